@@ -0,0 +1,207 @@
+"""
+Streaming parser for the free text diagnostics in fort.amr and run logs.
+
+Lines such as
+     Courant # of grid     6 level  3 is   0.7764D-03
+      294 points flagged on level    2
+    time t =  0.33907E+03,  total mass =  0.352534095896216E+16  diff = ...
+     Checkpoint file at time t =    14400.000000000000
+     alloc size memsize =      8000000
+     Number of steps taken =           50
+    AMRCLAW: level  1  CFL = .7502E+00  dt = 0.1234E+02  final t = ...
+are turned into typed records, dictionaries with a kind and the fields
+below, which can be written as JSON lines or gathered in a numpy record
+array.  The level 1 step number and the last time reported are attached
+to every record.  Lines that are not recognized are skipped.
+
+To use interactively:
+    >>> import amrlog
+    >>> records = list(amrlog.parse_file('_output/fort.amr'))
+    >>> a = amrlog.to_array(records)
+    >>> a[a['kind'] == 'courant']['courant'].max()
+
+To write JSON lines, or follow a file while a run is in progress:
+    $ python amrlog.py _output/fort.amr > amr.jsonl
+    $ python amrlog.py _output/fort.amr follow
+
+"""
+
+import os, re, sys, time, json
+import numpy as np
+
+_number = r'([-+]?[0-9]*\.?[0-9]+(?:[EeDd][-+]?[0-9]+)?)'
+
+patterns = [
+    ('courant', re.compile(r'Courant # of grid\s+(\d+)\s+level\s+(\d+)\s+is\s+'
+                           + _number), ['grid', 'level', 'courant']),
+    ('flagged', re.compile(r'^\s*(\d+)\s+points flagged on level\s+(\d+)'),
+                ['npts', 'level']),
+    ('projected', re.compile(r'^\s*(\d+)\s+more pts\. projected to level\s+(\d+)'),
+                ['npts', 'level']),
+    ('time', re.compile(r'time t =\s*' + _number + r',\s*total mass =\s*'
+                        + _number + r'\s*diff =\s*' + _number),
+             ['t', 'mass', 'massdiff']),
+    ('require', re.compile(r'require\s+(\d+)\s+words'), ['words']),
+    ('space', re.compile(r'(current|maximum)\s+space usage =\s*(\d+)'),
+              ['which', 'words']),
+    ('cells', re.compile(r'# cells advanced on level\s+(\d+)\s*=\s*' + _number),
+              ['level', 'cells']),
+    ('checkpoint', re.compile(r'Checkpoint file at time t =\s*' + _number),
+                   ['t']),
+    ('memsize', re.compile(r'memsize =\s*(\d+)'), ['words']),
+    ('steps', re.compile(r'Number of steps taken =\s*(\d+)'), ['nsteps']),
+    ('cfl_dt', re.compile(r'AMRCLAW: level\s+(\d+)\s+CFL\s*=\s*' + _number
+                          + r'\s+dt\s*=\s*' + _number
+                          + r'(?:\s+final t\s*=\s*' + _number + ')?'),
+               ['level', 'courant', 'dt', 't']),
+    ]
+
+_int_fields = ['grid', 'level', 'npts', 'words', 'nsteps']
+
+record_dtype = np.dtype([('kind', 'S16'), ('step', 'i4'), ('t', 'f8'),
+                         ('level', 'i4'), ('grid', 'i4'), ('courant', 'f8'),
+                         ('npts', 'i8'), ('dt', 'f8'), ('words', 'i8'),
+                         ('cells', 'f8'), ('mass', 'f8'), ('massdiff', 'f8'),
+                         ('nsteps', 'i8')])
+
+
+def _value(field, text):
+    if field == 'which':
+        return text
+    if text is None:
+        return None
+    if field in _int_fields:
+        return int(text)
+    return float(text.replace('D', 'E').replace('d', 'e'))
+
+
+class AmrLogParser(object):
+    """
+    Turns lines into records, keeping track of the level 1 step number
+    and of the last time reported.
+    """
+
+    def __init__(self):
+        self.step = 0
+        self.t = 0.
+        self._last_kind = None
+        self._last_level = None
+
+    def parse_line(self, line):
+        """
+        Return the record for line, or None if it is not recognized.
+        """
+        for kind, pattern, fields in patterns:
+            match = pattern.search(line)
+            if match is None:
+                continue
+            record = {'kind': kind}
+            for field, text in zip(fields, match.groups()):
+                value = _value(field, text)
+                if value is not None:
+                    record[field] = value
+            if kind == 'space':
+                record['kind'] = record.pop('which') + '_space'
+            # a new level 1 step starts with the first level 1 Courant line:
+            if kind in ['courant', 'cfl_dt'] and record['level'] == 1 and \
+                    not (self._last_kind == kind and self._last_level == 1):
+                self.step += 1
+            if 't' in record:
+                self.t = record['t']
+            self._last_kind = kind
+            self._last_level = record.get('level')
+            record['step'] = self.step
+            record.setdefault('t', self.t)
+            return record
+        return None
+
+
+def parse_lines(lines, parser=None):
+    """
+    Generator of the records in an iterable of lines.
+    """
+    if parser is None:
+        parser = AmrLogParser()
+    for line in lines:
+        record = parser.parse_line(line)
+        if record is not None:
+            yield record
+
+
+def parse_file(fname):
+    """
+    Generator of the records in the file fname.
+    """
+    f = open(fname)
+    try:
+        for record in parse_lines(f):
+            yield record
+    finally:
+        f.close()
+
+
+def follow(fname, interval=5., maxidle=600.):
+    """
+    Generator of the records of fname as lines are appended to it, for a
+    run in progress.  Stops when the file has not grown for maxidle seconds.
+    """
+    parser = AmrLogParser()
+    offset = 0
+    partial = ''
+    idle = 0.
+    while idle < maxidle:
+        if os.path.exists(fname) and os.path.getsize(fname) > offset:
+            f = open(fname)
+            f.seek(offset)
+            text = partial + f.read()
+            offset = f.tell()
+            f.close()
+            lines = text.split('\n')
+            # the last piece may be a line still being written:
+            partial = lines.pop()
+            for record in parse_lines(lines, parser):
+                yield record
+            idle = 0.
+        else:
+            idle += interval
+            time.sleep(interval)
+
+
+def to_array(records):
+    """
+    Numpy record array with dtype record_dtype, fields that do not apply
+    to a kind of record are 0 (or nan for floats).
+    """
+    records = list(records)
+    a = np.zeros(len(records), dtype=record_dtype)
+    for name in record_dtype.names:
+        if record_dtype[name].kind == 'f':
+            a[name] = np.nan
+    for k, record in enumerate(records):
+        for name, value in record.items():
+            if name in record_dtype.names:
+                a[k][name] = value
+    return a
+
+
+def write_jsonl(records, f=sys.stdout):
+    """
+    Write each record as one line of JSON to the open file f.
+    """
+    for record in records:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Usage: python amrlog.py fort.amr [follow]"
+        sys.exit(1)
+    fname = sys.argv[1]
+    if len(sys.argv) > 2 and sys.argv[2] == 'follow':
+        records = follow(fname)
+    else:
+        records = parse_file(fname)
+    try:
+        write_jsonl(records)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,281 @@
+"""
+AMR workload profile of a run from the grid headers of its output frames.
+
+For every frame the grid headers (read with frameindex.py, no patch data)
+give the number of cells on each level.  A cell on level L is advanced
+prod(tratio[0:L-1]) times per level 1 step, where tratio are the time
+refinement ratios inratt (or inratx when
+geodata.variable_dt_refinement_ratios is set, since the time ratios then
+follow the space ratios for a CFL limited step), so the cell-updates per
+level over each output interval are estimated from the number of level 1
+steps in fort.amr.
+
+Each patch on level L > 1 is attributed to the innermost regions of
+setregions.data active at that time that intersect it and allow level L
+(maxlevel >= L), split by their overlap with the patch, or to no region
+if none does.  For each gauge
+the finest level covering it and the cell-updates of the patches that
+contain it are reported too.
+
+To use:
+    $ python amrprofile.py _output
+which prints the tables and saves the plot amrprofile.png.
+
+"""
+
+import os, sys
+import numpy as np
+
+import frameindex
+
+
+def read_datafile(fname):
+    """
+    Return a dictionary mapping name to the list of value strings for each
+    line "values =: name" of a data file written by setrun.py.
+    """
+    values = {}
+    for line in open(fname):
+        if '=:' in line:
+            tokens, name = line.split('=:', 1)
+            values[name.split()[0]] = tokens.split()
+    return values
+
+
+def read_setregions(outdir='_output'):
+    """
+    Return the regions of setregions.data as a list of
+    [minlevel,maxlevel,t1,t2,x1,x2,y1,y2].
+    """
+    lines = [line for line in open(os.path.join(outdir, 'setregions.data'))
+             if line.strip() and not line.startswith('#')]
+    nregions = int(lines[0].split()[0])
+    return [[float(v) for v in line.split()]
+            for line in lines[1:nregions+1]]
+
+
+def time_ratios(outdir='_output'):
+    """
+    Return (mxnest, space ratios, time ratios, variable_dt) for the run.
+    """
+    amr = read_datafile(os.path.join(outdir, 'amr2ez.data'))
+    mxnest = abs(int(amr['mxnest'][0]))
+    inratx = [int(r) for r in amr['inratx']]
+    inratt = [int(r) for r in amr.get('inratt', ['1']*len(inratx))]
+    variable_dt = False
+    geo_fname = os.path.join(outdir, 'setgeo.data')
+    if os.path.exists(geo_fname):
+        geo = read_datafile(geo_fname)
+        variable_dt = geo.get('variable_dt_refinement_ratios',
+                              ['F'])[0].upper().startswith('T')
+    if variable_dt:
+        tratio = inratx
+    else:
+        tratio = inratt
+    return mxnest, inratx, tratio[:max(mxnest-1, 0)], variable_dt
+
+
+def level1_steps(outdir='_output'):
+    """
+    Return the number of level 1 time steps in fort.amr and the last time
+    reported there, or (None, None) if fort.amr is not available.
+    """
+    import amrlog
+    fname = os.path.join(outdir, 'fort.amr')
+    if not os.path.exists(fname):
+        return None, None
+    nsteps, tlast = 0, None
+    for record in amrlog.parse_file(fname):
+        nsteps = record['step']
+        tlast = record['t']
+    return nsteps, tlast
+
+
+def attribute_patch(row, regions, t):
+    """
+    Return an array with, for each region, the number of cells of the patch
+    described by index row attributed to it, and the number attributed to
+    no region (last entry).
+
+    The regions that qualify are those active at t that allow the level of
+    the patch and intersect it.  Of these only the innermost ones, that do
+    not contain another qualifying region, are credited, in proportion to
+    their overlap with the patch; patches are much larger than the small
+    regions that force them, so cell centers would mostly miss them.
+    """
+    level = int(row['level'])
+    xlow, ylow = row['xlow'], row['ylow']
+    xhi = xlow + row['mx']*row['dx']
+    yhi = ylow + row['my']*row['dy']
+    counts = np.zeros(len(regions) + 1)
+    overlap = {}
+    for k, (minlevel, maxlevel, t1, t2, x1, x2, y1, y2) in enumerate(regions):
+        if not (t1 <= t <= t2 and maxlevel >= level):
+            continue
+        wx = min(x2, xhi) - max(x1, xlow)
+        wy = min(y2, yhi) - max(y1, ylow)
+        if wx > 0 and wy > 0:
+            overlap[k] = wx*wy
+    innermost = []
+    for k in overlap:
+        x1, x2, y1, y2 = regions[k][4:8]
+        inner = [j for j in overlap if regions[j][4:8] != regions[k][4:8] and
+                 x1 <= regions[j][4] and regions[j][5] <= x2 and
+                 y1 <= regions[j][6] and regions[j][7] <= y2]
+        if not inner:
+            innermost.append(k)
+    ncells = float(row['mx']*row['my'])
+    if not innermost:
+        counts[-1] = ncells
+        return counts
+    total = sum(overlap[k] for k in innermost)
+    for k in innermost:
+        counts[k] = ncells*overlap[k]/total
+    return counts
+
+
+def profile(outdir='_output'):
+    """
+    Compute the profile of the run in outdir.  Returns a dictionary with
+        times:          time of each frame
+        cells:          cells per level, shape (nframes, mxnest)
+        updates:        estimated cell-updates per level over the interval
+                        ending at each frame, shape (nframes, mxnest)
+        region_updates: cell-updates attributed to each region (and to no
+                        region, last column), shape (nframes, nregions+1)
+        gauge_level:    finest level at each gauge, shape (nframes, ngauges)
+        gauge_updates:  cell-updates of the patches containing each gauge
+    """
+    import gaugestore
+    mxnest, inratx, tratio, variable_dt = time_ratios(outdir)
+    steps_per_level = np.cumprod([1] + list(tratio))[:mxnest]
+    regions = read_setregions(outdir)
+    try:
+        gauges = gaugestore.read_setgauges(outdir)
+    except IOError:
+        gauges = {}
+    gaugenos = sorted(gauges.keys())
+    gx = np.array([gauges[g][0] for g in gaugenos])
+    gy = np.array([gauges[g][1] for g in gaugenos])
+
+    framenos = frameindex.framenos(outdir)
+    times = np.array([frameindex.read_tfile(n, outdir)['time']
+                      for n in framenos])
+    nsteps, tlast = level1_steps(outdir)
+    if nsteps and tlast is not None and tlast > times[0]:
+        steps_per_time = nsteps/(tlast - times[0])
+    else:
+        steps_per_time = None
+
+    nframes = len(framenos)
+    cells = np.zeros((nframes, mxnest))
+    updates = np.zeros((nframes, mxnest))
+    region_updates = np.zeros((nframes, len(regions) + 1))
+    gauge_level = np.zeros((nframes, len(gaugenos)), dtype=int)
+    gauge_updates = np.zeros((nframes, len(gaugenos)))
+    for k, frameno in enumerate(framenos):
+        index = frameindex.load_index(frameindex.frame_fname(frameno, outdir))
+        if k == 0 or steps_per_time is None:
+            nsteps_k = 1.
+        else:
+            nsteps_k = steps_per_time*(times[k] - times[k-1])
+        for row in index:
+            level = int(row['level'])
+            ncells = float(row['mx']*row['my'])
+            weight = steps_per_level[level-1]*nsteps_k
+            cells[k, level-1] += ncells
+            updates[k, level-1] += ncells*weight
+            if level > 1:
+                region_updates[k] += attribute_patch(row, regions,
+                                                     times[k])*weight
+            xhi = row['xlow'] + row['mx']*row['dx']
+            yhi = row['ylow'] + row['my']*row['dy']
+            inside = (gx >= row['xlow']) & (gx <= xhi) & \
+                     (gy >= row['ylow']) & (gy <= yhi)
+            gauge_updates[k, inside] += ncells*weight
+            gauge_level[k, inside] = np.maximum(gauge_level[k, inside], level)
+
+    return {'framenos': framenos, 'times': times, 'cells': cells,
+            'updates': updates, 'regions': regions,
+            'region_updates': region_updates, 'gaugenos': gaugenos,
+            'gauge_level': gauge_level, 'gauge_updates': gauge_updates,
+            'steps_per_level': steps_per_level, 'variable_dt': variable_dt,
+            'nsteps': nsteps}
+
+
+def print_tables(prof, f=sys.stdout):
+    mxnest = prof['cells'].shape[1]
+    f.write("Cells and estimated cell-updates per level\n")
+    f.write("(level 1 steps in fort.amr: %s, level steps per level 1 step: %s%s)\n"
+            % (prof['nsteps'], list(prof['steps_per_level']),
+               ', from inratx since variable_dt_refinement_ratios'
+               if prof['variable_dt'] else ''))
+    f.write('%6s %12s' % ('frame', 't'))
+    for level in range(1, mxnest+1):
+        f.write(' %12s' % ('cells L%s' % level))
+    f.write(' %14s\n' % 'updates')
+    for k, frameno in enumerate(prof['framenos']):
+        f.write('%6s %12.2f' % (frameno, prof['times'][k]))
+        for level in range(mxnest):
+            f.write(' %12d' % prof['cells'][k, level])
+        f.write(' %14.4e\n' % prof['updates'][k].sum())
+    total = prof['updates'].sum(axis=0)
+    f.write('\nTotal cell-updates per level:\n')
+    for level in range(mxnest):
+        f.write('  level %s: %14.4e  (%5.1f%%)\n'
+                % (level+1, total[level],
+                   100.*total[level]/max(total.sum(), 1.)))
+
+    f.write('\nCell-updates on levels > 1 attributed to regions:\n')
+    region_total = prof['region_updates'].sum(axis=0)
+    for k, region in enumerate(prof['regions']):
+        f.write('  region %s %s: %14.4e  (%5.1f%%)\n'
+                % (k+1, region, region_total[k],
+                   100.*region_total[k]/max(region_total.sum(), 1.)))
+    f.write('  no region:  %14.4e\n' % region_total[-1])
+
+    f.write('\nGauges: finest level at last frame, cell-updates of covering patches\n')
+    for j, gaugeno in enumerate(prof['gaugenos']):
+        f.write('  gauge %4s: level %s  %14.4e\n'
+                % (gaugeno, prof['gauge_level'][-1, j],
+                   prof['gauge_updates'][:, j].sum()))
+
+
+def plot_profile(prof, fname='amrprofile.png'):
+    import matplotlib
+    matplotlib.use('Agg')
+    import pylab
+    pylab.figure(figsize=(12, 5))
+    pylab.subplot(1, 2, 1)
+    bottom = np.zeros(len(prof['times']))
+    for level in range(prof['updates'].shape[1]):
+        pylab.bar(np.arange(len(prof['times'])), prof['updates'][:, level],
+                  bottom=bottom, label='level %s' % (level+1))
+        bottom += prof['updates'][:, level]
+    pylab.xticks(np.arange(len(prof['times'])), prof['framenos'])
+    pylab.xlabel('frame')
+    pylab.ylabel('cell-updates')
+    pylab.legend(loc='upper left')
+    pylab.title('Cell-updates per output interval')
+
+    pylab.subplot(1, 2, 2)
+    region_total = prof['region_updates'].sum(axis=0)
+    labels = ['%s' % (k+1) for k in range(len(prof['regions']))] + ['none']
+    pylab.bar(np.arange(len(region_total)), region_total)
+    pylab.xticks(np.arange(len(region_total)), labels)
+    pylab.xlabel('region')
+    pylab.title('Cell-updates on levels > 1 by region')
+    pylab.savefig(fname)
+    print "Saved %s" % fname
+
+
+if __name__ == '__main__':
+    outdir = '_output'
+    if len(sys.argv) > 1:
+        outdir = sys.argv[1]
+    prof = profile(outdir)
+    print_tables(prof)
+    try:
+        plot_profile(prof)
+    except ImportError:
+        print "*** matplotlib not available, no plot made"
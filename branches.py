@@ -0,0 +1,277 @@
+"""
+Run many variants of setrun.py that only differ after time t_fork as one
+shared prefix and a short restarted tail per variant.
+
+The prefix is the run of setrun.py up to t_fork, with the output times of
+setrun.py before t_fork and t_fork itself, in rundir/prefix.  xgeoclaw
+checkpoints at the end of a run (fort.chkNNNN, with its time in
+fort.tckNNNN), so each branch, a row of a table as in scenarios.py, is
+written to rundir/name with restart set, its output times after t_fork
+and the checkpoint linked as restart.data, and the branches are run at
+most nprocs at a time.  The prefix is not run again while its data files
+are unchanged and its checkpoint is at t_fork.
+
+Afterwards rundir/name/_combined is made with links to the frames of the
+prefix and, renumbered to follow them, those of the branch, and with a
+fort.gauge of the prefix lines up to t_fork and the branch lines after,
+so it can be plotted like a complete run.  Fixed grid output is linked as
+the branch wrote it.  The output of an earlier run of a branch, fixed
+grids included, is removed when its data files are written again.
+
+Only parameters that do not matter before t_fork should be changed in the
+branches, e.g. geodata.coeffmanning, geodata.frictiondepth or regions
+whose time window starts after t_fork; the topo, dtopo and qinit files
+cannot be.
+
+To use:
+    $ python branches.py branches.csv 7200          # only write the data
+    $ python branches.py branches.csv 7200 run 4    # and run 4 at a time
+
+"""
+
+import os, sys, re, glob, imp, shutil
+import numpy as np
+
+import scenarios
+
+# parameters that change the run before any t_fork:
+prefix_parameters = ['geodata.topofiles', 'geodata.dtopofiles',
+                     'geodata.qinitfiles', 'clawdata.t0']
+
+
+def output_times(clawdata):
+    """
+    Output times after t0 of clawdata for outstyle 1 or 2.
+    """
+    if clawdata.outstyle == 1:
+        return list(np.linspace(clawdata.t0, clawdata.tfinal,
+                                clawdata.nout + 1)[1:])
+    elif clawdata.outstyle == 2:
+        return list(clawdata.tout)
+    raise ValueError("outstyle %s is not supported, use 1 or 2"
+                     % clawdata.outstyle)
+
+
+def set_output_times(clawdata, times):
+    clawdata.outstyle = 2
+    clawdata.tout = list(times)
+    clawdata.nout = len(times)
+    clawdata.tfinal = times[-1]
+
+
+def prefix_rundata(rundata, t_fork):
+    """
+    Set rundata to run up to t_fork, with its output times before.
+    """
+    times = [t for t in output_times(rundata.clawdata) if t < t_fork]
+    set_output_times(rundata.clawdata, times + [t_fork])
+    rundata.clawdata.restart = False
+    return rundata
+
+
+def branch_rundata(rundata, scenario, t_fork):
+    """
+    Apply the overrides of scenario to rundata and set it to restart at
+    t_fork, with its output times after.
+    """
+    for key in prefix_parameters:
+        if scenario.get(key, '') != '':
+            raise ValueError("Branch %s changes %s, which is used before "
+                             "t_fork" % (scenario['name'], key))
+    rundata = scenarios.apply_overrides(rundata, scenario)
+    times = [t for t in output_times(rundata.clawdata) if t > t_fork]
+    if not times:
+        raise ValueError("Branch %s has no output times after %s"
+                         % (scenario['name'], t_fork))
+    set_output_times(rundata.clawdata, times)
+    rundata.clawdata.restart = True
+    return rundata
+
+
+def last_checkpoint(rundir):
+    """
+    Return (time, name of the fort.chkNNNN file) of the last checkpoint
+    in rundir, or None.
+    """
+    checkpoints = []
+    for fname in glob.glob(os.path.join(rundir, 'fort.tck[0-9]*')):
+        text = open(fname).read()
+        match = re.search(r'time t\s*=\s*(\S+)', text)
+        chkname = fname.replace('fort.tck', 'fort.chk')
+        if match is None or not os.path.exists(chkname):
+            continue
+        checkpoints.append((int(fname[-4:]),
+                            float(match.group(1).replace('D', 'E')), chkname))
+    if not checkpoints:
+        return None
+    step, t, chkname = max(checkpoints)
+    return t, chkname
+
+
+def frame_times(rundir):
+    """
+    Dictionary of frame number to time of the fort.tNNNN files in rundir.
+    """
+    import frameindex
+    times = {}
+    for fname in glob.glob(os.path.join(rundir, 'fort.t[0-9][0-9][0-9][0-9]')):
+        frameno = int(fname[-4:])
+        times[frameno] = frameindex.read_tfile(frameno, rundir)['time']
+    return times
+
+
+def output_files(rundir):
+    """
+    Frames, gauge and fixed grid output and frame indexes of a run in
+    rundir.
+    """
+    fnames = []
+    for pattern in ['fort.q[0-9][0-9][0-9][0-9]', 'fort.t[0-9][0-9][0-9][0-9]',
+                    'fort.gauge', 'fort.gauge.npz', 'fort.fg*', '*.idx.npy']:
+        fnames += glob.glob(os.path.join(rundir, pattern))
+    return fnames
+
+
+def combine_output(prefix_dir, branch_dir, t_fork, tol=1.e-6):
+    """
+    Make branch_dir/_combined with links to the frames of prefix_dir up to
+    t_fork followed by those of branch_dir after it, renumbered, to the
+    *.data and fixed grid files of the branch, and a fort.gauge of the
+    prefix lines up to t_fork and the branch lines after.  The output of
+    the prefix and of the branch is not changed.  Returns the directory
+    and the number of frames.
+    """
+    combined_dir = os.path.join(branch_dir, '_combined')
+    if os.path.isdir(combined_dir):
+        shutil.rmtree(combined_dir)
+    os.makedirs(combined_dir)
+    prefix_times = frame_times(prefix_dir)
+    branch_times = frame_times(branch_dir)
+    frames = [(prefix_dir, f) for f in sorted(prefix_times)
+              if prefix_times[f] <= t_fork + tol]
+    frames += [(branch_dir, f) for f in sorted(branch_times)
+               if branch_times[f] > t_fork + tol]
+    for k, (rundir, frameno) in enumerate(frames):
+        for prefix in ['fort.q', 'fort.t']:
+            source = os.path.join(rundir, prefix + str(frameno).zfill(4))
+            if os.path.exists(source):
+                os.symlink(os.path.abspath(source), os.path.join(
+                    combined_dir, prefix + str(k).zfill(4)))
+    for source in glob.glob(os.path.join(branch_dir, '*.data')) + \
+                  glob.glob(os.path.join(branch_dir, 'fort.fg*')):
+        if os.path.basename(source) != 'restart.data':
+            os.symlink(os.path.abspath(source), os.path.join(
+                combined_dir, os.path.basename(source)))
+
+    lines = []
+    for rundir, first in [(prefix_dir, True), (branch_dir, False)]:
+        fname = os.path.join(rundir, 'fort.gauge')
+        if not os.path.exists(fname):
+            continue
+        for line in open(fname):
+            tokens = line.split()
+            if len(tokens) != 7:
+                continue
+            before = float(tokens[2].replace('D', 'E')) <= t_fork + tol
+            if before == first:
+                lines.append(line)
+    open(os.path.join(combined_dir, 'fort.gauge'), 'w').writelines(lines)
+    return combined_dir, len(frames)
+
+
+def make_branches(table_fname, t_fork, setrun_file='setrun.py',
+                  rundir='_branches'):
+    """
+    Write the prefix and a directory per branch of the table in rundir.
+    Returns the prefix directory, the list of branch directories, and
+    True if the prefix has to be run.
+    """
+    setrun_module = imp.load_source('setrun_branches',
+                                    os.path.abspath(setrun_file))
+    basedir = os.path.dirname(os.path.abspath(setrun_file))
+    prefix_dir = os.path.join(rundir, 'prefix')
+    if not os.path.isdir(prefix_dir):
+        os.makedirs(prefix_dir)
+    rundata = prefix_rundata(setrun_module.setrun(), t_fork)
+    changed = scenarios.write_data(rundata, prefix_dir)
+    scenarios.link_inputs(rundata, prefix_dir, basedir)
+    checkpoint = last_checkpoint(prefix_dir)
+    run_prefix = bool(changed) or checkpoint is None or \
+                 abs(checkpoint[0] - t_fork) > 1.e-6
+    branch_dirs = []
+    for scenario in scenarios.read_table(table_fname):
+        branch_dir = os.path.join(rundir, scenario['name'])
+        if not os.path.isdir(branch_dir):
+            os.makedirs(branch_dir)
+        rundata = branch_rundata(setrun_module.setrun(), scenario, t_fork)
+        # output of an earlier run of the branch:
+        for fname in output_files(branch_dir):
+            os.remove(fname)
+        scenarios.write_data(rundata, branch_dir)
+        scenarios.link_inputs(rundata, branch_dir, basedir)
+        branch_dirs.append(branch_dir)
+        print "Created %s" % branch_dir
+    return prefix_dir, branch_dirs, run_prefix
+
+
+def link_checkpoint(prefix_dir, branch_dirs):
+    """
+    Link the last checkpoint of prefix_dir as restart.data into each of
+    branch_dirs.  Returns its time.
+    """
+    checkpoint = last_checkpoint(prefix_dir)
+    if checkpoint is None:
+        raise IOError("No checkpoint in %s" % prefix_dir)
+    t, chkname = checkpoint
+    for branch_dir in branch_dirs:
+        target = os.path.join(branch_dir, 'restart.data')
+        if os.path.lexists(target):
+            os.remove(target)
+        os.symlink(os.path.abspath(chkname), target)
+    return t
+
+
+def run_branches(table_fname, t_fork, setrun_file='setrun.py',
+                 rundir='_branches', nprocs=None, executable='xgeoclaw'):
+    """
+    Run the prefix if needed, then the branches of the table from its
+    checkpoint, and combine the output of each branch with the prefix.
+    Returns the results of scenarios.run_all for the branches.
+    """
+    prefix_dir, branch_dirs, run_prefix = make_branches(table_fname, t_fork,
+                                                        setrun_file, rundir)
+    if run_prefix:
+        print "Running the prefix up to t = %s" % t_fork
+        for fname in output_files(prefix_dir):
+            os.remove(fname)
+        status = scenarios.run_xgeoclaw(prefix_dir, executable)[1]
+        if status != 0:
+            raise RuntimeError("The prefix run in %s failed with status %s"
+                               % (prefix_dir, status))
+    t = link_checkpoint(prefix_dir, branch_dirs)
+    if abs(t - t_fork) > 1.e-6:
+        raise ValueError("The last checkpoint in %s is at t = %s, not %s"
+                         % (prefix_dir, t, t_fork))
+    results = scenarios.run_all(branch_dirs, nprocs, executable,
+                                summary=os.path.join(rundir, 'summary.csv'))
+    for branch_dir, status, seconds in results:
+        if status == 0:
+            combined_dir, nframes = combine_output(prefix_dir, branch_dir,
+                                                   t_fork)
+            print "%s: %s frames" % (combined_dir, nframes)
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "Usage: python branches.py table.csv t_fork [run [nprocs]]"
+        sys.exit(1)
+    table_fname = sys.argv[1]
+    t_fork = float(sys.argv[2])
+    if len(sys.argv) > 3 and sys.argv[3] == 'run':
+        nprocs = None
+        if len(sys.argv) > 4:
+            nprocs = int(sys.argv[4])
+        run_branches(table_fname, t_fork, nprocs=nprocs)
+    else:
+        make_branches(table_fname, t_fork)
@@ -0,0 +1,301 @@
+"""
+Maximum amplitude, arrival time and runup at points every ds meters along
+the coast, from the frames fort.qNNNN.
+
+The coast is the zero contour of a topo file (java.asc by default),
+traced into lines through the points where the topography changes sign
+between neighbouring points of the file (see trace_contours), and each
+line longer than ds is resampled every ds meters along its length, so the
+points follow each other along the coast.  Or it is a polyline given as a
+text file of lon, lat lines, resampled the same way.
+
+In each frame the finest grid covering each point is found by a search of
+the points sorted by longitude for each grid of the frame, coarsest level
+first, and the cells of that grid within search meters of the point in
+x and in y are looked at (at least the cell containing it, which is all
+there is where only a coarse grid covers the point):
+    eta_max     largest eta in the wet cells below sea level
+    arrival     first time |eta| exceeds arrival_tol in one of them
+    runup       largest eta in the wet cells above sea level (the highest
+                ground inundated near the point), nan if none
+and these are reduced over the frames, which are spread over a pool of
+processes.  Unlike gauges this only costs a look at the saved frames.
+
+To use:
+    $ python coastline.py _output 500             # coast of java.asc
+    $ python coastline.py _output 500 coast.txt   # along a polyline
+which writes coastline.csv with columns line, x, y, eta_max, arrival,
+runup, the points of each line in order, the longest line first.
+
+"""
+
+import sys, csv
+import numpy as np
+
+import frameindex
+
+drytol = 1.e-3
+arrival_tol = 1.e-2
+
+
+def read_polyline(fname):
+    """
+    Return arrays x, y of the lon, lat lines of fname.
+    """
+    data = np.loadtxt(fname, usecols=(0, 1), ndmin=2)
+    return data[:, 0], data[:, 1]
+
+
+def segment_lengths(x, y, Rearth=6367.5e3):
+    """
+    Lengths in meters of the segments of the polyline x, y on a sphere of
+    radius Rearth (config['Rearth'] of regioncheck.load_config).
+    """
+    deg2m = Rearth*np.pi/180.
+    dx = np.diff(x)*deg2m*np.cos(np.radians(0.5*(y[1:] + y[:-1])))
+    dy = np.diff(y)*deg2m
+    return np.sqrt(dx**2 + dy**2)
+
+
+def resample_polyline(x, y, ds, Rearth=6367.5e3):
+    """
+    Points every ds meters along the polyline x, y, including its ends.
+    """
+    s = np.concatenate(([0.], np.cumsum(segment_lengths(x, y, Rearth))))
+    si = np.linspace(0., s[-1], max(int(np.ceil(s[-1]/ds)), 1) + 1)
+    return np.interp(si, s, x), np.interp(si, s, y)
+
+
+def trace_contours(x, y, Z):
+    """
+    Polylines along which Z[j,i] at (x[i], y[j]) changes sign, as a list
+    of arrays (xs, ys), by marching squares: the crossings on the edges
+    between neighbouring points are placed by linear interpolation and
+    joined across each cell, and the joined crossings are followed from
+    the ends of open lines, then around closed ones.
+    """
+    land = Z >= 0.
+    ny, nx = Z.shape
+    # crossings on the edges along x, then along y:
+    hj, hi = np.where(land[:, 1:] != land[:, :-1])
+    vj, vi = np.where(land[1:, :] != land[:-1, :])
+    z0, z1 = Z[hj, hi], Z[hj, hi+1]
+    px = np.concatenate((x[hi] + z0/(z0 - z1)*(x[hi+1] - x[hi]), x[vi]))
+    z0, z1 = Z[vj, vi], Z[vj+1, vi]
+    py = np.concatenate((y[hj], y[vj] + z0/(z0 - z1)*(y[vj+1] - y[vj])))
+    hid = -np.ones((ny, nx-1), dtype=int)
+    hid[hj, hi] = np.arange(len(hj))
+    vid = -np.ones((ny-1, nx), dtype=int)
+    vid[vj, vi] = len(hj) + np.arange(len(vj))
+    # crossings on the bottom, right, top and left edges of each cell:
+    edges = np.array([hid[:-1, :], vid[:, 1:], hid[1:, :], vid[:, :-1]])
+    ncross = (edges >= 0).sum(axis=0)
+    # two crossings are joined:
+    segments = [np.sort(edges[:, ncross == 2], axis=0)[2:].T]
+    # four (a saddle): the corners are cut off so that the center, the
+    # mean of the corners, stays with the corners of its side:
+    bottom, right, top, left = edges[:, ncross == 4]
+    center = (Z[:-1, :-1] + Z[:-1, 1:] + Z[1:, :-1] + Z[1:, 1:])[ncross == 4]
+    ac = (center >= 0.) == land[:-1, :-1][ncross == 4]
+    segments.append(np.array([bottom, np.where(ac, right, left)]).T)
+    segments.append(np.array([top, np.where(ac, left, right)]).T)
+    neighbours = [[] for k in range(len(px))]
+    for a, b in np.vstack(segments):
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+
+    lines = []
+    visited = np.zeros(len(px), dtype=bool)
+    ends = [k for k in range(len(px)) if len(neighbours[k]) == 1]
+    for start in ends + range(len(px)):
+        if visited[start]:
+            continue
+        line = [start]
+        visited[start] = True
+        while True:
+            unvisited = [k for k in neighbours[line[-1]] if not visited[k]]
+            if not unvisited:
+                break
+            line.append(unvisited[0])
+            visited[unvisited[0]] = True
+        if start in neighbours[line[-1]] and len(line) > 2:
+            line.append(start)              # closed
+        lines.append((px[line], py[line]))
+    return lines
+
+
+def coast_lines(topofile='java.asc', ds=500., topotype=3, bbox=None,
+                min_length=None, Rearth=6367.5e3):
+    """
+    The zero contours of topofile inside bbox = [x1, x2, y1, y2] if given,
+    each resampled every ds meters, longest first, as a list of (x, y).
+    Contours shorter than min_length (ds if None) are dropped.
+    """
+    import traveltime
+    x, y, h = traveltime.topo_grid(topofile, topotype)
+    if bbox is not None:
+        ix = np.where((x >= bbox[0]) & (x <= bbox[1]))[0]
+        iy = np.where((y >= bbox[2]) & (y <= bbox[3]))[0]
+        x, y, h = x[ix], y[iy], h[iy[0]:iy[-1]+1, ix[0]:ix[-1]+1]
+    if min_length is None:
+        min_length = ds
+    lines = []
+    for lx, ly in trace_contours(x, y, -h):
+        length = segment_lengths(lx, ly, Rearth).sum()
+        if length >= min_length:
+            rx, ry = resample_polyline(lx, ly, ds, Rearth)
+            if lx[0] == lx[-1] and ly[0] == ly[-1]:
+                # closed, the first point only once:
+                rx, ry = rx[:-1], ry[:-1]
+            lines.append((length, (rx, ry)))
+    lines.sort(key=lambda line: -line[0])
+    return [line for length, line in lines]
+
+
+def coast_points(topofile='java.asc', ds=500., topotype=3, bbox=None,
+                 min_length=None, Rearth=6367.5e3):
+    """
+    Points every ds meters along the coast lines of coast_lines(), in
+    order along each line, and the number of the line of each point.
+    """
+    lines = coast_lines(topofile, ds, topotype, bbox, min_length, Rearth)
+    px = np.concatenate([lx for lx, ly in lines])
+    py = np.concatenate([ly for lx, ly in lines])
+    line = np.concatenate([k*np.ones(len(lx), dtype=int)
+                           for k, (lx, ly) in enumerate(lines)])
+    return px, py, line
+
+
+def locate(index, px, py):
+    """
+    For each point px, py the row of index of the finest grid covering it,
+    -1 where none does.
+    """
+    order = np.argsort(px, kind='mergesort')
+    xs = px[order]
+    best = -np.ones(len(px), dtype=int)
+    rows = np.argsort(index, order=['level', 'gridno'])
+    for k in rows:
+        row = index[k]
+        lo = np.searchsorted(xs, row['xlow'])
+        hi = np.searchsorted(xs, row['xlow'] + row['mx']*row['dx'],
+                             side='right')
+        if lo == hi:
+            continue
+        candidates = order[lo:hi]
+        y = py[candidates]
+        inside = (y >= row['ylow']) & (y <= row['ylow'] + row['my']*row['dy'])
+        best[candidates[inside]] = k
+    return best
+
+
+def frame_values(frame, px, py, search=1000., Rearth=6367.5e3):
+    """
+    eta_max, runup and a boolean array arrived at the points px, py in
+    frame (an IndexedFrame), see the module docstring.
+    """
+    deg2m = Rearth*np.pi/180.
+    n = len(px)
+    eta_max = -np.inf*np.ones(n)
+    runup = -np.inf*np.ones(n)
+    arrived = np.zeros(n, dtype=bool)
+    best = locate(frame.index, px, py)
+    f = open(frame.fname, 'rb')
+    try:
+        for k in np.unique(best[best >= 0]):
+            row = frame.index[k]
+            points = np.where(best == k)[0]
+            mx, my = int(row['mx']), int(row['my'])
+            coslat = np.cos(np.radians(row['ylow'] + 0.5*my*row['dy']))
+            nx = int(search/(row['dx']*deg2m*coslat))
+            ny = int(search/(row['dy']*deg2m))
+            q = frame.read_q(row, f)
+            i = np.floor((px[points] - row['xlow'])/row['dx']).astype(int)
+            j = np.floor((py[points] - row['ylow'])/row['dy']).astype(int)
+            I = np.clip(i[:, np.newaxis, np.newaxis]
+                        + np.arange(-nx, nx + 1)[np.newaxis, :, np.newaxis],
+                        0, mx - 1)
+            J = np.clip(j[:, np.newaxis, np.newaxis]
+                        + np.arange(-ny, ny + 1)[np.newaxis, np.newaxis, :],
+                        0, my - 1)
+            cells = q[I, J].reshape((len(points), -1, q.shape[2]))
+            h, eta = cells[:, :, 0], cells[:, :, -1]
+            wet = h > drytol
+            sea = wet & (eta - h < 0.)
+            land = wet & ~sea
+            eta_max[points] = np.where(sea, eta, -np.inf).max(axis=1)
+            runup[points] = np.where(land, eta, -np.inf).max(axis=1)
+            arrived[points] = (sea & (np.abs(eta) > arrival_tol)).any(axis=1)
+    finally:
+        f.close()
+    return eta_max, runup, arrived
+
+
+def _frame_worker(args):
+    # Values of one frame, with its time.
+    outdir, frameno, px, py, search, Rearth = args
+    frame = frameindex.IndexedFrame(frameno, outdir)
+    return (frame.t,) + frame_values(frame, px, py, search, Rearth)
+
+
+def extract(outdir, px, py, framenos=None, nprocs=None, search=1000.,
+            Rearth=6367.5e3):
+    """
+    Return eta_max, arrival and runup at the points px, py over the frames
+    framenos (all if None) of outdir, nan where never set.
+    """
+    from multiprocessing import Pool
+    if framenos is None:
+        framenos = frameindex.framenos(outdir)
+    work = [(outdir, frameno, px, py, search, Rearth)
+            for frameno in framenos]
+    if nprocs == 1:
+        results = map(_frame_worker, work)
+    else:
+        pool = Pool(nprocs)
+        try:
+            results = pool.map(_frame_worker, work)
+        finally:
+            pool.close()
+            pool.join()
+    eta_max = -np.inf*np.ones(len(px))
+    runup = -np.inf*np.ones(len(px))
+    arrival = np.inf*np.ones(len(px))
+    for t, frame_eta, frame_runup, arrived in results:
+        eta_max = np.maximum(eta_max, frame_eta)
+        runup = np.maximum(runup, frame_runup)
+        arrival[arrived] = np.minimum(arrival[arrived], t)
+    for values in (eta_max, runup, arrival):
+        values[np.isinf(values)] = np.nan
+    return eta_max, arrival, runup
+
+
+def write_csv(fname, line, px, py, eta_max, arrival, runup):
+    writer = csv.writer(open(fname, 'w'))
+    writer.writerow(['line', 'x', 'y', 'eta_max', 'arrival', 'runup'])
+    for row in zip(line, px, py, eta_max, arrival, runup):
+        writer.writerow([row[0], '%.5f' % row[1], '%.5f' % row[2]] +
+                        ['%.4g' % v for v in row[3:]])
+
+
+if __name__ == '__main__':
+    import regioncheck
+    outdir = '_output'
+    ds = 500.
+    if len(sys.argv) > 1:
+        outdir = sys.argv[1]
+    if len(sys.argv) > 2:
+        ds = float(sys.argv[2])
+    Rearth = regioncheck.load_config(outdir)['Rearth']
+    if len(sys.argv) > 3:
+        x, y = read_polyline(sys.argv[3])
+        px, py = resample_polyline(x, y, ds, Rearth)
+        line = np.zeros(len(px), dtype=int)
+    else:
+        px, py, line = coast_points('java.asc', ds, Rearth=Rearth)
+    print "Extracting at %s points" % len(px)
+    eta_max, arrival, runup = extract(outdir, px, py, Rearth=Rearth)
+    write_csv('coastline.csv', line, px, py, eta_max, arrival, runup)
+    print "Largest eta %.2f m, largest runup %.2f m" \
+          % (np.nanmax(eta_max), np.nanmax(runup))
+    print "Written to coastline.csv"
@@ -0,0 +1,117 @@
+"""
+Write the *.data files of a rundata object only where they changed.
+
+rundata.write() rewrites every data file, which updates their modification
+times even when the contents are identical.  write_changed() lets rundata
+write into a scratch directory, compares the SHA-1 hash of each file with
+the hash stored in .data_sha1 for the file in the target directory, and
+only replaces files whose contents differ, so unchanged files keep their
+modification times.
+
+To use in setrun.py:
+    >>> import datawrite
+    >>> changed = datawrite.write_changed(rundata)
+
+The Makefile makes the .data stamp with
+    $ python datawrite.py setrun.py .data
+which runs setrun.py and only touches the stamp when a data file changed
+(or the stamp is missing), so make .output does not rerun xgeoclaw after
+setrun.py was edited without changing the data.
+
+"""
+
+import os, sys, shutil, tempfile, hashlib
+
+manifest_fname = '.data_sha1'
+
+
+def content_hash(fname):
+    return hashlib.sha1(open(fname, 'rb').read()).hexdigest()
+
+
+def read_manifest(datadir='.'):
+    """
+    Return the dictionary of file name to hash stored in datadir.
+    """
+    hashes = {}
+    fname = os.path.join(datadir, manifest_fname)
+    if os.path.exists(fname):
+        for line in open(fname):
+            tokens = line.split()
+            if len(tokens) == 2:
+                hashes[tokens[1]] = tokens[0]
+    return hashes
+
+
+def write_manifest(hashes, datadir='.'):
+    f = open(os.path.join(datadir, manifest_fname), 'w')
+    for name in sorted(hashes.keys()):
+        f.write('%s  %s\n' % (hashes[name], name))
+    f.close()
+
+
+def write_changed(rundata, datadir='.', verbose=True):
+    """
+    Write the data files of rundata into datadir, replacing only the files
+    whose contents changed.  Returns the list of files written.
+    """
+    datadir = os.path.abspath(datadir)
+    scratch = tempfile.mkdtemp(prefix='rundata_')
+    cwd = os.getcwd()
+    try:
+        os.chdir(scratch)
+        rundata.write()
+        os.chdir(cwd)
+        hashes = read_manifest(datadir)
+        manifest = os.path.join(datadir, manifest_fname)
+        if os.path.exists(manifest):
+            manifest_mtime = os.path.getmtime(manifest)
+        else:
+            manifest_mtime = None
+        changed = []
+        for name in sorted(os.listdir(scratch)):
+            new_hash = content_hash(os.path.join(scratch, name))
+            target = os.path.join(datadir, name)
+            if os.path.exists(target):
+                old_hash = hashes.get(name)
+                # a file edited since the manifest was written is rehashed:
+                if old_hash is None or manifest_mtime is None or \
+                        os.path.getmtime(target) > manifest_mtime:
+                    old_hash = content_hash(target)
+                if old_hash == new_hash:
+                    hashes[name] = new_hash
+                    continue
+            shutil.copyfile(os.path.join(scratch, name), target)
+            hashes[name] = new_hash
+            changed.append(name)
+        write_manifest(hashes, datadir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if verbose:
+        if changed:
+            print "Data files changed: %s" % ' '.join(changed)
+        else:
+            print "Data files unchanged"
+    return changed
+
+
+def touch(fname):
+    open(fname, 'a').close()
+    os.utime(fname, None)
+
+
+if __name__ == '__main__':
+    import imp
+    setrun_file = 'setrun.py'
+    stamp = '.data'
+    if len(sys.argv) > 1:
+        setrun_file = sys.argv[1]
+    if len(sys.argv) > 2:
+        stamp = sys.argv[2]
+    setrun_module = imp.load_source('setrun_datawrite',
+                                    os.path.abspath(setrun_file))
+    changed = write_changed(setrun_module.setrun())
+    if changed or not os.path.exists(stamp):
+        touch(stamp)
@@ -0,0 +1,263 @@
+"""
+Exceedance probabilities of a fixed grid over an ensemble of scenarios.
+
+For each scenario the largest value over the run of a quantity on fixed
+grid fgno is read once:
+    inundation      the largest flow depth etamax - B on land (B > 0) and
+                    the largest surface etamax offshore
+    etamax          the largest surface
+from the etamax column of the last fort.fgNN_NNNN file when the fixed
+grid has ioutsurfacemax set, and from the h and eta columns of all its
+frames otherwise.  With a weight w for each scenario (e.g. its annual
+rate or probability), each cell accumulates
+    weight          the total weight of the scenarios with data there
+    exceed          the weight of those exceeding each threshold
+    mean, m2        weighted running mean and sum of squared deviations
+    maximum         the largest value of any scenario
+so memory only depends on the size of the grid.  Accumulators for
+different scenarios are merged exactly (mean and m2 as in Chan et al.),
+so the scenarios are dealt out to a pool of processes and their partial
+results merged at the end.
+
+The scenarios are the rows of a table as in scenarios.py, with output in
+_scenarios/name and an optional column weight (1 if missing).
+
+To use:
+    $ python ensemble.py scenarios.csv 1 8
+for fixed grid 1 on 8 processes, which writes _ensemble/fg01.npz with x,
+y, thresholds, probability[k,j,i] (the weighted fraction of scenarios
+exceeding thresholds[k]), mean, std, maximum and weight.  Or
+interactively with a list of (outdir, weight):
+    >>> import ensemble
+    >>> acc, extent = ensemble.reduce_ensemble([('_output', 1.), ...], 1)
+
+"""
+
+import os, sys, time
+import numpy as np
+
+thresholds = [0.1, 0.5, 1., 2., 3., 5.]
+drytol = 1.e-3
+
+
+def fg_maxima(outdir, fgno=1, quantity='inundation'):
+    """
+    Return the extent [x1, x2, y1, y2] of fixed grid fgno in outdir and
+    the largest quantity over the run, shape (my, mx), nan where no
+    scenario output is available.
+    """
+    import fgcube
+    framenos = fgcube.fg_framenos(fgno, outdir)
+    if len(framenos) == 0:
+        raise IOError("No fort.fg%s_NNNN files in %s"
+                      % (str(fgno).zfill(2), outdir))
+    fname = fgcube.fg_fname(fgno, framenos[-1], outdir)
+    t, mx, my, xlow, ylow, xhi, yhi, ncols = fgcube.read_fg_header(fname)
+    try:
+        fixedgrid = fgcube.read_setfixedgrids(outdir)[fgno-1]
+        columns = fgcube.fg_columns(fixedgrid[9], fixedgrid[10])
+    except (IOError, IndexError):
+        columns = fgcube.fg_columns()
+    if len(columns) != ncols:
+        raise IOError("%s has %s columns, expected %s"
+                      % (fname, ncols, len(columns)))
+    last = fgcube.read_fg_data(fname, mx, my, ncols)
+    B = last[:, :, columns.index('B')]
+    if 'etamax' in columns:
+        etamax = last[:, :, columns.index('etamax')]
+        hmax = np.maximum(etamax - B, 0.)
+    else:
+        # one frame at a time:
+        etamax = -np.inf*np.ones((my, mx))
+        hmax = -np.inf*np.ones((my, mx))
+        for frameno in framenos:
+            data = fgcube.read_fg_data(fgcube.fg_fname(fgno, frameno, outdir),
+                                       mx, my, ncols)
+            h = data[:, :, columns.index('h')]
+            wet = np.where(np.isnan(h), 0., h) > drytol
+            eta = data[:, :, columns.index('eta')]
+            etamax = np.where(wet, np.fmax(etamax, eta), etamax)
+            hmax = np.fmax(hmax, h)
+        etamax[np.isinf(etamax)] = np.nan
+        hmax[np.isinf(hmax)] = np.nan
+    if quantity == 'etamax':
+        values = etamax
+    elif quantity == 'inundation':
+        values = np.where(np.where(np.isnan(B), 0., B) > 0., hmax, etamax)
+    else:
+        raise ValueError("Unknown quantity %s" % quantity)
+    return [xlow, xhi, ylow, yhi], values
+
+
+class Exceedance(object):
+    """
+    Weighted exceedance counts and running statistics of the scenario
+    maxima added, for the given thresholds.
+    """
+
+    def __init__(self, thresholds=thresholds):
+        self.thresholds = np.array(thresholds, dtype=float)
+        self.nscenarios = 0
+        self.shape = None
+
+    def _allocate(self, shape):
+        self.shape = shape
+        self.weight = np.zeros(shape)
+        self.exceed = np.zeros((len(self.thresholds),) + shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.maximum = -np.inf*np.ones(shape)
+
+    def add(self, values, weight=1.):
+        """
+        Add the maxima values of a scenario with the given weight.
+        """
+        if self.shape is None:
+            self._allocate(values.shape)
+        elif values.shape != self.shape:
+            raise ValueError("Fixed grid of shape %s, expected %s"
+                             % (values.shape, self.shape))
+        ok = ~np.isnan(values)
+        v = np.where(ok, values, 0.)
+        w = np.where(ok, weight, 0.)
+        total = self.weight + w
+        delta = v - self.mean
+        self.mean += np.where(total > 0, w/np.where(total > 0, total, 1.), 0.) \
+                     *delta
+        self.m2 += w*delta*(v - self.mean)
+        self.weight = total
+        self.exceed += w*(v[np.newaxis] > self.thresholds[:, np.newaxis,
+                                                          np.newaxis])
+        self.maximum = np.where(ok, np.maximum(self.maximum, v), self.maximum)
+        self.nscenarios += 1
+
+    def merge(self, other):
+        """
+        Merge the accumulator other of other scenarios into this one.
+        """
+        if other.shape is None:
+            return
+        if self.shape is None:
+            self._allocate(other.shape)
+        elif other.shape != self.shape:
+            raise ValueError("Cannot merge fixed grids of shapes %s and %s"
+                             % (self.shape, other.shape))
+        if not np.array_equal(self.thresholds, other.thresholds):
+            raise ValueError("Cannot merge different thresholds")
+        total = self.weight + other.weight
+        safe = np.where(total > 0, total, 1.)
+        delta = other.mean - self.mean
+        self.mean += delta*other.weight/safe
+        self.m2 += other.m2 + delta**2*self.weight*other.weight/safe
+        self.weight = total
+        self.exceed += other.exceed
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        self.nscenarios += other.nscenarios
+
+    def probability(self):
+        """
+        Weighted fraction of the scenarios exceeding each threshold,
+        shape (len(thresholds), my, mx), nan where no scenario has data.
+        """
+        return np.where(self.weight > 0, self.exceed
+                        /np.where(self.weight > 0, self.weight, 1.), np.nan)
+
+    def std(self):
+        return np.where(self.weight > 0, np.sqrt(np.maximum(self.m2, 0.)
+                        /np.where(self.weight > 0, self.weight, 1.)), np.nan)
+
+    def save(self, fname, extent):
+        """
+        Save the results in the npz file fname, see the module docstring.
+        """
+        my, mx = self.shape
+        np.savez(fname, x=np.linspace(extent[0], extent[1], mx),
+                 y=np.linspace(extent[2], extent[3], my),
+                 thresholds=self.thresholds, probability=self.probability(),
+                 mean=np.where(self.weight > 0, self.mean, np.nan),
+                 std=self.std(),
+                 maximum=np.where(np.isinf(self.maximum), np.nan, self.maximum),
+                 weight=self.weight, exceed=self.exceed, m2=self.m2,
+                 nscenarios=self.nscenarios)
+
+
+def _reduce(args):
+    # Worker: accumulate the scenarios runs [(outdir, weight), ...].
+    runs, fgno, thresholds, quantity = args
+    acc = Exceedance(thresholds)
+    extent = None
+    for outdir, weight in runs:
+        try:
+            extent, values = fg_maxima(outdir, fgno, quantity)
+        except IOError, e:
+            print "*** Skipping %s: %s" % (outdir, e)
+            continue
+        acc.add(values, weight)
+    return acc, extent
+
+
+def reduce_ensemble(runs, fgno=1, thresholds=thresholds,
+                    quantity='inundation', nprocs=None):
+    """
+    Accumulate fixed grid fgno of the scenarios runs, a list of
+    (outdir, weight), on a pool of nprocs processes (one per cpu if None).
+    Returns the merged Exceedance and the extent of the fixed grid.
+    """
+    from multiprocessing import Pool, cpu_count
+    if nprocs is None:
+        nprocs = cpu_count()
+    nparts = max(min(nprocs, len(runs)), 1)
+    work = [(runs[k::nparts], fgno, thresholds, quantity)
+            for k in range(nparts)]
+    if nparts == 1:
+        results = [_reduce(work[0])]
+    else:
+        pool = Pool(nparts)
+        try:
+            results = pool.map(_reduce, work)
+        finally:
+            pool.close()
+            pool.join()
+    total = Exceedance(thresholds)
+    extent = None
+    for acc, part_extent in results:
+        total.merge(acc)
+        extent = extent or part_extent
+    return total, extent
+
+
+def table_runs(table_fname, rundir='_scenarios'):
+    """
+    List of (outdir, weight) for the scenarios of a table of scenarios.py.
+    """
+    import scenarios
+    runs = []
+    for scenario in scenarios.read_table(table_fname):
+        weight = scenario.get('weight', '')
+        runs.append((os.path.join(rundir, scenario['name']),
+                     float(weight) if weight != '' else 1.))
+    return runs
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Usage: python ensemble.py table.csv [fgno] [nprocs]"
+        sys.exit(1)
+    fgno = 1
+    nprocs = None
+    if len(sys.argv) > 2:
+        fgno = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        nprocs = int(sys.argv[3])
+    t0 = time.time()
+    acc, extent = reduce_ensemble(table_runs(sys.argv[1]), fgno,
+                                  nprocs=nprocs)
+    if acc.shape is None:
+        print "*** No scenario has output for fixed grid %s" % fgno
+        sys.exit(1)
+    if not os.path.isdir('_ensemble'):
+        os.mkdir('_ensemble')
+    fname = os.path.join('_ensemble', 'fg%s.npz' % str(fgno).zfill(2))
+    acc.save(fname, extent)
+    print "%s scenarios reduced in %.1f seconds, written to %s" \
+          % (acc.nscenarios, time.time() - t0, fname)
@@ -0,0 +1,318 @@
+"""
+Maximum envelopes of a run on a uniform lattice, in one pass over the
+frames.
+
+Each frame fort.qNNNN is resampled (see resample.py) onto the lattice over
+bbox with spacing dx, dy, one tile of tile by tile cells at a time, and
+the running maxima over the frames and the time of each maximum are
+updated:
+    eta_max, t_eta_max          surface eta where the cell is wet
+    h_max, t_h_max              water depth h
+    speed_max, t_speed_max      sqrt(hu**2 + hv**2)/h where wet
+The lattice is by default the domain at the cell size of the finest level
+in the frames.  The envelope is kept in the .npy files of a directory,
+memory-mapped, so only a tile of each frame is held in memory at a time.
+
+The tiles are dealt out to a pool of processes, each bringing its own
+tiles of the one envelope up to date with all the frames, so the disk
+and memory used do not grow with the number of processes.  Envelopes of
+disjoint sets of frames on the same lattice can also be merged cell by
+cell (Envelope.merge).  Cells that no frame covers (or that are never
+wet) are nan.  The frame numbers are
+recorded in envelope.json, so the envelope of a longer run can be brought
+up to date with only the new frames.
+
+To use:
+    $ python envelope.py _output _envelope 8
+    $ python envelope.py _output _envelope 8 0.001 110 112 -9 -7
+which makes the envelope of all frames on 8 processes, in the second case
+on the lattice with spacing 0.001 degree over [110,112] x [-9,-7], and
+writes eta_max.asc and t_eta_max.asc in the format of java.asc too.
+
+"""
+
+import os, sys, json, time
+import numpy as np
+
+import frameindex, resample
+
+names = ['eta_max', 'h_max', 'speed_max']
+drytol = 1.e-3
+max_bytes = 4.e9                    # warn about envelopes larger than this
+
+
+class Envelope(object):
+    """
+    Maxima and their times on the lattice over bbox with spacing dx, dy,
+    as arrays in self.arrays, kept in .npy files in dirname.
+    An existing envelope in dirname is opened if bbox is None.
+    """
+
+    def __init__(self, dirname, bbox=None, dx=None, dy=None):
+        self.dirname = dirname
+        metaname = os.path.join(dirname, 'envelope.json')
+        if bbox is None:
+            meta = json.load(open(metaname))
+            self.bbox, self.dx, self.dy = meta['bbox'], meta['dx'], meta['dy']
+            self.framenos = meta['framenos']
+            mode = 'r+'
+        else:
+            if dy is None:
+                dy = dx
+            self.bbox, self.dx, self.dy = list(bbox), dx, dy
+            self.framenos = []
+            mode = 'w+'
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        self.x, self.y = resample.raster_coords(self.bbox, self.dx, self.dy)
+        shape = (len(self.y), len(self.x))
+        self.arrays = {}
+        for name in names:
+            for key, fill in ((name, -np.inf), ('t_' + name, np.nan)):
+                fname = os.path.join(dirname, key + '.npy')
+                if mode == 'r+':
+                    self.arrays[key] = np.load(fname, mmap_mode='r+')
+                else:
+                    self.arrays[key] = np.lib.format.open_memmap(
+                        fname, mode='w+', dtype=np.float32, shape=shape)
+                    self.arrays[key][:] = fill
+        if mode == 'w+':
+            self.save()
+
+    def save(self):
+        for array in self.arrays.values():
+            array.flush()
+        meta = {'bbox': self.bbox, 'dx': self.dx, 'dy': self.dy,
+                'framenos': sorted(self.framenos)}
+        f = open(os.path.join(self.dirname, 'envelope.json'), 'w')
+        json.dump(meta, f, indent=1)
+        f.close()
+
+    def tiles(self, tile=1024):
+        """
+        Yield the slices (rows, columns) of the tiles of the lattice and
+        their bbox.
+        """
+        for j1 in range(0, len(self.y), tile):
+            for i1 in range(0, len(self.x), tile):
+                j2 = min(j1 + tile, len(self.y))
+                i2 = min(i1 + tile, len(self.x))
+                bbox = [self.bbox[0] + i1*self.dx, self.bbox[0] + i2*self.dx,
+                        self.bbox[2] + j1*self.dy, self.bbox[2] + j2*self.dy]
+                yield (slice(j1, j2), slice(i1, i2)), bbox
+
+    def update(self, name, sl, values, t):
+        """
+        Raise the maxima of name on the tile sl to values, at time t.
+        """
+        current = self.arrays[name][sl]
+        larger = values > current
+        current[larger] = values[larger]
+        self.arrays['t_' + name][sl][larger] = t
+
+    def add_frame(self, frame, tile=1024, patch_cache=None, tilenos=None):
+        """
+        Update the envelope with the IndexedFrame frame, on the tiles
+        numbered tilenos in the order of tiles() (all if None).
+        """
+        for tileno, (sl, bbox) in enumerate(self.tiles(tile)):
+            if tilenos is not None and tileno not in tilenos:
+                continue
+            if not frame.select(bbox=bbox).size:
+                continue
+            x, y, q, level = resample.resample(frame, bbox, self.dx, self.dy,
+                                               fields=range(4),
+                                               patch_cache=patch_cache)
+            # the tile bbox is a whole number of cells, but check:
+            shape = (sl[0].stop - sl[0].start, sl[1].stop - sl[1].start)
+            if q.shape[:2] != shape:
+                raise ValueError("Tile %s has shape %s, expected %s"
+                                 % (bbox, q.shape[:2], shape))
+            h = q[:, :, 0]
+            covered = level > 0
+            wet = covered & (np.where(covered, h, 0.) > drytol)
+            hwet = np.where(wet, h, 1.)
+            speed = np.sqrt(q[:, :, 1]**2 + q[:, :, 2]**2)/hwet
+            self.update('eta_max', sl, np.where(wet, q[:, :, 3], -np.inf),
+                        frame.t)
+            self.update('h_max', sl, np.where(covered, h, -np.inf), frame.t)
+            self.update('speed_max', sl, np.where(wet, speed, -np.inf),
+                        frame.t)
+        if tilenos is None:
+            self.framenos.append(frame.frameno)
+
+    def merge(self, other, tile=1024):
+        """
+        Merge the envelope other, made on the same lattice from other
+        frames, into this one.
+        """
+        if other.bbox != self.bbox or other.dx != self.dx or \
+                other.dy != self.dy:
+            raise ValueError("Cannot merge envelopes on different lattices")
+        for sl, bbox in self.tiles(tile):
+            for name in names:
+                values = other.arrays[name][sl]
+                times = other.arrays['t_' + name][sl]
+                current = self.arrays[name][sl]
+                current_times = self.arrays['t_' + name][sl]
+                # ties go to the earlier time, whatever the merge order:
+                times_set = np.where(np.isnan(times), np.inf, times)
+                earlier = times_set < np.where(np.isnan(current_times),
+                                               np.inf, current_times)
+                larger = (values > current) | ((values == current) & earlier)
+                current[larger] = values[larger]
+                current_times[larger] = times[larger]
+        self.framenos = sorted(set(self.framenos) | set(other.framenos))
+
+    def get(self, name):
+        """
+        Array of name (e.g. 'eta_max' or 't_eta_max'), nan where unset.
+        """
+        values = np.array(self.arrays[name])
+        values[np.isinf(values)] = np.nan
+        return values
+
+
+def default_lattice(outdir='_output', framenos=None):
+    """
+    bbox of the level 1 grids and the cell sizes dx, dy of the finest
+    level in the frames of outdir.
+    """
+    if framenos is None:
+        framenos = frameindex.framenos(outdir)
+    bbox, dx, dy = None, np.inf, np.inf
+    for frameno in framenos:
+        index = frameindex.load_index(frameindex.frame_fname(frameno, outdir))
+        dx, dy = min(dx, index['dx'].min()), min(dy, index['dy'].min())
+        coarse = index[index['level'] == 1]
+        if bbox is None and len(coarse) > 0:
+            bbox = [coarse['xlow'].min(),
+                    (coarse['xlow'] + coarse['mx']*coarse['dx']).max(),
+                    coarse['ylow'].min(),
+                    (coarse['ylow'] + coarse['my']*coarse['dy']).max()]
+    return bbox, float(dx), float(dy)
+
+
+def _tiles(args):
+    # Worker: add the frames framenos of outdir to the tiles tilenos of
+    # the envelope in dirname, which no other worker writes.
+    outdir, framenos, dirname, tilenos, tile = args
+    import plotcache
+    envelope = Envelope(dirname)
+    tilenos = set(tilenos)
+    for frameno in framenos:
+        frame = frameindex.IndexedFrame(frameno, outdir)
+        # patches are only reused within a frame:
+        envelope.add_frame(frame, tile, plotcache.PlotVarCache(), tilenos)
+    for array in envelope.arrays.values():
+        array.flush()
+    return len(tilenos)
+
+
+def make_envelope(outdir='_output', dirname='_envelope', nprocs=None,
+                  bbox=None, dx=None, dy=None, framenos=None, tile=1024):
+    """
+    Make the envelope of the frames framenos (all if None) of outdir in
+    dirname on a pool of nprocs processes (one per cpu if None), or add
+    the frames not yet in it if dirname holds an envelope on the same
+    lattice.  Returns the Envelope.
+    """
+    from multiprocessing import Pool, cpu_count
+    if framenos is None:
+        framenos = frameindex.framenos(outdir)
+    default_bbox, default_dx, default_dy = default_lattice(outdir, framenos)
+    if bbox is None:
+        bbox = default_bbox
+    if dx is None:
+        dx, dy = default_dx, default_dy
+    if dy is None:
+        dy = dx
+
+    envelope = None
+    if os.path.exists(os.path.join(dirname, 'envelope.json')):
+        envelope = Envelope(dirname)
+        if envelope.bbox != list(bbox) or envelope.dx != dx or \
+                envelope.dy != dy:
+            print "*** Lattice changed, making the envelope again"
+            envelope = None
+        else:
+            framenos = [f for f in framenos if f not in envelope.framenos]
+    if envelope is None:
+        envelope = Envelope(dirname, bbox, dx, dy)
+        nbytes = sum([array.nbytes for array in envelope.arrays.values()])
+        if nbytes > max_bytes:
+            print "*** The envelope takes %.1f GB in %s, consider a larger" \
+                  " dx or a smaller bbox" % (nbytes/1.e9, dirname)
+    if not framenos:
+        return envelope
+
+    if nprocs is None:
+        nprocs = cpu_count()
+    ntiles = len(list(envelope.tiles(tile)))
+    nparts = min(nprocs, ntiles)
+    # tiles dealt out in turn, so each part has tiles all over the domain:
+    work = [(outdir, sorted(framenos), dirname, range(k, ntiles, nparts),
+             tile) for k in range(nparts)]
+    if nparts == 1:
+        _tiles(work[0])
+    else:
+        pool = Pool(nparts)
+        try:
+            pool.map(_tiles, work)
+        finally:
+            pool.close()
+            pool.join()
+    # the workers wrote to the files, so open them again:
+    envelope = Envelope(dirname)
+    envelope.framenos = sorted(set(envelope.framenos) | set(framenos))
+    envelope.save()
+    return envelope
+
+
+def write_asc(fname, x, y, values, nodata=-9999.):
+    """
+    Write values[j,i] at (x[i], y[j]) as an ESRI ASCII grid with the header
+    of java.asc (topotype 3), nan written as nodata.
+    """
+    dx = x[1] - x[0] if len(x) > 1 else 1.
+    dy = y[1] - y[0] if len(y) > 1 else dx
+    f = open(fname, 'w')
+    f.write('%s\t     ncols\n' % len(x))
+    f.write('%s\t     nrows\n' % len(y))
+    f.write('%.10g     xllcorner\n' % (x[0] - 0.5*dx))
+    f.write('%.10g     yllcorner\n' % (y[0] - 0.5*dy))
+    f.write('%.10g     cellsize\n' % dx)
+    f.write('%g\t     no data value\n' % nodata)
+    # rows from north to south:
+    np.savetxt(f, np.where(np.isnan(values), nodata, values)[::-1],
+               fmt='%.4f')
+    f.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Usage: python envelope.py outdir [dirname] [nprocs] " \
+              "[dx [x1 x2 y1 y2]]"
+        sys.exit(1)
+    outdir = sys.argv[1]
+    dirname = '_envelope'
+    nprocs = None
+    dx = None
+    bbox = None
+    if len(sys.argv) > 2:
+        dirname = sys.argv[2]
+    if len(sys.argv) > 3:
+        nprocs = int(sys.argv[3])
+    if len(sys.argv) > 4:
+        dx = float(sys.argv[4])
+    if len(sys.argv) > 8:
+        bbox = [float(v) for v in sys.argv[5:9]]
+    t0 = time.time()
+    envelope = make_envelope(outdir, dirname, nprocs, bbox, dx)
+    print "Envelope of %s frames on %s x %s cells in %.1f seconds" \
+          % (len(envelope.framenos), len(envelope.y), len(envelope.x),
+             time.time() - t0)
+    for name in ['eta_max', 't_eta_max']:
+        write_asc(os.path.join(dirname, name + '.asc'), envelope.x,
+                  envelope.y, envelope.get(name))
+    print "Written to %s" % dirname
@@ -0,0 +1,287 @@
+"""
+Binary memory-mapped cube of the fixed grid output fort.fgNN_NNNN.
+
+All frames of fixed grid fgno are converted once, in parallel, into a
+single array indexed by (frame, j, i, column) and saved as
+fort.fgNN.cube.npy, with the times and grid extent in fort.fgNN.cube.npz.
+Later reads memory-map the cube instead of parsing text.
+
+Each fort.fgNN_NNNN file has a header of 8 lines followed by mx*my rows,
+with i (the x index) varying fastest, so that point (i,j) is at
+    x = xlow + i*(xhi-xlow)/(mx-1),   y = ylow + j*(yhi-ylow)/(my-1).
+The columns are h, hu, hv, B, eta, followed by the arrival time if
+ioutarrivaltimes and by etamin, etamax if ioutsurfacemax.
+
+To use interactively:
+    >>> import fgcube
+    >>> cube = fgcube.FGCube(1, outdir='_output')   # converts if needed
+    >>> cube.times
+    >>> eta = cube.column('eta')                     # shape (nframes,my,mx)
+    >>> grid, solution = cube.get_frame(5)           # as plotfg reads it
+
+To convert all frames of fixed grid 1 on 4 processes:
+    $ python fgcube.py 1 _output 4
+
+"""
+
+import os, glob
+import numpy as np
+
+
+def fg_fname(fgno, frameno, outdir='_output'):
+    return os.path.join(outdir, 'fort.fg%s_%s' % (str(fgno).zfill(2),
+                                                   str(frameno).zfill(4)))
+
+
+def cube_fname(fgno, outdir='_output'):
+    return os.path.join(outdir, 'fort.fg%s.cube.npy' % str(fgno).zfill(2))
+
+
+def fg_framenos(fgno, outdir='_output'):
+    """
+    Return the sorted frame numbers of the fort.fgNN_NNNN files of fgno.
+    """
+    pattern = os.path.join(outdir, 'fort.fg%s_[0-9][0-9][0-9][0-9]' \
+                           % str(fgno).zfill(2))
+    return sorted([int(f[-4:]) for f in glob.glob(pattern)])
+
+
+def read_setfixedgrids(outdir='_output'):
+    """
+    Return the list of fixed grids in setfixedgrids.data, each of the form
+    [t1,t2,noutput,x1,x2,y1,y2,xpoints,ypoints,
+     ioutarrivaltimes,ioutsurfacemax]
+    """
+    lines = open(os.path.join(outdir, 'setfixedgrids.data')).readlines()
+    lines = [line for line in lines
+             if line.strip() and not line.startswith('#')]
+    nfixedgrids = int(lines[0].split()[0])
+    fixedgrids = []
+    for line in lines[1:nfixedgrids+1]:
+        fixedgrids.append([float(v) for v in line.split()])
+    return fixedgrids
+
+
+def fg_columns(ioutarrivaltimes=0, ioutsurfacemax=0):
+    """
+    Names of the columns written to fort.fgNN_NNNN.
+    """
+    columns = ['h', 'hu', 'hv', 'B', 'eta']
+    if ioutarrivaltimes:
+        columns.append('arrival')
+    if ioutsurfacemax:
+        columns += ['etamin', 'etamax']
+    return columns
+
+
+def read_fg_header(fname):
+    """
+    Return t, mx, my, xlow, ylow, xhi, yhi, ncols from the header
+    of a fort.fgNN_NNNN file.
+    """
+    f = open(fname)
+    values = [f.readline().split()[0].replace('D', 'E') for i in range(8)]
+    f.close()
+    t = float(values[0])
+    mx, my = int(values[1]), int(values[2])
+    xlow, ylow, xhi, yhi = [float(v) for v in values[3:7]]
+    ncols = int(values[7])
+    return t, mx, my, xlow, ylow, xhi, yhi, ncols
+
+
+def read_fg_data(fname, mx, my, ncols):
+    """
+    Parse the data rows of a fort.fgNN_NNNN file into shape (my, mx, ncols).
+    """
+    f = open(fname, 'rb')
+    for i in range(8):
+        f.readline()
+    text = f.read()
+    f.close()
+    data = np.fromstring(text.replace(b'D', b'E'), sep=' ')
+    if data.size != mx*my*ncols:
+        raise IOError("%s has %s values, expected %s" \
+                      % (fname, data.size, mx*my*ncols))
+    return data.reshape((my, mx, ncols))
+
+
+def _convert_frame(args):
+    # Worker for convert: parse one frame and store it in the cube.
+    fname, cubename, k, mx, my, ncols = args
+    cube = np.load(cubename, mmap_mode='r+')
+    cube[k] = read_fg_data(fname, mx, my, ncols)
+    cube.flush()
+    del cube
+    return k
+
+
+def convert(fgno=1, outdir='_output', nprocs=None, dtype='float64'):
+    """
+    Convert all frames of fixed grid fgno in outdir into the cube.
+    The frames are parsed on a pool of nprocs processes (one per cpu
+    if None, serially if 1), each writing its frame directly into the
+    memory-mapped cube.  Returns the name of the cube file.
+    """
+    framenos = fg_framenos(fgno, outdir)
+    if len(framenos) == 0:
+        raise IOError("No fort.fg%s_NNNN files in %s" \
+                      % (str(fgno).zfill(2), outdir))
+    fnames = [fg_fname(fgno, frameno, outdir) for frameno in framenos]
+    headers = [read_fg_header(fname) for fname in fnames]
+    t, mx, my, xlow, ylow, xhi, yhi, ncols = headers[0]
+    times = np.array([header[0] for header in headers])
+
+    cubename = cube_fname(fgno, outdir)
+    cube = np.lib.format.open_memmap(cubename, mode='w+', dtype=dtype,
+                                     shape=(len(fnames), my, mx, ncols))
+    del cube
+
+    work = [(fname, cubename, k, mx, my, ncols)
+            for k, fname in enumerate(fnames)]
+    if nprocs == 1:
+        for args in work:
+            _convert_frame(args)
+    else:
+        from multiprocessing import Pool
+        pool = Pool(nprocs)
+        try:
+            pool.map(_convert_frame, work)
+        finally:
+            pool.close()
+            pool.join()
+
+    try:
+        fixedgrid = read_setfixedgrids(outdir)[fgno-1]
+        columns = fg_columns(fixedgrid[9], fixedgrid[10])
+    except (IOError, IndexError):
+        columns = []
+    if len(columns) != ncols:
+        columns = ['col%s' % k for k in range(ncols)]
+
+    np.savez(cubename[:-4] + '.npz', times=times, framenos=framenos,
+             extent=np.array([xlow, xhi, ylow, yhi]),
+             columns=np.array(columns))
+    return cubename
+
+
+def cube_is_current(fgno, outdir='_output'):
+    """
+    True if the cube of fgno exists and is newer than all of its frames.
+    """
+    cubename = cube_fname(fgno, outdir)
+    metaname = cubename[:-4] + '.npz'
+    if not (os.path.exists(cubename) and os.path.exists(metaname)):
+        return False
+    framenos = fg_framenos(fgno, outdir)
+    if list(np.load(metaname)['framenos']) != framenos:
+        return False
+    mtime = os.path.getmtime(metaname)
+    for frameno in framenos:
+        if os.path.getmtime(fg_fname(fgno, frameno, outdir)) > mtime:
+            return False
+    return True
+
+
+class FGFrame(object):
+    """
+    One frame of a fixed grid, with each column as an attribute of
+    shape (my, mx) and the coordinates in X, Y.
+    """
+    pass
+
+
+class FGCube(object):
+    """
+    Memory-mapped access to all frames of fixed grid fgno.
+    The cube is (re)built with convert() when it is missing or stale
+    unless build=False.
+    """
+
+    def __init__(self, fgno=1, outdir='_output', build=True, nprocs=None):
+        self.fgno = fgno
+        self.outdir = outdir
+        if build and not cube_is_current(fgno, outdir):
+            print "Converting fixed grid %s frames in %s" % (fgno, outdir)
+            convert(fgno, outdir, nprocs)
+        cubename = cube_fname(fgno, outdir)
+        self.cube = np.load(cubename, mmap_mode='r')
+        meta = np.load(cubename[:-4] + '.npz')
+        self.times = meta['times']
+        self.framenos = [int(frameno) for frameno in meta['framenos']]
+        self.xlow, self.xhi, self.ylow, self.yhi = meta['extent']
+        self.columns = [str(c) for c in meta['columns']]
+        nframes, self.my, self.mx, self.ncols = self.cube.shape
+        self.x = np.linspace(self.xlow, self.xhi, self.mx)
+        self.y = np.linspace(self.ylow, self.yhi, self.my)
+
+    def column(self, name):
+        """
+        Return column name for all frames, shape (nframes, my, mx).
+        """
+        return self.cube[:, :, :, self.columns.index(name)]
+
+    def frame(self, frameno):
+        """
+        Return an FGFrame for frame number frameno (as in fort.fgNN_frameno).
+        """
+        k = self.framenos.index(frameno)
+        fgframe = FGFrame()
+        fgframe.frameno = frameno
+        fgframe.t = self.times[k]
+        fgframe.mx, fgframe.my = self.mx, self.my
+        fgframe.xlow, fgframe.xhi = self.xlow, self.xhi
+        fgframe.ylow, fgframe.yhi = self.ylow, self.yhi
+        fgframe.X, fgframe.Y = np.meshgrid(self.x, self.y)
+        for m, name in enumerate(self.columns):
+            setattr(fgframe, name, np.asarray(self.cube[k, :, :, m]))
+        return fgframe
+
+    def get_frame(self, frameno, drytol=1.e-2):
+        """
+        Return (grid, solution) for frame frameno as returned by
+        ClawPlotFGData.get_frame of pyclaw.plotters.plotfg, which it
+        replaces in setplotfg.py.  Raises IOError if there is no such
+        frame, as that does.
+        """
+        if frameno not in self.framenos:
+            raise IOError("Missing fixed grid output file for frame %s"
+                          % frameno)
+        k = self.framenos.index(frameno)
+        grid = FGFrame()
+        grid.mx, grid.my = self.mx, self.my
+        grid.xlow, grid.xhi = self.xlow, self.xhi
+        grid.ylow, grid.yhi = self.ylow, self.yhi
+        # cell edges and centers, as plotfg sets them:
+        grid.x = np.linspace(self.xlow, self.xhi, self.mx + 1)
+        grid.y = np.linspace(self.ylow, self.yhi, self.my + 1)
+        grid.dx = grid.x[1] - grid.x[0]
+        grid.dy = grid.y[1] - grid.y[0]
+        grid.xcenter = grid.x[:-1] + grid.dx/2.
+        grid.ycenter = grid.y[:-1] + grid.dy/2.
+        solution = FGFrame()
+        solution.t = self.times[k]
+        solution.ncols = self.ncols
+        # columns first, shape (ncols, my, mx):
+        solution.fg = np.rollaxis(np.asarray(self.cube[k], dtype=float), 2)
+        solution.h = solution.fg[self.columns.index('h')]
+        solution.B = solution.fg[self.columns.index('B')]
+        solution.eta = solution.fg[self.columns.index('eta')]
+        solution.surface = np.ma.masked_where(np.isnan(solution.eta),
+                                              solution.eta)
+        solution.land = np.ma.masked_where(solution.h > drytol, solution.B)
+        return grid, solution
+
+
+if __name__ == '__main__':
+    import sys
+    fgno = 1
+    outdir = '_output'
+    nprocs = None
+    if len(sys.argv) > 1:
+        fgno = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        outdir = sys.argv[2]
+    if len(sys.argv) > 3:
+        nprocs = int(sys.argv[3])
+    cubename = convert(fgno, outdir, nprocs)
+    print "Created %s" % cubename
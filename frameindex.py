@@ -0,0 +1,246 @@
+"""
+Indexed, lazy reader for the AMR output frames fort.qNNNN.
+
+The first time a frame is opened, a single pass over the file records the
+header of every grid (grid_number, AMR_level, mx, my, xlow, ylow, dx, dy)
+together with the byte offsets of its data.  This index is saved next to
+the frame as fort.qNNNN.idx.npy and reused as long as it is newer than
+the frame.  Patch data is only parsed when a grid is requested, so asking
+for the finest level in a one-degree window reads a small part of the file.
+
+To use interactively:
+    >>> import frameindex
+    >>> frame = frameindex.IndexedFrame(1, outdir='_output')
+    >>> frame.index                                    # headers of all grids
+    >>> grids = frame.getgrids(levels=[5], bbox=[110,111,-10,-6])
+    >>> grids[0].q                                     # shape (mx,my,meqn)
+
+To build the index of every frame in an output directory:
+    $ python frameindex.py _output
+
+"""
+
+import os, re, glob
+import numpy as np
+
+index_dtype = np.dtype([('gridno', 'i4'), ('level', 'i4'),
+                        ('mx', 'i4'), ('my', 'i4'),
+                        ('xlow', 'f8'), ('ylow', 'f8'),
+                        ('dx', 'f8'), ('dy', 'f8'),
+                        ('offset', 'i8'), ('nbytes', 'i8')])
+
+_grid_number = re.compile(r'grid_number')
+
+
+def frame_fname(frameno, outdir='_output', prefix='fort.q'):
+    return os.path.join(outdir, '%s%s' % (prefix, str(frameno).zfill(4)))
+
+
+def index_fname(frameno, outdir='_output'):
+    return frame_fname(frameno, outdir) + '.idx.npy'
+
+
+def framenos(outdir='_output'):
+    """
+    Return the sorted list of frame numbers with a fort.qNNNN file in outdir.
+    """
+    fnames = glob.glob(os.path.join(outdir, 'fort.q[0-9][0-9][0-9][0-9]'))
+    return sorted([int(f[-4:]) for f in fnames])
+
+
+def read_tfile(frameno, outdir='_output'):
+    """
+    Read the fort.tNNNN file of a frame.
+    Returns a dictionary with keys time, meqn, ngrids, naux, ndim.
+    """
+    tdata = {}
+    for line in open(frame_fname(frameno, outdir, 'fort.t')):
+        tokens = line.split()
+        if len(tokens) >= 2:
+            value = tokens[0].replace('D', 'E')
+            if tokens[1] == 'time':
+                tdata['time'] = float(value)
+            else:
+                tdata[tokens[1]] = int(value)
+    return tdata
+
+
+def build_index(fname):
+    """
+    Scan the fort.q file fname once and return the grid index as a
+    structured array with dtype index_dtype.  The offset and nbytes fields
+    locate the data block of each grid within the file.
+    """
+    text = open(fname, 'rb').read()
+    starts = [text.rfind(b'\n', 0, m.start()) + 1
+              for m in _grid_number.finditer(text)]
+    index = np.zeros(len(starts), dtype=index_dtype)
+    for k, start in enumerate(starts):
+        pos = start
+        header = []
+        for i in range(8):
+            end = text.index(b'\n', pos)
+            header.append(text[pos:end].split()[0].replace(b'D', b'E'))
+            pos = end + 1
+        # data starts after the blank line following the header:
+        end = text.index(b'\n', pos)
+        pos = end + 1
+        if k+1 < len(starts):
+            stop = starts[k+1]
+        else:
+            stop = len(text)
+        index[k] = (int(header[0]), int(header[1]), int(header[2]),
+                    int(header[3]), float(header[4]), float(header[5]),
+                    float(header[6]), float(header[7]), pos, stop - pos)
+    return index
+
+
+def load_index(fname, rebuild=False):
+    """
+    Return the grid index of the fort.q file fname, reading the saved
+    fname.idx.npy if it is up to date and building (and saving) it otherwise.
+    """
+    idxname = fname + '.idx.npy'
+    if (not rebuild) and os.path.exists(idxname) and \
+            os.path.getmtime(idxname) >= os.path.getmtime(fname):
+        return np.load(idxname)
+    index = build_index(fname)
+    try:
+        np.save(idxname, index)
+    except IOError:
+        print "*** Could not save index file %s" % idxname
+    return index
+
+
+def select(index, levels=None, bbox=None):
+    """
+    Return the boolean mask of the rows of index on one of the AMR levels
+    in levels (all levels if None) whose patch intersects
+    bbox = [x1, x2, y1, y2] (everywhere if None).
+    """
+    mask = np.ones(len(index), dtype=bool)
+    if levels is not None:
+        mask &= np.in1d(index['level'], levels)
+    if bbox is not None:
+        x1, x2, y1, y2 = bbox
+        xhi = index['xlow'] + index['mx']*index['dx']
+        yhi = index['ylow'] + index['my']*index['dy']
+        mask &= (index['xlow'] < x2) & (xhi > x1) & \
+                (index['ylow'] < y2) & (yhi > y1)
+    return mask
+
+
+class Patch(object):
+    """
+    One grid patch of an AMR frame.  The solution is in q with shape
+    (mx, my, meqn), so q[i,j,:] is the cell with center
+    (xlow + (i+0.5)*dx, ylow + (j+0.5)*dy).
+    """
+
+    def __init__(self, row, q=None):
+        self.gridno = int(row['gridno'])
+        self.level = int(row['level'])
+        self.mx = int(row['mx'])
+        self.my = int(row['my'])
+        self.xlow = float(row['xlow'])
+        self.ylow = float(row['ylow'])
+        self.dx = float(row['dx'])
+        self.dy = float(row['dy'])
+        self.q = q
+
+    def edges(self):
+        return [self.xlow, self.xlow + self.mx*self.dx,
+                self.ylow, self.ylow + self.my*self.dy]
+
+    def xcenter(self):
+        return self.xlow + (np.arange(self.mx) + 0.5)*self.dx
+
+    def ycenter(self):
+        return self.ylow + (np.arange(self.my) + 0.5)*self.dy
+
+    def __repr__(self):
+        return 'Patch(gridno=%s, level=%s, mx=%s, my=%s, edges=%s)' \
+               % (self.gridno, self.level, self.mx, self.my, self.edges())
+
+
+class IndexedFrame(object):
+    """
+    Lazy access to the grids of frame frameno in outdir.
+    Only the index and the fort.t file are read when the object is created.
+    """
+
+    def __init__(self, frameno, outdir='_output', rebuild=False):
+        self.frameno = frameno
+        self.outdir = outdir
+        self.fname = frame_fname(frameno, outdir)
+        tdata = read_tfile(frameno, outdir)
+        self.t = tdata['time']
+        self.meqn = tdata['meqn']
+        self.index = load_index(self.fname, rebuild)
+
+    def levels(self):
+        return sorted(set(self.index['level']))
+
+    def select(self, levels=None, bbox=None):
+        """
+        Return the rows of the index matching levels and bbox, see select().
+        """
+        return self.index[select(self.index, levels, bbox)]
+
+    def read_q(self, row, f=None):
+        """
+        Parse the data of the grid described by index row and return q
+        with shape (mx, my, meqn).
+        """
+        close = f is None
+        if close:
+            f = open(self.fname, 'rb')
+        f.seek(int(row['offset']))
+        text = f.read(int(row['nbytes']))
+        if close:
+            f.close()
+        mx, my = int(row['mx']), int(row['my'])
+        q = np.fromstring(text.replace(b'D', b'E'), sep=' ')
+        if q.size != mx*my*self.meqn:
+            raise IOError("Grid %s in %s has %s values, expected %s" \
+                          % (row['gridno'], self.fname, q.size,
+                             mx*my*self.meqn))
+        # rows in the file are ordered with i varying fastest:
+        return q.reshape((my, mx, self.meqn)).transpose((1, 0, 2))
+
+    def getgrids(self, levels=None, bbox=None):
+        """
+        Return a list of Patch objects with data loaded for the grids on
+        the given levels that intersect bbox = [x1, x2, y1, y2].
+        """
+        rows = self.select(levels, bbox)
+        f = open(self.fname, 'rb')
+        try:
+            grids = [Patch(row, self.read_q(row, f)) for row in rows]
+        finally:
+            f.close()
+        return grids
+
+    def itergrids(self, levels=None, bbox=None):
+        """
+        Like getgrids but yields one Patch at a time, so only one patch
+        is held in memory.
+        """
+        f = open(self.fname, 'rb')
+        try:
+            for row in self.select(levels, bbox):
+                yield Patch(row, self.read_q(row, f))
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) == 2:
+        outdir = sys.argv[1]
+    else:
+        outdir = '_output'
+    for frameno in framenos(outdir):
+        index = load_index(frame_fname(frameno, outdir), rebuild=True)
+        print "Frame %s: %s grids, levels %s" \
+              % (frameno, len(index), sorted(set(index['level'])))
@@ -0,0 +1,258 @@
+"""
+Compare the gauges of many runs with tide gauge observations at once.
+
+Observations are text files obsdir/TGnnnn.txt (or .dat) with columns
+t (seconds since the earthquake) and eta (m) for gauge nnnn, as the
+arrays TG32412 and TG51406 used in setplot.py.  They are read once into
+obsdir/observations.npz and only files changed since are read again.
+
+For each gauge the observation and the model series of every run (from
+gaugestore.py) are interpolated onto a common time base with spacing dt
+over the times they all cover, and the metrics are computed for all runs
+together:
+    arrival_obs, arrival_model, arrival_error
+                    first time |eta| exceeds threshold, model - obs
+    peak_obs, peak_model, peak_error
+                    largest eta, model - obs
+    rms             root mean square of model - obs
+    lag, corr       time shift (s, positive if the model is late) of the
+                    largest cross-correlation within max_lag, and its
+                    normalized value
+
+To use:
+    $ python gaugecompare.py obs _output _scenarios/java2 ...
+which prints the table, writes gaugecompare.csv and, if matplotlib is
+available, a plot per gauge in _compare.
+
+"""
+
+import os, re, sys, glob, csv
+import numpy as np
+
+import gaugestore
+
+metric_names = ['arrival_obs', 'arrival_model', 'arrival_error', 'peak_obs',
+                'peak_model', 'peak_error', 'rms', 'lag', 'corr']
+
+
+class ObservationStore(object):
+    """
+    Observed series of the files TGnnnn.* in obsdir, kept in
+    obsdir/observations.npz.
+    """
+
+    def __init__(self, obsdir='obs'):
+        self.obsdir = obsdir
+        self.storename = os.path.join(obsdir, 'observations.npz')
+        self._data = {}
+        self._stamps = {}
+        if os.path.exists(self.storename):
+            npz = np.load(self.storename)
+            for key in npz.files:
+                if key.startswith('gauge'):
+                    self._data[int(key[5:])] = npz[key]
+                elif key.startswith('stamp'):
+                    self._stamps[int(key[5:])] = tuple(npz[key])
+        self.update()
+
+    @property
+    def gaugenos(self):
+        return sorted(self._data.keys())
+
+    def gauge(self, gaugeno):
+        """
+        Return an object with arrays t and eta for gaugeno.
+        """
+        if gaugeno not in self._data:
+            raise KeyError("No observations for gauge %s in %s"
+                           % (gaugeno, self.obsdir))
+        return gaugestore.GaugeColumns(gaugeno, self._rows(gaugeno))
+
+    def _rows(self, gaugeno):
+        # columns as in gaugestore, the observations only have t and eta:
+        data = self._data[gaugeno]
+        rows = np.zeros((data.shape[0], len(gaugestore.columns)))
+        rows[:, 0] = data[:, 0]
+        rows[:, -1] = data[:, 1]
+        return rows
+
+    def update(self):
+        """
+        Read the observation files that are new or changed.
+        """
+        changed = False
+        found = set()
+        for fname in sorted(glob.glob(os.path.join(self.obsdir, 'TG*'))):
+            match = re.match(r'TG(\d+)\.(txt|dat)$', os.path.basename(fname))
+            if match is None:
+                continue
+            gaugeno = int(match.group(1))
+            found.add(gaugeno)
+            stamp = (os.path.getsize(fname), os.path.getmtime(fname))
+            if self._stamps.get(gaugeno) == stamp:
+                continue
+            data = np.loadtxt(fname, usecols=(0, 1), ndmin=2)
+            self._data[gaugeno] = data[np.argsort(data[:, 0], kind='mergesort')]
+            self._stamps[gaugeno] = stamp
+            changed = True
+        for gaugeno in set(self._data.keys()) - found:
+            del self._data[gaugeno]
+            del self._stamps[gaugeno]
+            changed = True
+        if changed:
+            arrays = {}
+            for gaugeno in self._data:
+                key = str(gaugeno).zfill(4)
+                arrays['gauge' + key] = self._data[gaugeno]
+                arrays['stamp' + key] = np.array(self._stamps[gaugeno])
+            np.savez(self.storename, **arrays)
+
+
+def common_times(obs_t, model_ts, dt=30.):
+    """
+    Times with spacing dt covered by the observation and all model series,
+    or None if they do not overlap.
+    """
+    t1 = max([obs_t[0]] + [t[0] for t in model_ts])
+    t2 = min([obs_t[-1]] + [t[-1] for t in model_ts])
+    if t2 <= t1:
+        return None
+    return np.arange(t1, t2 + 0.5*dt, dt)[:int((t2 - t1)/dt) + 1]
+
+
+def first_exceedance(t, eta, threshold):
+    """
+    First time at which |eta| exceeds threshold along the last axis,
+    nan where it never does.
+    """
+    above = np.abs(eta) > threshold
+    first = np.argmax(above, axis=-1)
+    return np.where(above.any(axis=-1), t[first], np.nan)
+
+
+def cross_correlation_lag(model, obs, dt, max_lag=1800.):
+    """
+    For each row of model, the lag (s) maximizing the cross-correlation
+    with obs, positive if model is late, and the normalized correlation.
+    """
+    nt = obs.shape[-1]
+    n = 2*nt
+    m = model - model.mean(axis=-1)[:, np.newaxis]
+    o = obs - obs.mean()
+    spectrum = np.fft.rfft(m, n, axis=-1)*np.conj(np.fft.rfft(o, n))
+    cc = np.fft.irfft(spectrum, n, axis=-1)
+    # lags 0..nt-1 then -(nt-1)..-1:
+    lags = np.concatenate((np.arange(nt), np.arange(-nt, 0)))*dt
+    cc[:, np.abs(lags) > max_lag] = -np.inf
+    best = np.argmax(cc, axis=-1)
+    norm = np.sqrt((m**2).sum(axis=-1)*(o**2).sum())
+    corr = cc[np.arange(len(best)), best]/np.where(norm > 0, norm, np.inf)
+    return lags[best], corr
+
+
+def compare_gauge(obs, models, dt=30., threshold=0.02, max_lag=1800.):
+    """
+    Metrics of the model series (objects with t and eta) against obs.
+    Returns (times, model values on times, obs values on times, dict of
+    metric name to an array over models), or None if they do not overlap.
+    """
+    times = common_times(obs.t, [m.t for m in models], dt)
+    if times is None or len(times) < 2:
+        return None
+    o = np.interp(times, obs.t, obs.eta)
+    M = np.array([np.interp(times, m.t, m.eta) for m in models])
+    metrics = {}
+    metrics['arrival_obs'] = first_exceedance(times, o, threshold) \
+                             *np.ones(len(models))
+    metrics['arrival_model'] = first_exceedance(times, M, threshold)
+    metrics['arrival_error'] = metrics['arrival_model'] - metrics['arrival_obs']
+    metrics['peak_obs'] = o.max()*np.ones(len(models))
+    metrics['peak_model'] = M.max(axis=-1)
+    metrics['peak_error'] = metrics['peak_model'] - metrics['peak_obs']
+    metrics['rms'] = np.sqrt(np.mean((M - o)**2, axis=-1))
+    metrics['lag'], metrics['corr'] = cross_correlation_lag(M, o, dt, max_lag)
+    return times, M, o, metrics
+
+
+def compare(outdirs, obsdir='obs', gaugenos=None, plotdir=None, **kwargs):
+    """
+    Compare the gauges of each run in outdirs with the observations.
+    Returns a list of rows (outdir, gaugeno, metrics...) in the order of
+    metric_names.  If plotdir is given a plot per gauge is saved there.
+    """
+    observations = ObservationStore(obsdir)
+    stores = [gaugestore.GaugeStore(outdir) for outdir in outdirs]
+    if gaugenos is None:
+        gaugenos = observations.gaugenos
+    rows = []
+    for gaugeno in gaugenos:
+        if gaugeno not in observations.gaugenos:
+            continue
+        runs = [k for k, store in enumerate(stores)
+                if gaugeno in store.gaugenos]
+        if not runs:
+            continue
+        obs = observations.gauge(gaugeno)
+        models = [stores[k].gauge(gaugeno) for k in runs]
+        result = compare_gauge(obs, models, **kwargs)
+        if result is None:
+            print "*** Gauge %s: model and observations do not overlap" % gaugeno
+            continue
+        times, M, o, metrics = result
+        for j, k in enumerate(runs):
+            rows.append([outdirs[k], gaugeno] +
+                        [metrics[name][j] for name in metric_names])
+        if plotdir is not None:
+            plot_gauge(gaugeno, times, M, o, [outdirs[k] for k in runs],
+                       plotdir)
+    return rows
+
+
+def write_table(rows, fname='gaugecompare.csv'):
+    writer = csv.writer(open(fname, 'w'))
+    writer.writerow(['outdir', 'gaugeno'] + metric_names)
+    for row in rows:
+        writer.writerow(row[:2] + ['%.6g' % v for v in row[2:]])
+
+
+def print_table(rows, f=sys.stdout):
+    f.write('%-24s %6s' % ('outdir', 'gauge'))
+    for name in metric_names:
+        f.write(' %13s' % name)
+    f.write('\n')
+    for row in rows:
+        f.write('%-24s %6s' % (row[0], row[1]))
+        for v in row[2:]:
+            f.write(' %13.4g' % v)
+        f.write('\n')
+
+
+def plot_gauge(gaugeno, times, M, o, labels, plotdir='_compare'):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import pylab
+    except ImportError:
+        return
+    if not os.path.isdir(plotdir):
+        os.makedirs(plotdir)
+    pylab.figure(figsize=(10, 4))
+    pylab.plot(times, o, 'r', label='Obs')
+    for k, label in enumerate(labels):
+        pylab.plot(times, M[k], label=label)
+    pylab.legend(loc='lower right')
+    pylab.xlabel('Time (seconds since earthquake)')
+    pylab.title('Gauge %s' % gaugeno)
+    fname = os.path.join(plotdir, 'gauge%s.png' % str(gaugeno).zfill(4))
+    pylab.savefig(fname)
+    pylab.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "Usage: python gaugecompare.py obsdir outdir [outdir ...]"
+        sys.exit(1)
+    rows = compare(sys.argv[2:], sys.argv[1], plotdir='_compare')
+    print_table(rows)
+    write_table(rows)
+    print "Table written to gaugecompare.csv"
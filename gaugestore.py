@@ -0,0 +1,225 @@
+"""
+Columnar per-gauge store for the gauge output fort.gauge.
+
+fort.gauge is one interleaved stream with a line per gauge and time step:
+    gaugeno, level, t, h, hu, hv, eta
+This module splits it once into contiguous columns for each gauge and
+saves them in fort.gauge.npz next to fort.gauge, together with the number
+of bytes already converted.  Updating the store only parses what has been
+appended to fort.gauge since, so it can follow a file that xgeoclaw is
+still writing.  A fingerprint of the bytes converted (see fingerprint())
+is kept too, and the store is rebuilt when fort.gauge was rewritten by a
+new run, even one with as much output.
+
+To use interactively:
+    >>> import gaugestore
+    >>> store = gaugestore.GaugeStore('_output')
+    >>> store.gaugenos                 # gauges found in fort.gauge
+    >>> g = store.gauge(5)
+    >>> g.t, g.eta                     # columns for gauge 5
+
+To convert, or follow a running job and append new rows as they appear:
+    $ python gaugestore.py _output
+    $ python gaugestore.py _output follow
+
+"""
+
+import os, time, hashlib
+import numpy as np
+
+columns = ['t', 'level', 'h', 'hu', 'hv', 'eta']
+
+
+def fingerprint(fname, offset, nbytes=4096):
+    """
+    Fingerprint of the first offset bytes of fname: its inode and a hash
+    of the first and of the last nbytes of them.  A rerun writing the same
+    gauges at the same times gives the same first lines, so the last ones
+    are included.
+    """
+    sha = hashlib.sha1()
+    f = open(fname, 'rb')
+    sha.update(f.read(min(nbytes, offset)))
+    f.seek(max(offset - nbytes, 0))
+    sha.update(f.read(offset - max(offset - nbytes, 0)))
+    f.close()
+    return '%s-%s' % (os.stat(fname).st_ino, sha.hexdigest())
+
+
+class GaugeColumns(object):
+    """
+    Time series of one gauge, one array per entry of columns.
+    q has columns h, hu, hv, eta as in the gauge plots of setplot.py.
+    """
+
+    def __init__(self, gaugeno, data):
+        self.gaugeno = gaugeno
+        self.data = data
+        for k, name in enumerate(columns):
+            setattr(self, name, data[:, k])
+        self.level = self.level.astype(int)
+        self.q = data[:, 2:]
+
+    def __len__(self):
+        return self.data.shape[0]
+
+
+class GaugeStore(object):
+    """
+    Per-gauge columns of outdir/fort.gauge, kept in outdir/fort.gauge.npz.
+    The store is brought up to date when it is created unless update=False.
+    """
+
+    def __init__(self, outdir='_output', update=True):
+        self.outdir = outdir
+        self.fname = os.path.join(outdir, 'fort.gauge')
+        self.storename = self.fname + '.npz'
+        self.offset = 0
+        self.fingerprint = ''
+        self._data = {}
+        if os.path.exists(self.storename):
+            self.load()
+        if update:
+            self.update()
+
+    @property
+    def gaugenos(self):
+        return sorted(self._data.keys())
+
+    def gauge(self, gaugeno):
+        if gaugeno not in self._data:
+            raise KeyError("Gauge %s not found in %s" % (gaugeno, self.fname))
+        return GaugeColumns(gaugeno, self._data[gaugeno])
+
+    def load(self):
+        npz = np.load(self.storename)
+        self.offset = int(npz['offset'])
+        if 'fingerprint' in npz.files:
+            self.fingerprint = str(npz['fingerprint'])
+        self._data = {}
+        for key in npz.files:
+            if key.startswith('gauge'):
+                self._data[int(key[5:])] = npz[key]
+
+    def save(self):
+        arrays = {'offset': np.array(self.offset),
+                  'fingerprint': np.array(self.fingerprint)}
+        for gaugeno, data in self._data.items():
+            arrays['gauge%s' % str(gaugeno).zfill(4)] = data
+        np.savez(self.storename, **arrays)
+
+    def update(self, save=True):
+        """
+        Parse the complete lines appended to fort.gauge since the last
+        update and append them to the columns of each gauge.
+        Returns the number of new rows.
+        """
+        if not os.path.exists(self.fname):
+            return 0
+        size = os.path.getsize(self.fname)
+        if self.offset > 0 and (size < self.offset or self.fingerprint !=
+                                fingerprint(self.fname, self.offset)):
+            # fort.gauge was rewritten by a new run, start over:
+            print "*** %s was rewritten, rebuilding store" % self.fname
+            self.offset = 0
+            self.fingerprint = ''
+            self._data = {}
+        if size == self.offset:
+            return 0
+        f = open(self.fname, 'rb')
+        f.seek(self.offset)
+        text = f.read(size - self.offset)
+        f.close()
+        # a run in progress may have written part of a line:
+        end = text.rfind(b'\n') + 1
+        if end == 0:
+            return 0
+        rows = np.fromstring(text[:end].replace(b'D', b'E'), sep=' ')
+        rows = rows.reshape((-1, 7))
+        self.offset += end
+        self.fingerprint = fingerprint(self.fname, self.offset)
+        self._append(rows)
+        if save:
+            self.save()
+        return rows.shape[0]
+
+    def _append(self, rows):
+        gaugeno = rows[:, 0].astype(int)
+        # stable sort keeps the time order within each gauge:
+        order = np.argsort(gaugeno, kind='mergesort')
+        gaugeno = gaugeno[order]
+        # reorder to t, level, h, hu, hv, eta:
+        rows = rows[order][:, [2, 1, 3, 4, 5, 6]]
+        nos, starts = np.unique(gaugeno, return_index=True)
+        stops = list(starts[1:]) + [len(gaugeno)]
+        for no, start, stop in zip(nos, starts, stops):
+            no = int(no)
+            if no in self._data:
+                self._data[no] = np.vstack((self._data[no], rows[start:stop]))
+            else:
+                self._data[no] = rows[start:stop].copy()
+
+    def follow(self, interval=10., maxidle=600.):
+        """
+        Keep updating the store while fort.gauge grows.  Returns after
+        fort.gauge has not changed for maxidle seconds.
+        """
+        idle = 0.
+        while idle < maxidle:
+            nrows = self.update()
+            if nrows > 0:
+                print "Added %s rows, %s bytes of %s converted" \
+                      % (nrows, self.offset, self.fname)
+                idle = 0.
+            else:
+                idle += interval
+            time.sleep(interval)
+
+
+def read_setgauges(outdir='_output'):
+    """
+    Return a dictionary mapping gaugeno to [x, y, t1, t2] from setgauges.data.
+    """
+    lines = open(os.path.join(outdir, 'setgauges.data')).readlines()
+    gauges = {}
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) == 5 and not line.startswith('#'):
+            gauges[int(tokens[0])] = [float(v) for v in tokens[1:]]
+    return gauges
+
+
+def fill_plotdata(plotdata, outdir=None):
+    """
+    Put every gauge of the store into the gauge cache of a
+    pyclaw ClawPlotData object, so the each_gauge figures do not
+    re-read fort.gauge for every gauge.
+    """
+    if not hasattr(plotdata, 'gaugesoln_dict'):
+        return
+    if outdir is None:
+        outdir = plotdata.outdir
+    store = GaugeStore(outdir)
+    try:
+        locations = read_setgauges(outdir)
+    except IOError:
+        locations = {}
+    key_outdir = os.path.abspath(outdir)
+    for gaugeno in store.gaugenos:
+        g = store.gauge(gaugeno)
+        if gaugeno in locations:
+            g.x, g.y, g.t1, g.t2 = locations[gaugeno]
+            g.location = (g.x, g.y)
+        plotdata.gaugesoln_dict[(gaugeno, key_outdir)] = g
+
+
+if __name__ == '__main__':
+    import sys
+    outdir = '_output'
+    if len(sys.argv) > 1:
+        outdir = sys.argv[1]
+    store = GaugeStore(outdir)
+    print "%s gauges, %s bytes of fort.gauge converted" \
+          % (len(store.gaugenos), store.offset)
+    if len(sys.argv) > 2 and sys.argv[2] == 'follow':
+        store.follow()
@@ -0,0 +1,326 @@
+"""
+Vectorized, chunked and cached Okada model for dtopo files.
+
+Computes the static sea floor deformation of a set of rectangular
+subfaults with the Okada (1985) formulas, evaluated for all subfaults
+and all points of a chunk of the dtopo mesh at once with numpy.  The
+mesh is split into chunks of rows so the memory used stays bounded, and
+the chunks can be computed on a pool of processes.
+
+The deformation is cached in cachedir, keyed by a hash of the subfault
+parameters and of the dtopo_params dictionary (except the file name), so
+a scenario is only recomputed when one of its parameters changes.
+
+The subfaults are dictionaries as returned by
+dtopotools.read_subfault_model, with lengths in meters and angles in
+degrees, and dtopo_params is the dictionary set up in maketopo.py:
+    >>> import okadavec
+    >>> dz = okadavec.make_dtopo_from_subfaults(subfaults, dtopo_params)
+
+The deformation is checked against okada2 of pyclaw for the subfaults of
+maketopo.py given at each latlong_location with
+    $ python okadavec.py
+
+"""
+
+import os, hashlib
+import numpy as np
+
+poisson = 0.25
+Rearth = 6367.5e3                  # as in setrun.py
+deg2rad = np.pi/180.
+lat2meter = Rearth*deg2rad
+
+# changed when the deformation computed for given parameters changes, so
+# cached deformations and dtopo files are made again:
+version = 2
+
+# number of (subfault, point) pairs evaluated at once:
+chunk_elements = 2**22
+
+_subfault_keys = ['latitude', 'longitude', 'depth', 'slip', 'rake',
+                  'strike', 'dip', 'length', 'width']
+
+
+def subfault_arrays(subfaults):
+    """
+    Return a dictionary of arrays, one entry per subfault, of the parameters
+    needed by the Okada model, with the location moved to the bottom
+    center of each subfault.
+    """
+    p = {}
+    for key in _subfault_keys:
+        p[key] = np.array([float(s[key]) for s in subfaults])
+    location = [s.get('latlong_location', 'top center') for s in subfaults]
+    dip = deg2rad*p['dip']
+    strike = deg2rad*p['strike']
+    # horizontal offset (in meters) of the top edge from the bottom edge:
+    up_dip_x = -p['width']*np.cos(dip)*np.cos(strike)
+    up_dip_y = p['width']*np.cos(dip)*np.sin(strike)
+    coslat = np.cos(deg2rad*p['latitude'])
+    # fraction of the width between the given point and the bottom edge:
+    frac = np.array([{'top center': 1., 'centroid': 0.5,
+                      'bottom center': 0.}[loc] for loc in location])
+    p['x_bottom'] = p['longitude'] - frac*up_dip_x/(lat2meter*coslat)
+    p['y_bottom'] = p['latitude'] - frac*up_dip_y/lat2meter
+    p['depth_bottom'] = p['depth'] + frac*p['width']*np.sin(dip)
+    return p
+
+
+def _strike_slip(y1, y2, ang_dip, q):
+    sn = np.sin(ang_dip)
+    cs = np.cos(ang_dip)
+    d_bar = y2*sn - q*cs
+    r = np.sqrt(y1**2 + y2**2 + q**2)
+    a4 = 2.0*poisson/cs*(np.log(r + d_bar) - sn*np.log(r + y2))
+    return -(d_bar*q/r/(r + y2) + q*sn/(r + y2) + a4*sn)/(2.0*np.pi)
+
+
+def _dip_slip(y1, y2, ang_dip, q):
+    sn = np.sin(ang_dip)
+    cs = np.cos(ang_dip)
+    d_bar = y2*sn - q*cs
+    r = np.sqrt(y1**2 + y2**2 + q**2)
+    xx = np.sqrt(y1**2 + q**2)
+    a5 = 4.*poisson/cs*np.arctan((y2*(xx + q*cs) + xx*(r + xx)*sn)
+                                 / y1/(r + xx)/cs)
+    return -(d_bar*q/r/(r + y1) + sn*np.arctan(y1*y2/q/r) - a5*sn*cs) \
+           / (2.0*np.pi)
+
+
+def okada_dz(p, x, y):
+    """
+    Vertical displacement at the points x, y (1d arrays of longitude and
+    latitude) summed over all subfaults in p (from subfault_arrays).
+    Subfaults are evaluated in blocks so that at most chunk_elements
+    (subfault, point) pairs are held at once.
+    """
+    dz = np.zeros(x.shape)
+    nsub = len(p['slip'])
+    block = max(1, chunk_elements // max(1, x.size))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k1 in range(0, nsub, block):
+            s = slice(k1, k1 + block)
+            col = lambda key: p[key][s][:, np.newaxis]
+            ang_dip = deg2rad*col('dip')
+            ang_rake = deg2rad*col('rake')
+            ang_strike = deg2rad*col('strike')
+            halfL = 0.5*col('length')
+            w = col('width')
+            depth_bottom = col('depth_bottom')
+
+            xx = lat2meter*np.cos(deg2rad*y)*(x - col('x_bottom'))
+            yy = lat2meter*(y - col('y_bottom'))
+            # distance along strike and up the fault plane:
+            x1 = xx*np.sin(ang_strike) + yy*np.cos(ang_strike)
+            x2 = -(xx*np.cos(ang_strike) - yy*np.sin(ang_strike))
+            pp = x2*np.cos(ang_dip) + depth_bottom*np.sin(ang_dip)
+            q = x2*np.sin(ang_dip) - depth_bottom*np.cos(ang_dip)
+
+            f = _strike_slip(x1 + halfL, pp, ang_dip, q) \
+                - _strike_slip(x1 + halfL, pp - w, ang_dip, q) \
+                - _strike_slip(x1 - halfL, pp, ang_dip, q) \
+                + _strike_slip(x1 - halfL, pp - w, ang_dip, q)
+            g = _dip_slip(x1 + halfL, pp, ang_dip, q) \
+                - _dip_slip(x1 + halfL, pp - w, ang_dip, q) \
+                - _dip_slip(x1 - halfL, pp, ang_dip, q) \
+                + _dip_slip(x1 - halfL, pp - w, ang_dip, q)
+
+            slip = col('slip')
+            dzk = slip*np.cos(ang_rake)*f + slip*np.sin(ang_rake)*g
+            dz += np.nansum(dzk, axis=0)
+    return dz
+
+
+def mesh(dtopo_params):
+    """
+    Return the 1d arrays x, y of the dtopo mesh.
+    """
+    x = np.linspace(dtopo_params['xlower'], dtopo_params['xupper'],
+                    dtopo_params['mx'])
+    y = np.linspace(dtopo_params['ylower'], dtopo_params['yupper'],
+                    dtopo_params['my'])
+    return x, y
+
+
+def _dz_rows(args):
+    # Worker: deformation on rows j1:j2 of the mesh, shape (j2-j1, mx).
+    p, x, y = args
+    X, Y = np.meshgrid(x, y)
+    return okada_dz(p, X.ravel(), Y.ravel()).reshape(X.shape)
+
+
+def compute_dz(subfaults, dtopo_params, nprocs=1):
+    """
+    Deformation dz on the dtopo mesh, shape (my, mx) with row 0 at
+    ylower.  The mesh is split into chunks of rows that are computed
+    serially if nprocs == 1 or on a pool of nprocs processes (one per
+    cpu if None).
+    """
+    p = subfault_arrays(subfaults)
+    x, y = mesh(dtopo_params)
+    nsub = len(subfaults)
+    rows = max(1, chunk_elements // max(1, nsub*len(x)))
+    work = [(p, x, y[j:j+rows]) for j in range(0, len(y), rows)]
+    if nprocs == 1 or len(work) == 1:
+        chunks = [_dz_rows(args) for args in work]
+    else:
+        from multiprocessing import Pool
+        pool = Pool(nprocs)
+        try:
+            chunks = pool.map(_dz_rows, work)
+        finally:
+            pool.close()
+            pool.join()
+    return np.vstack(chunks)
+
+
+def params_hash(subfaults, dtopo_params):
+    """
+    Hash of the subfault parameters and the dtopo parameters that
+    determine the deformation (the output file name is not included).
+    """
+    sha = hashlib.sha1()
+    sha.update(('okadavec %s' % version).encode())
+    for subfault in subfaults:
+        sha.update(repr(sorted(subfault.items())).encode())
+    params = [(key, value) for (key, value) in sorted(dtopo_params.items())
+              if key != 'fname']
+    sha.update(repr(params).encode())
+    return sha.hexdigest()
+
+
+def write_dtopo(dz, dtopo_params):
+    """
+    Write the dtopotype 3 file dtopo_params['fname'] for a static
+    deformation: zero at the first time and dz at the later times.
+    """
+    mx, my = dtopo_params['mx'], dtopo_params['my']
+    mt = dtopo_params['ntimes']
+    t0, tfinal = dtopo_params['t0'], dtopo_params['tfinal']
+    dx = (dtopo_params['xupper'] - dtopo_params['xlower'])/(mx - 1.)
+    dy = (dtopo_params['yupper'] - dtopo_params['ylower'])/(my - 1.)
+    dt = (tfinal - t0)/max(mt - 1., 1.)
+    fid = open(dtopo_params['fname'], 'w')
+    fid.write("%7i       mx \n" % mx)
+    fid.write("%7i       my \n" % my)
+    fid.write("%7i       mt \n" % mt)
+    fid.write("%20.14e   xlower\n" % dtopo_params['xlower'])
+    fid.write("%20.14e   ylower\n" % dtopo_params['ylower'])
+    fid.write("%20.14e   t0\n" % t0)
+    fid.write("%20.14e   dx\n" % dx)
+    fid.write("%20.14e   dy\n" % dy)
+    fid.write("%20.14e   dt\n" % dt)
+    for k in range(mt):
+        if k == 0:
+            dzk = np.zeros(dz.shape)
+        else:
+            dzk = dz
+        # rows are written from north to south:
+        np.savetxt(fid, dzk[::-1, :], fmt='%012.6e', delimiter='   ')
+    fid.close()
+
+
+def make_dtopo_from_subfaults(subfaults, dtopo_params, nprocs=1,
+                              cachedir='_dtopo_cache'):
+    """
+    Compute (or take from the cache) the deformation of subfaults on the
+    mesh of dtopo_params, write the dtopo file dtopo_params['fname'] and
+    return dz.
+    """
+    key = params_hash(subfaults, dtopo_params)
+    cachename = os.path.join(cachedir, key + '.npy')
+    if os.path.exists(cachename):
+        print "Using cached deformation %s" % cachename
+        dz = np.load(cachename)
+    else:
+        dz = compute_dz(subfaults, dtopo_params, nprocs)
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        np.save(cachename, dz)
+    write_dtopo(dz, dtopo_params)
+    open(dtopo_params['fname'] + '.sha1', 'w').write(key + '\n')
+    return dz
+
+
+def dtopo_is_current(subfaults, dtopo_params):
+    """
+    True if dtopo_params['fname'] was written for these parameters.
+    """
+    fname = dtopo_params['fname']
+    if not (os.path.exists(fname) and os.path.exists(fname + '.sha1')):
+        return False
+    key = open(fname + '.sha1').read().strip()
+    return key == params_hash(subfaults, dtopo_params)
+
+
+def move_location(subfault, location):
+    """
+    Copy of subfault with latitude, longitude and depth given at location
+    ('top center', 'centroid' or 'bottom center') instead.
+    """
+    # fraction of the width between the top edge and each location:
+    down_dip = {'top center': 0., 'centroid': 0.5, 'bottom center': 1.}
+    frac = down_dip[location] \
+           - down_dip[subfault.get('latlong_location', 'top center')]
+    dip = deg2rad*float(subfault['dip'])
+    strike = deg2rad*float(subfault['strike'])
+    w = float(subfault['width'])
+    coslat = np.cos(deg2rad*float(subfault['latitude']))
+    s = dict(subfault)
+    s['depth'] = float(subfault['depth']) + frac*w*np.sin(dip)
+    s['longitude'] = float(subfault['longitude']) \
+                     + frac*w*np.cos(dip)*np.cos(strike)/(lat2meter*coslat)
+    s['latitude'] = float(subfault['latitude']) \
+                    - frac*w*np.cos(dip)*np.sin(strike)/lat2meter
+    s['latlong_location'] = location
+    return s
+
+
+def check_okada2(subfaults, dtopo_params):
+    """
+    Compare compute_dz with the sum over the subfaults of okada2.okadamap
+    of pyclaw on the dtopo mesh.  Returns the largest difference and the
+    largest |dz| of okada2.  okada2 uses a slightly different radius of
+    the earth, so the difference is small but not zero.
+    """
+    from pyclaw.geotools import okada2
+    x, y = mesh(dtopo_params)
+    dz2 = np.zeros((len(y), len(x)))
+    for subfault in subfaults:
+        # okadamap takes the top center:
+        s = move_location(subfault, 'top center')
+        okadaparams = {'Focal_Depth': s['depth'],
+                       'Fault_Length': s['length'],
+                       'Fault_Width': s['width'],
+                       'Dislocation': s['slip'],
+                       'Strike_Direction': s['strike'],
+                       'Dip_Angle': s['dip'],
+                       'Slip_Angle': s['rake'],
+                       'Epicenter_Latitude': s['latitude'],
+                       'Epicenter_Longitude': s['longitude']}
+        dz2 += okada2.okadamap(okadaparams, x, y)
+    dz = compute_dz(subfaults, dtopo_params)
+    return np.abs(dz - dz2).max(), np.abs(dz2).max()
+
+
+if __name__ == '__main__':
+    # Check against okada2 for the subfaults of maketopo.py given at each
+    # location:
+    import sys
+    import maketopo
+    subfaults = maketopo.read_subfaults()
+    dtopo_params = maketopo.java2_dtopo_params()
+    failed = False
+    for location in ['top center', 'centroid', 'bottom center']:
+        moved = [move_location(s, location) for s in subfaults]
+        diff, dzmax = check_okada2(moved, dtopo_params)
+        print "%-14s largest |dz| %.2f m, difference from okada2 %.4f m" \
+              % (location, dzmax, diff)
+        # the radius of okada2 moves points far from the subfault by about
+        # 0.2%, which gives differences of about 1.5% on steep slopes:
+        if diff > 0.03*dzmax:
+            print "*** okadavec differs from okada2 for %s" % location
+            failed = True
+    if failed:
+        sys.exit(1)
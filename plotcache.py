@@ -0,0 +1,191 @@
+"""
+Cache of derived plot variables shared by all plot items and figures.
+
+In setplot.py the same function, e.g. geoplot.surface_or_depth, is the
+plot_var of items in several figures, and geoplot.topo is used twice in
+each zoomed figure, so it is evaluated many times on the same grid of the
+same frame.  Wrapping a plot_var function with cached() makes the
+plotting loop look up the result by (outdir, frame, grid, plot_var)
+first and only call the function on a miss, where the grid is known by
+its level, lower corner and size.  The cache holds at most
+maxbytes of arrays and evicts the least recently used entries first.
+
+To use in setplot.py:
+    >>> import plotcache
+    >>> surface_or_depth = plotcache.cached(geoplot.surface_or_depth)
+    >>> plotitem.plot_var = surface_or_depth
+
+To check that two plot items on the same grid share one evaluation, on
+the grids of a frame of _output:
+    $ python plotcache.py _output 1
+
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+
+class PlotVarCache(object):
+    """
+    LRU cache of arrays bounded by the total number of bytes held.
+    """
+
+    def __init__(self, maxbytes=256*1024**2):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the value stored for key, or None.
+        """
+        try:
+            value, nbytes = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        # re-insert to mark as most recently used:
+        self._entries[key] = (value, nbytes)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        nbytes = _nbytes(value)
+        if nbytes > self.maxbytes:
+            return
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.maxbytes:
+            oldkey, (oldvalue, oldbytes) = self._entries.popitem(last=False)
+            self.nbytes -= oldbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+
+def _nbytes(value):
+    # Memory held by a plot_var result (array, masked array or scalar).
+    nbytes = getattr(value, 'nbytes', 0)
+    mask = getattr(value, 'mask', None)
+    if mask is not None and mask is not np.ma.nomask:
+        nbytes += mask.nbytes
+    return nbytes
+
+
+cache = PlotVarCache()
+
+
+def grid_key(grid, q=None):
+    """
+    (level, xlower, ylower, mx, my) identifying grid, a grid of pyclaw
+    (with dimensions) or a frameindex.Patch, or None.
+    """
+    if grid is None:
+        return None
+    level = getattr(grid, 'level', None)
+    dimensions = getattr(grid, 'dimensions', None)
+    if dimensions is not None:
+        lower = tuple([float(d.lower) for d in dimensions])
+    elif hasattr(grid, 'xlow'):
+        lower = (grid.xlow, grid.ylow)
+    else:
+        return None
+    if q is None:
+        q = getattr(grid, 'q', None)
+    if q is None:
+        return None
+    return (level,) + lower + tuple(q.shape[:2])
+
+
+def cache_key(current_data, plot_var):
+    """
+    Key identifying the result of plot_var on the grid in current_data,
+    or None if the grid cannot be identified.  The plotting loop does not
+    set a grid number in current_data, so the grid is identified by its
+    level, lower corner and size.
+    """
+    frameno = getattr(current_data, 'frameno', None)
+    grid = getattr(current_data, 'grid', None)
+    if grid is None:
+        grid = getattr(current_data, 'patch', None)
+    key = grid_key(grid, getattr(current_data, 'q', None))
+    if frameno is None or key is None:
+        return None
+    plotdata = getattr(current_data, 'plotdata', None)
+    outdir = getattr(plotdata, 'outdir', None)
+    name = getattr(plot_var, '__module__', '') + '.' + \
+           getattr(plot_var, '__name__', repr(plot_var))
+    return (outdir, frameno, key, name)
+
+
+def cached(plot_var, plotvar_cache=None):
+    """
+    Return a plot_var function that gives the same result as plot_var
+    but looks it up in plotvar_cache (the module cache if None) first.
+    """
+    if plotvar_cache is None:
+        plotvar_cache = cache
+
+    def cached_plot_var(current_data):
+        key = cache_key(current_data, plot_var)
+        if key is None:
+            return plot_var(current_data)
+        value = plotvar_cache.get(key)
+        if value is None:
+            value = plot_var(current_data)
+            plotvar_cache.put(key, value)
+        return value
+
+    cached_plot_var.__name__ = getattr(plot_var, '__name__', 'plot_var')
+    cached_plot_var.__doc__ = getattr(plot_var, '__doc__', None)
+    return cached_plot_var
+
+
+if __name__ == '__main__':
+    # Two plot items with the same plot_var on each grid of a frame, with
+    # current_data set as the plotting loop sets it:
+    import sys
+    import frameindex
+    outdir = '_output'
+    frameno = 1
+    if len(sys.argv) > 1:
+        outdir = sys.argv[1]
+    if len(sys.argv) > 2:
+        frameno = int(sys.argv[2])
+
+    class CurrentData(object):
+        pass
+
+    class PlotData(object):
+        outdir = outdir
+
+    calls = []
+    def surface(current_data):
+        calls.append(1)
+        return current_data.q[:, :, -1]
+
+    plotvar_cache = PlotVarCache()
+    items = [cached(surface, plotvar_cache), cached(surface, plotvar_cache)]
+    current_data = CurrentData()
+    current_data.plotdata = PlotData()
+    current_data.frameno = frameno
+    ngrids = 0
+    for grid in frameindex.IndexedFrame(frameno, outdir).itergrids():
+        current_data.grid = grid
+        current_data.q = grid.q
+        for plot_var in items:
+            plot_var(current_data)
+        ngrids += 1
+    print "%s grids, %s evaluations, %s hits, %s misses" \
+          % (ngrids, len(calls), plotvar_cache.hits, plotvar_cache.misses)
+    if len(calls) != ngrids or plotvar_cache.hits != ngrids:
+        print "*** The second plot item did not hit the cache"
+        sys.exit(1)
@@ -0,0 +1,350 @@
+"""
+Incremental version of "make .plots".
+
+A manifest plotdir/plot_manifest.json records for each work item of
+plotpool.py (a frame and figure, a gauge or another figure) a hash of
+its inputs when it was last plotted:
+    frame items:    the files fort.qNNNN and fort.tNNNN of the frame and
+                    the setup of the figure
+    gauge items:    the columns of the gauge (see gaugestore.py) and the
+                    setup of all gauge figures
+    other items:    all fort.* files of outdir and the setup of the figure
+The setup of a figure is hashed from its attributes, axes and items in
+setplot.py, including the code, defaults and closures of the functions
+they refer to and the module level functions and values these use, so
+changing a colormap, a limit or an afteraxes function only changes the
+hash of the figures using it.  Settings of plotdata outside the figures
+(except those for the index only) go into every hash.
+
+Only the items whose hash changed or whose plot is missing are plotted,
+in parallel with plotpool.plotclaw_parallel, and the html and latex index
+files are then rewritten for the frames and gauges all of whose plots are
+in the manifest.  The hash of a file is only recomputed when its size or
+modification time changed.
+
+To use:
+    $ python plotmanifest.py _output _plots setplot.py 8
+or
+    $ make plots_incremental
+and add "force" to replot everything.
+
+"""
+
+import os, re, sys, glob, time, json, types, hashlib
+import numpy as np
+
+import plotpool
+
+manifest_name = 'plot_manifest.json'
+
+# plotdata attributes that only affect the index files:
+index_only = ['print_framenos', 'print_gaugenos', 'print_fignos', 'html',
+              'latex', 'printfigs']
+index_prefixes = ('html_', 'latex_', '_')
+
+
+def _update(md5, obj, seen, skip):
+    # Feed a stable description of obj to md5, recursing into containers,
+    # functions and instances.  seen holds the ids already visited, skip
+    # the ids of objects described by their type only.
+    if obj is None or isinstance(obj, (bool, int, long, float, complex,
+                                       basestring)):
+        md5.update('%s:%r;' % (type(obj).__name__, obj))
+        return
+    if id(obj) in skip:
+        md5.update('<%s>;' % type(obj).__name__)
+        return
+    if id(obj) in seen:
+        md5.update('<seen>;')
+        return
+    seen.add(id(obj))
+    if isinstance(obj, np.memmap):
+        # the contents are output, not setup:
+        md5.update('memmap:%s%s%s;' % (obj.filename, obj.shape, obj.dtype))
+    elif isinstance(obj, np.ndarray):
+        md5.update('array:%s%s;' % (obj.shape, obj.dtype))
+        md5.update(np.ascontiguousarray(obj).tostring())
+        mask = getattr(obj, 'mask', None)
+        if mask is not None and mask is not np.ma.nomask:
+            md5.update(np.ascontiguousarray(mask).tostring())
+    elif isinstance(obj, (list, tuple)):
+        md5.update('%s:%d;' % (type(obj).__name__, len(obj)))
+        for value in obj:
+            _update(md5, value, seen, skip)
+    elif isinstance(obj, dict):
+        md5.update('dict:%d;' % len(obj))
+        for key in sorted(obj.keys(), key=repr):
+            _update(md5, key, seen, skip)
+            _update(md5, obj[key], seen, skip)
+    elif isinstance(obj, (set, frozenset)):
+        md5.update('set:%s;' % sorted(repr(value) for value in obj))
+    elif isinstance(obj, types.ModuleType):
+        md5.update('module:%s;' % obj.__name__)
+    elif isinstance(obj, (type, types.ClassType)):
+        md5.update('class:%s.%s;' % (obj.__module__, obj.__name__))
+    elif isinstance(obj, types.FunctionType):
+        md5.update('function:%s;' % obj.__name__)
+        _update_code(md5, obj.__code__, obj.__globals__, seen, skip)
+        _update(md5, obj.__defaults__, seen, skip)
+        for cell in obj.__closure__ or ():
+            _update(md5, cell.cell_contents, seen, skip)
+    elif isinstance(obj, types.MethodType):
+        _update(md5, obj.im_func, seen, skip)
+        _update(md5, obj.im_self, seen, skip)
+    elif isinstance(obj, types.BuiltinFunctionType):
+        md5.update('builtin:%s.%s;' % (getattr(obj, '__module__', None),
+                                      obj.__name__))
+    elif hasattr(obj, '__dict__'):
+        md5.update('object:%s;' % type(obj).__name__)
+        _update(md5, vars(obj), seen, skip)
+    else:
+        # no stable description, e.g. a file:
+        md5.update('<%s>;' % type(obj).__name__)
+
+
+def _update_code(md5, code, globals, seen, skip):
+    md5.update(code.co_code)
+    md5.update(repr(code.co_names))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code(md5, const, globals, seen, skip)
+        else:
+            _update(md5, const, seen, skip)
+    # module level functions and values used by the code:
+    for name in code.co_names:
+        if name in globals:
+            md5.update('global:%s;' % name)
+            _update(md5, globals[name], seen, skip)
+
+
+def setup_hash(obj, skip=()):
+    """
+    Hash of the setup held by obj (e.g. a plotfigure), with the objects
+    in skip (e.g. plotdata) not looked into.
+    """
+    md5 = hashlib.md5()
+    _update(md5, obj, set(), set(id(s) for s in skip))
+    return md5.hexdigest()
+
+
+def plotdata_hash(plotdata):
+    """
+    Hash of the settings of plotdata outside the figures that affect the
+    plots rather than only the index.
+    """
+    settings = {}
+    for name, value in vars(plotdata).items():
+        if name in index_only or name.startswith(index_prefixes) or \
+                name in ('plotfigure_dict', 'otherfigure_dict'):
+            continue
+        settings[name] = value
+    return setup_hash(settings, [plotdata])
+
+
+class PlotManifest(object):
+    """
+    Input hashes of the plots in plotdir and hashes of the files they were
+    made from, kept in plotdir/plot_manifest.json.
+    """
+
+    def __init__(self, plotdir='_plots'):
+        self.fname = os.path.join(plotdir, manifest_name)
+        self.items = {}
+        self.files = {}
+        if os.path.exists(self.fname):
+            try:
+                data = json.load(open(self.fname))
+                self.items = data['items']
+                self.files = data['files']
+            except (ValueError, KeyError), e:
+                print "*** Ignoring unreadable %s: %s" % (self.fname, e)
+
+    def file_hash(self, fname, blocksize=2**20):
+        """
+        Hash of the contents of fname, recomputed only if its size or
+        modification time changed.  None if it does not exist.
+        """
+        if not os.path.exists(fname):
+            return None
+        fname = os.path.abspath(fname)
+        stamp = [os.path.getsize(fname), os.path.getmtime(fname)]
+        entry = self.files.get(fname)
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+        md5 = hashlib.md5()
+        f = open(fname, 'rb')
+        block = f.read(blocksize)
+        while block:
+            md5.update(block)
+            block = f.read(blocksize)
+        f.close()
+        self.files[fname] = stamp + [md5.hexdigest()]
+        return md5.hexdigest()
+
+    def save(self):
+        f = open(self.fname, 'w')
+        json.dump({'items': self.items, 'files': self.files}, f, indent=1,
+                  sort_keys=True)
+        f.close()
+
+
+def item_key(item):
+    """
+    Key of a plotpool work item in the manifest, e.g. 'frame 1 15'.
+    """
+    return ' '.join([str(v) for v in item if v is not None])
+
+
+def _combine(*hashes):
+    return hashlib.md5(' '.join([str(h) for h in hashes])).hexdigest()
+
+
+def output_files(outdir):
+    """
+    The fort.* files written by xgeoclaw in outdir, without those derived
+    from them (indices, caches).
+    """
+    fnames = glob.glob(os.path.join(outdir, 'fort.*'))
+    return sorted([f for f in fnames
+                   if re.match(r'fort\.[a-z]+[0-9_]*$', os.path.basename(f))])
+
+
+def item_hashes(plotdata, items, manifest):
+    """
+    Dictionary of item_key(item) to the hash of its inputs for the
+    plotpool work items.
+    """
+    outdir = plotdata.outdir
+    common = plotdata_hash(plotdata)
+    figures = {}
+    for name in plotdata._fignames:
+        plotfigure = plotdata.plotfigure_dict[name]
+        figures[plotfigure.figno] = setup_hash(plotfigure, [plotdata])
+    gauge_setup = _combine(*[figures[figno] for figno, name
+                             in plotpool.figures_of_type(plotdata,
+                                                         'each_gauge')])
+    store = None
+    hashes = {}
+    for item in items:
+        kind, number, figno = item
+        if kind == 'frame':
+            sframe = str(number).zfill(4)
+            inputs = [manifest.file_hash(os.path.join(outdir, 'fort.q' + sframe)),
+                      manifest.file_hash(os.path.join(outdir, 'fort.t' + sframe)),
+                      figures[figno]]
+        elif kind == 'gauge':
+            if store is None:
+                import gaugestore
+                store = gaugestore.GaugeStore(outdir)
+            data = ''
+            if number in store.gaugenos:
+                data = hashlib.md5(store.gauge(number).data.tostring()).hexdigest()
+            inputs = [data, gauge_setup]
+        else:
+            inputs = [manifest.file_hash(fname)
+                      for fname in output_files(outdir)]
+            inputs.append(setup_hash(plotdata.otherfigure_dict[number],
+                                     [plotdata]))
+        hashes[item_key(item)] = _combine(common, *inputs)
+    return hashes
+
+
+def plot_exists(plotdata, item):
+    """
+    True if the plot files of item are in plotdata.plotdir.
+    """
+    kind, number, figno = item
+    fmt = plotdata.print_format
+    if kind == 'frame':
+        fnames = [plotpool.plot_fname('frame', number, figno, fmt)]
+    elif kind == 'gauge':
+        fnames = [plotpool.plot_fname('gauge', number, g_figno, fmt)
+                  for g_figno, name in plotpool.figures_of_type(plotdata,
+                                                                'each_gauge')]
+    else:
+        fname = getattr(plotdata.otherfigure_dict[number], 'fname', None)
+        fnames = [fname] if fname else []
+    for fname in fnames:
+        if not os.path.exists(os.path.join(plotdata.plotdir, fname)):
+            return False
+    return True
+
+
+def plotclaw_incremental(outdir='_output', plotdir='_plots',
+                         setplot_file='setplot.py', nprocs=None, force=False):
+    """
+    Plot the work items of setplot_file whose inputs changed since the
+    manifest in plotdir was written (all if force), update the manifest
+    and write the index files for the frames and gauges it holds.
+    Returns the list of (item, seconds, error message) of plotpool.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+    if not os.path.isdir(plotdir):
+        os.mkdir(plotdir)
+    plotdata = plotpool.make_plotdata(outdir, plotdir, setplot_file)
+    manifest = PlotManifest(plotdir)
+    items = plotpool.work_items(plotdata)
+    hashes = item_hashes(plotdata, items, manifest)
+    stale = [item for item in items if force
+             or manifest.items.get(item_key(item)) != hashes[item_key(item)]
+             or not plot_exists(plotdata, item)]
+    print "%s of %s items changed" % (len(stale), len(items))
+
+    # items no longer made are dropped, failed ones are plotted next time:
+    keys = set(hashes.keys())
+    for key in manifest.items.keys():
+        if key not in keys:
+            del manifest.items[key]
+    for item in stale:
+        manifest.items.pop(item_key(item), None)
+    results = []
+    if stale:
+        results = plotpool.plotclaw_parallel(outdir, plotdir, setplot_file,
+                                             nprocs, items=stale, index=False)
+        for item, seconds, error in results:
+            if error is None:
+                manifest.items[item_key(item)] = hashes[item_key(item)]
+    manifest.save()
+    framenos, gaugenos = index_numbers(items, manifest)
+    plotpool.write_index(plotdata, framenos, gaugenos)
+    return results
+
+
+def index_numbers(items, manifest):
+    """
+    Frames and gauges all of whose work items are in the manifest.
+    """
+    framenos, gaugenos, missing = [], [], set()
+    for kind, number, figno in items:
+        if item_key((kind, number, figno)) not in manifest.items:
+            missing.add((kind, number))
+    for kind, number, figno in items:
+        if (kind, number) in missing:
+            continue
+        if kind == 'frame' and number not in framenos:
+            framenos.append(number)
+        elif kind == 'gauge' and number not in gaugenos:
+            gaugenos.append(number)
+    return framenos, gaugenos
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != 'force']
+    outdir = '_output'
+    plotdir = '_plots'
+    setplot_file = 'setplot.py'
+    nprocs = None
+    if len(args) > 0:
+        outdir = args[0]
+    if len(args) > 1:
+        plotdir = args[1]
+    if len(args) > 2:
+        setplot_file = args[2]
+    if len(args) > 3:
+        nprocs = int(args[3])
+    t0 = time.time()
+    results = plotclaw_incremental(outdir, plotdir, setplot_file, nprocs,
+                                   force='force' in sys.argv[1:])
+    print "Done: %s items in %.1f seconds" % (len(results), time.time() - t0)
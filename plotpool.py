@@ -0,0 +1,259 @@
+"""
+Parallel version of "make .plots".
+
+The figures set up in setplot.py are split into independent work items,
+one per (frame, figure) pair, one per gauge and one per other figure
+(e.g. the fixed grid plots), and the items are spread over a pool of
+processes.  Each process runs setplot once and then plots and saves the
+items it is given, using the same file names as the serial plotting
+routines (frame0001fig15.png, gauge0001fig300.png, ...).  The html and
+latex index files are only written after all processes have finished.
+
+To use:
+    $ python plotpool.py _output _plots setplot.py 8
+or
+    $ make plots_parallel
+
+"""
+
+import os, sys, glob, time
+
+import frameindex
+
+_plotdata = None
+
+
+def load_setplot(setplot_file='setplot.py'):
+    """
+    Import the setplot function from setplot_file.
+    """
+    import imp
+    setplot_file = os.path.abspath(setplot_file)
+    name = os.path.splitext(os.path.basename(setplot_file))[0]
+    module = imp.load_source(name, setplot_file)
+    return module.setplot
+
+
+def make_plotdata(outdir='_output', plotdir='_plots', setplot_file='setplot.py'):
+    """
+    Return a ClawPlotData object for outdir set up by setplot_file.
+    """
+    from pyclaw.plotters.data import ClawPlotData
+    plotdata = ClawPlotData()
+    plotdata.outdir = os.path.abspath(outdir)
+    plotdata.plotdir = os.path.abspath(plotdir)
+    plotdata.setplot = setplot_file
+    plotdata = load_setplot(setplot_file)(plotdata)
+    plotdata.outdir = os.path.abspath(outdir)
+    plotdata.plotdir = os.path.abspath(plotdir)
+    return plotdata
+
+
+def figures_of_type(plotdata, figtype):
+    """
+    Return a list of (figno, name) for the figures of type figtype
+    ('each_frame' or 'each_gauge') that are shown and printed.
+    """
+    figures = []
+    for name in plotdata._fignames:
+        plotfigure = plotdata.plotfigure_dict[name]
+        if plotfigure.type != figtype or not plotfigure.show:
+            continue
+        if plotdata.print_fignos != 'all' and \
+                plotfigure.figno not in plotdata.print_fignos:
+            continue
+        figures.append((plotfigure.figno, name))
+    return figures
+
+
+def print_framenos(plotdata):
+    framenos = plotdata.print_framenos
+    if framenos == 'all':
+        fnames = glob.glob(os.path.join(plotdata.outdir, 'fort.t[0-9]*'))
+        framenos = sorted([int(f[-4:]) for f in fnames])
+    return list(framenos)
+
+
+def print_gaugenos(plotdata):
+    gaugenos = plotdata.print_gaugenos
+    if gaugenos == 'all':
+        import gaugestore
+        try:
+            gaugenos = sorted(gaugestore.read_setgauges(plotdata.outdir).keys())
+        except IOError:
+            gaugenos = []
+    return list(gaugenos)
+
+
+def plot_fname(kind, number, figno, format='png'):
+    """
+    File name used by the serial plotting routines, e.g. frame0001fig15.png.
+    """
+    return '%s%sfig%s.%s' % (kind, str(number).zfill(4), figno, format)
+
+
+def work_items(plotdata):
+    """
+    List of the independent plotting tasks for plotdata:
+        ('frame', frameno, figno), ('gauge', gaugeno, None) and
+        ('other', name, None).
+    """
+    items = []
+    fignos = [figno for figno, name in figures_of_type(plotdata, 'each_frame')]
+    for frameno in print_framenos(plotdata):
+        for figno in fignos:
+            items.append(('frame', frameno, figno))
+    if len(figures_of_type(plotdata, 'each_gauge')) > 0:
+        for gaugeno in print_gaugenos(plotdata):
+            items.append(('gauge', gaugeno, None))
+    for name in getattr(plotdata, '_otherfignames', []):
+        otherfigure = plotdata.otherfigure_dict[name]
+        if getattr(otherfigure, 'makefig', None) is not None:
+            items.append(('other', name, None))
+    return items
+
+
+def _init_worker(outdir, plotdir, setplot_file):
+    # Each process sets up its own plotdata, since setplot.py defines
+    # closures that cannot be passed between processes.
+    global _plotdata
+    import matplotlib
+    matplotlib.use('Agg')
+    _plotdata = make_plotdata(outdir, plotdir, setplot_file)
+
+
+def _plot_item(item):
+    # Plot and save one work item, returns (item, seconds, error message).
+    import pylab
+    from pyclaw.plotters import frametools, gaugetools
+    plotdata = _plotdata
+    kind, number, figno = item
+    t0 = time.time()
+    error = None
+    try:
+        if kind == 'frame':
+            shown = {}
+            for name in plotdata._fignames:
+                plotfigure = plotdata.plotfigure_dict[name]
+                shown[name] = plotfigure.show
+                plotfigure.show = plotfigure.show and plotfigure.figno == figno
+            try:
+                frametools.plotframe(number, plotdata, verbose=False)
+            finally:
+                for name in shown:
+                    plotdata.plotfigure_dict[name].show = shown[name]
+            pylab.figure(figno)
+            pylab.savefig(os.path.join(plotdata.plotdir,
+                          plot_fname('frame', number, figno,
+                                     plotdata.print_format)))
+        elif kind == 'gauge':
+            gaugetools.plotgauge(number, plotdata, verbose=False)
+            for g_figno, name in figures_of_type(plotdata, 'each_gauge'):
+                pylab.figure(g_figno)
+                pylab.savefig(os.path.join(plotdata.plotdir,
+                              plot_fname('gauge', number, g_figno,
+                                         plotdata.print_format)))
+        elif kind == 'other':
+            cwd = os.getcwd()
+            os.chdir(plotdata.plotdir)
+            try:
+                plotdata.otherfigure_dict[number].makefig(plotdata)
+            finally:
+                os.chdir(cwd)
+    except Exception, e:
+        error = '%s: %s' % (e.__class__.__name__, e)
+    pylab.close('all')
+    return item, time.time() - t0, error
+
+
+def write_index(plotdata, framenos, gaugenos):
+    """
+    Write the html and latex index files for the plots in plotdata.plotdir,
+    as done at the end of the serial plotting.
+    """
+    from pyclaw.plotters import plotpages
+    frame_figures = figures_of_type(plotdata, 'each_frame')
+    gauge_figures = figures_of_type(plotdata, 'each_gauge')
+    frametimes = {}
+    for frameno in framenos:
+        frametimes[frameno] = frameindex.read_tfile(frameno,
+                                                    plotdata.outdir)['time']
+    plotdata.timeframes_framenos = framenos
+    plotdata.timeframes_frametimes = frametimes
+    plotdata.timeframes_fignos = [figno for figno, name in frame_figures]
+    plotdata.timeframes_fignames = dict(frame_figures)
+    plotdata.gauges_gaugenos = gaugenos
+    plotdata.gauges_fignos = [figno for figno, name in gauge_figures]
+    plotdata.gauges_fignames = dict(gauge_figures)
+
+    cwd = os.getcwd()
+    try:
+        if plotdata.latex:
+            plotpages.plotclaw2latex(plotdata)
+        if plotdata.html:
+            plotpages.plotclaw2html(plotdata)
+    finally:
+        os.chdir(cwd)
+
+
+def plotclaw_parallel(outdir='_output', plotdir='_plots',
+                      setplot_file='setplot.py', nprocs=None, items=None,
+                      index=True):
+    """
+    Make all plots requested in setplot_file on a pool of nprocs processes
+    (one per cpu if None) and then write the index files.
+    If items is given, only those work items are plotted, but the
+    index still covers all frames and gauges.  The index files are not
+    written if index is False.
+    Returns a list of (item, seconds, error message).
+    """
+    from multiprocessing import Pool
+    import matplotlib
+    matplotlib.use('Agg')
+
+    if not os.path.isdir(plotdir):
+        os.mkdir(plotdir)
+    plotdata = make_plotdata(outdir, plotdir, setplot_file)
+    if items is None:
+        items = work_items(plotdata)
+    print "Plotting %s items from %s into %s" % (len(items), outdir, plotdir)
+
+    pool = Pool(nprocs, _init_worker, (outdir, plotdir, setplot_file))
+    try:
+        # items are ordered by frame, so with one frame's figures per chunk
+        # a process evaluates the plot_var functions of a frame only once
+        # (see plotcache.py):
+        nfigs = len(figures_of_type(plotdata, 'each_frame'))
+        results = pool.map(_plot_item, items, chunksize=max(1, nfigs))
+    finally:
+        pool.close()
+        pool.join()
+
+    for item, seconds, error in results:
+        if error is not None:
+            print "*** Error plotting %s: %s" % (item, error)
+
+    # only now that every process is done can the index be merged:
+    if index:
+        write_index(plotdata, print_framenos(plotdata),
+                    print_gaugenos(plotdata))
+    return results
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    outdir = '_output'
+    plotdir = '_plots'
+    setplot_file = 'setplot.py'
+    nprocs = None
+    if len(args) > 0:
+        outdir = args[0]
+    if len(args) > 1:
+        plotdir = args[1]
+    if len(args) > 2:
+        setplot_file = args[2]
+    if len(args) > 3:
+        nprocs = int(args[3])
+    t0 = time.time()
+    results = plotclaw_parallel(outdir, plotdir, setplot_file, nprocs)
+    print "Done: %s items in %.1f seconds" % (len(results), time.time() - t0)
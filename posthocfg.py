@@ -0,0 +1,238 @@
+"""
+Fixed grids added after a run, filled from the frames fort.qNNNN.
+
+A fixed grid is given as in setrun.py,
+    [t1, t2, noutput, x1, x2, y1, y2, xpoints, ypoints,
+     ioutarrivaltimes, ioutsurfacemax]
+and for each frame with a time between t1 and t2 its values are written
+to outdir/fort.fgNN_NNNN in the format of xgeoclaw (see fgcube.py), so
+setplotfg.py, fgcube.py and ensemble.py use it like any other fixed grid.
+The fixed grid is added to outdir/setfixedgrids.data as number NN.  If a
+grid with the same extent, points and output flags is already listed
+there, its number is returned, and its output is left as it is when
+fort.fgNN_0001 exists, e.g. for a fixed grid of the run itself.
+
+The grids of a frame intersecting the fixed grid are found from the frame
+index (frameindex.py) and painted onto the points coarsest level first,
+so each point takes the finest grid covering it.  The points covered by a
+grid are a block of rows and columns of the fixed grid, found by index
+arithmetic, and h, hu, hv, eta are interpolated bilinearly from the cell
+centers of the grid (the nearest centers are used within half a cell of
+its edges), with B = eta - h.  Where one of the four cells is dry the
+values of the nearest cell are taken instead, so the surface is not mixed
+with the land.  Points no grid covers are nan.
+
+Unlike in xgeoclaw, the output times are those of the frames rather than
+noutput times, and the arrival times and the surface extrema are only
+taken over the frames.  As in xgeoclaw the arrival time is nan where no
+arrival has been seen yet.
+
+To use:
+    $ python posthocfg.py _output 128.05 128.20 -3.75 -3.65 100 100
+for Ambon Bay with surface extrema and arrival times, or interactively:
+    >>> import posthocfg
+    >>> fgno = posthocfg.make_fixedgrid('_output',
+    ...     [0,14400,17,128.63,128.73,-3.64,-3.54,100,100,0,1])  # Saparua
+
+"""
+
+import os, sys
+import numpy as np
+
+import frameindex
+
+arrival_tol = 1.e-2
+drytol = 1.e-3
+
+
+def fg_points(fixedgrid):
+    """
+    Coordinates x, y of the points of fixedgrid.
+    """
+    x1, x2, y1, y2 = fixedgrid[3:7]
+    return np.linspace(x1, x2, int(fixedgrid[7])), \
+           np.linspace(y1, y2, int(fixedgrid[8]))
+
+
+def _interpolate(row, q, x, y, values, level):
+    # Paint the points x, y inside the grid of index row, q of shape
+    # (mx, my, meqn), with values bilinear in the cell centers.
+    mx, my = int(row['mx']), int(row['my'])
+    xhi = row['xlow'] + mx*row['dx']
+    yhi = row['ylow'] + my*row['dy']
+    ix = np.where((x >= row['xlow']) & (x <= xhi))[0]
+    iy = np.where((y >= row['ylow']) & (y <= yhi))[0]
+    if len(ix) == 0 or len(iy) == 0:
+        return
+    # the points inside are contiguous:
+    sx = slice(ix[0], ix[-1] + 1)
+    sy = slice(iy[0], iy[-1] + 1)
+    fi = np.clip((x[sx] - row['xlow'])/row['dx'] - 0.5, 0., mx - 1.)
+    fj = np.clip((y[sy] - row['ylow'])/row['dy'] - 0.5, 0., my - 1.)
+    i0 = np.minimum(fi.astype(int), max(mx - 2, 0))
+    j0 = np.minimum(fj.astype(int), max(my - 2, 0))
+    i1 = np.minimum(i0 + 1, mx - 1)
+    j1 = np.minimum(j0 + 1, my - 1)
+    ax = (fi - i0)[np.newaxis, :, np.newaxis]
+    ay = (fj - j0)[:, np.newaxis, np.newaxis]
+    I0, J0 = i0[np.newaxis, :], j0[:, np.newaxis]
+    I1, J1 = i1[np.newaxis, :], j1[:, np.newaxis]
+    bilinear = (1-ay)*((1-ax)*q[I0, J0] + ax*q[I1, J0]) \
+             + ay*((1-ax)*q[I0, J1] + ax*q[I1, J1])
+    # next to dry cells the surface would be mixed with the land, so the
+    # nearest cell is used instead:
+    hmin = np.minimum(np.minimum(q[I0, J0, 0], q[I1, J0, 0]),
+                      np.minimum(q[I0, J1, 0], q[I1, J1, 0]))
+    nearest = q[np.round(fi).astype(int)[np.newaxis, :],
+                np.round(fj).astype(int)[:, np.newaxis]]
+    values[sy, sx] = np.where((hmin > drytol)[:, :, np.newaxis], bilinear,
+                              nearest)
+    level[sy, sx] = row['level']
+
+
+def interpolate_frame(frame, x, y):
+    """
+    Values of h, hu, hv, eta of frame (an IndexedFrame) at the points
+    x, y of a fixed grid, shape (len(y), len(x), 4), and the level used.
+    """
+    values = np.nan*np.ones((len(y), len(x), 4))
+    level = np.zeros((len(y), len(x)), dtype=int)
+    rows = frame.select(bbox=[x[0], x[-1], y[0], y[-1]])
+    f = open(frame.fname, 'rb')
+    try:
+        for row in np.sort(rows, order=['level', 'gridno']):
+            q = frame.read_q(row, f)[:, :, :4]
+            _interpolate(row, q, x, y, values, level)
+    finally:
+        f.close()
+    return values, level
+
+
+def write_fg(fname, t, fixedgrid, columns):
+    """
+    Write the columns, each of shape (ypoints, xpoints), of fixedgrid at
+    time t to fname in the format of xgeoclaw.
+    """
+    x1, x2, y1, y2 = fixedgrid[3:7]
+    my, mx = columns[0].shape
+    f = open(fname, 'w')
+    f.write('%18.8E    time\n' % t)
+    f.write('%5i    mx\n' % mx)
+    f.write('%5i    my\n' % my)
+    f.write('%18.8E    xlow\n' % x1)
+    f.write('%18.8E    ylow\n' % y1)
+    f.write('%18.8E    xhi\n' % x2)
+    f.write('%18.8E    yhi\n' % y2)
+    f.write('%5i  columns\n\n' % len(columns))
+    data = np.array([c.ravel() for c in columns]).T
+    np.savetxt(f, data, fmt='%26.16E')
+    f.close()
+
+
+def find_fixedgrid(fixedgrids, fixedgrid):
+    """
+    Number of the grid in fixedgrids with the extent, points and output
+    flags of fixedgrid (noutput is not compared), or None.
+    """
+    for k, other in enumerate(fixedgrids):
+        if np.allclose(other[:2], fixedgrid[:2]) and \
+                np.allclose(other[3:9], fixedgrid[3:9]) and \
+                list(other[9:11]) == list(fixedgrid[9:11]):
+            return k + 1
+    return None
+
+
+def add_to_setfixedgrids(outdir, fixedgrid, noutput):
+    """
+    Add fixedgrid with noutput output times to outdir/setfixedgrids.data
+    unless it is there (see find_fixedgrid), and return (its number, True
+    if it was added).
+    """
+    import fgcube
+    fname = os.path.join(outdir, 'setfixedgrids.data')
+    try:
+        fixedgrids = fgcube.read_setfixedgrids(outdir)
+        lines = open(fname).readlines()
+    except IOError:
+        fixedgrids, lines = [], ['1 =: nfixedgrids\n']
+    fgno = find_fixedgrid(fixedgrids, fixedgrid)
+    if fgno is not None:
+        return fgno, False
+    # the count is the first line that is not a comment or blank:
+    for n, line in enumerate(lines):
+        if line.strip() and not line.startswith('#'):
+            lines[n] = '%-25s =: nfixedgrids\n' % (len(fixedgrids) + 1)
+            break
+    # keep only the lines of the grids listed, then add the new one:
+    listed = [line for line in lines[n+1:] if line.strip()]
+    lines = lines[:n+1] + listed[:len(fixedgrids)]
+    fixedgrid = list(fixedgrid)
+    fixedgrid[2] = noutput
+    lines.append('  '.join(['%g' % v for v in fixedgrid]) + '\n')
+    open(fname, 'w').writelines(lines)
+    return len(fixedgrids) + 1, True
+
+
+def make_fixedgrid(outdir, fixedgrid, framenos=None):
+    """
+    Add fixedgrid to the output in outdir from the frames framenos (all if
+    None) with times in [t1, t2].  Returns the number of the fixed grid.
+    """
+    import fgcube
+    fixedgrid = [float(v) for v in fixedgrid]
+    t1, t2 = fixedgrid[:2]
+    if framenos is None:
+        framenos = frameindex.framenos(outdir)
+    frames = [frameindex.IndexedFrame(frameno, outdir) for frameno in framenos]
+    frames = [frame for frame in frames if t1 <= frame.t <= t2]
+    if len(frames) == 0:
+        raise ValueError("No frames in %s between t = %s and %s"
+                         % (outdir, t1, t2))
+    fgno, added = add_to_setfixedgrids(outdir, fixedgrid, len(frames))
+    if not added and os.path.exists(fgcube.fg_fname(fgno, 1, outdir)):
+        print "Fixed grid %s is already in %s" % (fgno, outdir)
+        return fgno
+    x, y = fg_points(fixedgrid)
+    arrival = np.nan*np.ones((len(y), len(x)))
+    etamin = np.inf*np.ones((len(y), len(x)))
+    etamax = -np.inf*np.ones((len(y), len(x)))
+    for k, frame in enumerate(frames):
+        values, level = interpolate_frame(frame, x, y)
+        h, hu, hv, eta = [values[:, :, m] for m in range(4)]
+        columns = [h, hu, hv, eta - h, eta]
+        covered = level > 0
+        wet = covered & (np.where(covered, h, 0.) > drytol)
+        if fixedgrid[9]:
+            arrived = np.isnan(arrival) & wet & (np.abs(np.where(wet, eta, 0.))
+                                                 > arrival_tol)
+            arrival[arrived] = frame.t
+            columns.append(arrival.copy())
+        if fixedgrid[10]:
+            etamin = np.where(wet, np.minimum(etamin, eta), etamin)
+            etamax = np.where(wet, np.maximum(etamax, eta), etamax)
+            columns += [np.where(np.isinf(etamin), 0., etamin),
+                        np.where(np.isinf(etamax), 0., etamax)]
+        write_fg(fgcube.fg_fname(fgno, k+1, outdir), frame.t, fixedgrid,
+                 columns)
+    return fgno
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 8:
+        print "Usage: python posthocfg.py outdir x1 x2 y1 y2 xpoints ypoints " \
+              "[t1 t2 [ioutarrivaltimes ioutsurfacemax]]"
+        sys.exit(1)
+    outdir = sys.argv[1]
+    x1, x2, y1, y2 = [float(v) for v in sys.argv[2:6]]
+    xpoints, ypoints = int(sys.argv[6]), int(sys.argv[7])
+    t1, t2 = 0., 1.e10
+    iarrival, isurfacemax = 1, 1
+    if len(sys.argv) > 9:
+        t1, t2 = float(sys.argv[8]), float(sys.argv[9])
+    if len(sys.argv) > 11:
+        iarrival, isurfacemax = int(sys.argv[10]), int(sys.argv[11])
+    fixedgrid = [t1, t2, 0, x1, x2, y1, y2, xpoints, ypoints, iarrival,
+                 isurfacemax]
+    fgno = make_fixedgrid(outdir, fixedgrid)
+    print "Wrote fixed grid %s to %s/fort.fg%s_NNNN" % (fgno, outdir,
+                                                       str(fgno).zfill(2))
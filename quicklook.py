@@ -0,0 +1,265 @@
+"""
+Quick look at a source with the linear long wave equations on a coarse
+uniform grid, to see which gauges and fixed grids it affects before
+running xgeoclaw.
+
+The depths of the first topo file found, subsampled by stride, are used
+on a lat-long grid with Rearth from setgeo, and the linear equations
+    eta_t + (M_x + (N cos(y))_y)/(Rearth cos(y)) = 0
+    M_t + g h eta_x/(Rearth cos(y)) = 0
+    N_t + g h eta_y/Rearth = 0
+for the surface eta and the fluxes M = hu, N = hv (x, y in radians) are
+advanced with a forward-backward scheme on a staggered grid.  Cells
+shallower than hmin are land, and a sponge layer along the edges of the
+grid absorbs outgoing waves.  The initial surface is the deformation of
+the dtopo files at their last time.
+
+The time series at the gauges are written to outdir/fort.gauge in the
+format of xgeoclaw, with level 0, so gaugestore.py and the gauge plots
+can read them and compare with a full run, and the largest |eta| at each
+gauge and in each fixed grid is reported.
+
+To use:
+    $ python quicklook.py                      # from setrun.py
+    $ python quicklook.py _scenarios/java2     # from the data files there
+which writes _quicklook/fort.gauge, or outdir given as a second argument.
+
+"""
+
+import os, sys
+import numpy as np
+
+import regioncheck, traveltime
+
+grav = 9.81
+
+
+class QuickLook(object):
+    """
+    Linear long wave solver on the grid x, y (degrees, increasing) with
+    depths h[j,i] at (x[i], y[j]).
+    """
+
+    def __init__(self, x, y, h, Rearth=6367.5e3, hmin=1., cfl=0.5,
+                 nsponge=10):
+        self.x, self.y = x, y
+        self.h = np.where(h > hmin, h, 0.)
+        self.wet = h > hmin
+        self.Rearth = Rearth
+        ny, nx = h.shape
+        self.dlam = np.radians(x[1] - x[0])
+        self.dphi = np.radians(y[1] - y[0])
+        phi = np.radians(y)
+        self.cosc = np.cos(phi)[:, np.newaxis]
+        self.cosf = np.cos(phi[:-1] + 0.5*self.dphi)[:, np.newaxis]
+        # depths at the interior cell edges, zero next to land:
+        self.hM = np.minimum(self.h[:, :-1], self.h[:, 1:])
+        self.hN = np.minimum(self.h[:-1, :], self.h[1:, :])
+        self.eta = np.zeros((ny, nx))
+        self.M = np.zeros((ny, nx+1))
+        self.N = np.zeros((ny+1, nx))
+        self.t = 0.
+        dxmin = Rearth*min(self.cosc.min()*self.dlam, self.dphi)
+        self.dt = cfl*dxmin/np.sqrt(grav*max(self.h.max(), 1.))
+
+        # sponge: damping factor 1 inside, decreasing towards the edges:
+        def ramp(n):
+            d = np.minimum(np.arange(n), np.arange(n)[::-1])
+            return 1. - 0.1*np.clip(1. - d/float(nsponge), 0., 1.)**2
+        self.damp = ramp(ny)[:, np.newaxis]*ramp(nx)[np.newaxis, :]
+
+    def set_eta(self, eta):
+        self.eta = np.where(self.wet, eta, 0.)
+
+    def step(self):
+        g, R, dt = grav, self.Rearth, self.dt
+        eta = self.eta
+        self.M[:, 1:-1] -= dt*g*self.hM/(R*self.cosc) \
+                           *(eta[:, 1:] - eta[:, :-1])/self.dlam
+        self.N[1:-1, :] -= dt*g*self.hN/R*(eta[1:, :] - eta[:-1, :])/self.dphi
+        # flux through the y edges, with cos at the edges:
+        Ncos = np.zeros(self.N.shape)
+        Ncos[1:-1, :] = self.N[1:-1, :]*self.cosf
+        divergence = (self.M[:, 1:] - self.M[:, :-1])/self.dlam \
+                   + (Ncos[1:, :] - Ncos[:-1, :])/self.dphi
+        self.eta = (eta - dt*divergence/(R*self.cosc))*self.damp
+        self.eta[~self.wet] = 0.
+        self.M[:, 1:-1] *= np.sqrt(self.damp[:, 1:]*self.damp[:, :-1])
+        self.N[1:-1, :] *= np.sqrt(self.damp[1:, :]*self.damp[:-1, :])
+        self.t += dt
+
+    def cell(self, xp, yp, search=3):
+        """
+        Index (j, i) of the nearest wet cell within search cells of
+        (xp, yp), or None.
+        """
+        if not (self.x[0] <= xp <= self.x[-1] and self.y[0] <= yp <= self.y[-1]):
+            return None
+        i = int(round((xp - self.x[0])/(self.x[1] - self.x[0])))
+        j = int(round((yp - self.y[0])/(self.y[1] - self.y[0])))
+        j1, i1 = max(j-search, 0), max(i-search, 0)
+        wet = self.wet[j1:j+search+1, i1:i+search+1]
+        if not wet.any():
+            return None
+        jj, ii = np.where(wet)
+        k = np.argmin((jj + j1 - j)**2 + (ii + i1 - i)**2)
+        return j1 + jj[k], i1 + ii[k]
+
+    def values(self, cells):
+        """
+        Array of rows h, hu, hv, eta at the cells.
+        """
+        rows = np.zeros((len(cells), 4))
+        for k, (j, i) in enumerate(cells):
+            hu = 0.5*(self.M[j, i] + self.M[j, i+1])
+            hv = 0.5*(self.N[j, i] + self.N[j+1, i])
+            rows[k] = [self.h[j, i] + self.eta[j, i], hu, hv, self.eta[j, i]]
+        return rows
+
+
+def initial_eta(x, y, dtopofiles, datadir=None):
+    """
+    Deformation of the dtopofiles at their last time on the grid x, y.
+    """
+    eta = np.zeros((len(y), len(x)))
+    for dtopofile in dtopofiles:
+        fname = regioncheck.input_fname(dtopofile[-1], datadir)
+        if fname is None:
+            raise IOError("dtopo file %s not found" % dtopofile[-1])
+        xd, yd, dz = traveltime.read_dtopo(fname)
+        # bilinear interpolation inside the dtopo grid:
+        fx = (x - xd[0])/(xd[1] - xd[0])
+        fy = (y - yd[0])/(yd[1] - yd[0])
+        okx = (fx >= 0) & (fx <= len(xd) - 1)
+        oky = (fy >= 0) & (fy <= len(yd) - 1)
+        fx, fy = fx[okx], fy[oky]
+        i0 = np.minimum(fx.astype(int), len(xd) - 2)
+        j0 = np.minimum(fy.astype(int), len(yd) - 2)
+        ax = (fx - i0)[np.newaxis, :]
+        ay = (fy - j0)[:, np.newaxis]
+        J, I = np.meshgrid(j0, i0, indexing='ij')
+        values = (1-ay)*((1-ax)*dz[J, I] + ax*dz[J, I+1]) \
+               + ay*((1-ax)*dz[J+1, I] + ax*dz[J+1, I+1])
+        eta[np.ix_(oky, okx)] += values
+    return eta
+
+
+def run(config, tfinal=None, dt_out=60., stride=4, **kwargs):
+    """
+    Run the quick look for config (from regioncheck.load_config) up to
+    tfinal (that of config by default, rounded up to a multiple of
+    dt_out).  Returns a dictionary with
+        gauges:     {gaugeno: array of rows t, level, h, hu, hv, eta}
+                    as the columns of gaugestore.GaugeColumns
+        gauge_max:  {gaugeno: largest |eta|}, for gauges in the grid
+        fg_max:     largest |eta| in each fixed grid, None if outside
+    """
+    datadir = config.get('datadir')
+    for topofile in config['topofiles']:
+        fname = regioncheck.input_fname(topofile[-1], datadir)
+        if fname is not None:
+            break
+    else:
+        raise IOError("None of the topo files was found")
+    x, y, h = traveltime.topo_grid(fname, int(topofile[0]), stride)
+    solver = QuickLook(x, y, h, config.get('Rearth', 6367.5e3), **kwargs)
+    solver.set_eta(initial_eta(x, y, config['dtopofiles'], datadir))
+    if tfinal is None:
+        tfinal = config['tfinal']
+
+    gaugenos, cells = [], []
+    for gauge in config['gauges']:
+        cell = solver.cell(gauge[1], gauge[2])
+        if cell is None:
+            print "*** gauge %d is not near a wet cell of the grid" % gauge[0]
+            continue
+        gaugenos.append(int(gauge[0]))
+        cells.append(cell)
+    fg_masks = []
+    for fg in config['fixedgrids']:
+        x1, x2, y1, y2 = fg[3:7]
+        mask = np.outer((y >= y1) & (y <= y2), (x >= x1) & (x <= x2)) \
+               & solver.wet
+        if not mask.any():
+            cell = solver.cell(0.5*(x1 + x2), 0.5*(y1 + y2))
+            if cell is not None:
+                mask[cell] = True
+        fg_masks.append(mask if mask.any() else None)
+
+    nout = int(np.ceil(tfinal/dt_out - 1e-9)) + 1
+    series = np.zeros((nout, len(cells), 6))
+    fg_max = [0. if mask is not None else None for mask in fg_masks]
+    # the forward-backward scheme needs a constant time step, so dt_out is
+    # made a whole number of steps:
+    nsub = int(np.ceil(dt_out/solver.dt))
+    solver.dt = dt_out/nsub
+    for n in range(nout):
+        if n > 0:
+            for k in range(nsub):
+                solver.step()
+        series[n, :, 0] = solver.t
+        series[n, :, 2:] = solver.values(cells)
+        for k, mask in enumerate(fg_masks):
+            if mask is not None:
+                fg_max[k] = max(fg_max[k], np.abs(solver.eta[mask]).max())
+
+    gauges = {}
+    for k, gaugeno in enumerate(gaugenos):
+        gauges[gaugeno] = series[:, k, :]
+    gauge_max = dict([(g, np.abs(gauges[g][:, 5]).max()) for g in gaugenos])
+    return {'gauges': gauges, 'gauge_max': gauge_max, 'fg_max': fg_max}
+
+
+def write_fort_gauge(gauges, outdir='_quicklook'):
+    """
+    Write the gauge series to outdir/fort.gauge in the format of xgeoclaw,
+    ordered by time, and convert them with gaugestore.
+    """
+    import gaugestore
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    gaugenos = sorted(gauges.keys())
+    nout = len(gauges[gaugenos[0]]) if gaugenos else 0
+    f = open(os.path.join(outdir, 'fort.gauge'), 'w')
+    for n in range(nout):
+        for gaugeno in gaugenos:
+            t, level, h, hu, hv, eta = gauges[gaugeno][n]
+            f.write('%8i %4i %14.7E %14.7E %14.7E %14.7E %14.7E\n'
+                    % (gaugeno, level, t, h, hu, hv, eta))
+    f.close()
+    return gaugestore.GaugeStore(outdir)
+
+
+def affected(result, threshold=0.01):
+    """
+    Gauge numbers and fixed grid numbers (from 1) where the largest |eta|
+    exceeds threshold meters.
+    """
+    gaugenos = [g for g in sorted(result['gauge_max'].keys())
+                if result['gauge_max'][g] > threshold]
+    fgnos = [k+1 for k, m in enumerate(result['fg_max'])
+             if m is not None and m > threshold]
+    return gaugenos, fgnos
+
+
+if __name__ == '__main__':
+    datadir = None
+    outdir = '_quicklook'
+    if len(sys.argv) > 1 and sys.argv[1] != 'setrun':
+        datadir = sys.argv[1]
+    if len(sys.argv) > 2:
+        outdir = sys.argv[2]
+    result = run(regioncheck.load_config(datadir))
+    write_fort_gauge(result['gauges'], outdir)
+    for gaugeno in sorted(result['gauge_max'].keys()):
+        print "gauge %4d   max |eta| %8.3f m" % (gaugeno,
+                                                 result['gauge_max'][gaugeno])
+    for k, m in enumerate(result['fg_max']):
+        if m is None:
+            print "fixed grid %d is outside the grid" % (k+1)
+        else:
+            print "fixed grid %d   max |eta| %8.3f m" % (k+1, m)
+    gaugenos, fgnos = affected(result)
+    print "Affected gauges: %s" % ' '.join(map(str, gaugenos))
+    print "Affected fixed grids: %s" % ' '.join(map(str, fgnos))
+    print "Gauge series written to %s" % os.path.join(outdir, 'fort.gauge')
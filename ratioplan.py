@@ -0,0 +1,344 @@
+"""
+Choose the refinement ratios inratx, inraty from a cost model.
+
+Each target is a box (a refinement region, or a gauge) with the finest
+cell size in meters wanted there.  For every sequence of ratios that
+reaches each target's resolution on some level (inratx and inraty are
+taken equal), each region's maxlevel becomes the coarsest level fine
+enough for its targets, and the cost of the run is estimated as follows:
+  - cells on level L: the area of the regions allowing level L (the
+    whole domain on level 1) divided by the cell area on level L, taking
+    nested regions once, as if each region were fully refined,
+  - time step on level L: cfl times the smallest cell width in meters
+    over sqrt(g*h), with h the greatest depth in the topo files over the
+    area of level L, and not larger than the level L-1 step, since with
+    variable_dt_refinement_ratios the time ratios follow the wave speeds,
+  - cell-updates: the sum over the levels of cells*tfinal/dt,
+  - memory: (2*meqn + maux) words per cell, with a layer of nghost ghost
+    cells around patches of patch_size cells on a side.
+Sequences needing more than maxwords words are infeasible, and the one
+with the fewest cell-updates is chosen.  By default the targets are the
+resolutions the current ratios give, which shows whether another
+sequence gets the same resolutions for less.
+
+To use:
+    $ python ratioplan.py                  # targets from setrun.py
+    $ python ratioplan.py _output 30       # 30 m at the finest regions
+    $ python ratioplan.py setrun 30 write  # write the plan to the data files
+
+"""
+
+import sys
+import numpy as np
+
+import regioncheck
+
+grav = 9.81
+
+
+def cell_size_m(dx, dy, box, Rearth=6367.5e3):
+    """
+    Smallest width in meters of a dx by dy degree cell in box, on a sphere
+    of radius Rearth (config['Rearth'] of regioncheck.load_config).
+    """
+    deg2m = Rearth*np.pi/180.
+    coslat = np.cos(np.radians(max(abs(box[2]), abs(box[3]))))
+    return min(dx*deg2m*coslat, dy*deg2m)
+
+
+def max_depth(box, topo, default_depth=4000.):
+    """
+    Greatest depth below sea level in box of the topo files, a list of
+    (topoheader, Z) from topocache.read_topofiles, or default_depth if
+    no topo file covers box.
+    """
+    depth = None
+    for header, Z in topo:
+        nrows, ncols = Z.shape
+        x = header['xll'] + header['cellsize']*np.arange(ncols)
+        # rows of Z go from north to south:
+        y = header['yll'] + header['cellsize']*np.arange(nrows)[::-1]
+        jx = np.where((x >= box[0]) & (x <= box[1]))[0]
+        iy = np.where((y >= box[2]) & (y <= box[3]))[0]
+        if len(jx) == 0 or len(iy) == 0:
+            continue
+        Zbox = np.asarray(Z[iy[0]:iy[-1]+1, jx[0]:jx[-1]+1])
+        depth = max(depth, -Zbox.min(), 0.)
+    if depth is None:
+        return default_depth
+    return depth
+
+
+def current_targets(config, resolution=None):
+    """
+    Targets, dictionaries with keys name, box and resolution (m), for the
+    regions intersecting the domain and the gauges, at the resolution the
+    current ratios give there.  If resolution is given it replaces that of
+    the regions allowing mxnest.
+    """
+    dx, dy = regioncheck.level_resolution(config)
+    domain = config['domain']
+    result = []
+    for k, region in enumerate(config['regions']):
+        box = regioncheck.clip(region[4:8], domain)
+        if box is None or region[1] <= 1:
+            continue
+        level = min(int(region[1]), config['mxnest'])
+        res = cell_size_m(dx[level-1], dy[level-1], box, config['Rearth'])
+        if resolution is not None and level == config['mxnest']:
+            res = resolution
+        result.append({'name': 'region %d' % (k+1), 'box': box,
+                       'resolution': res})
+    for gaugeno, x, y, t1, t2 in config['gauges']:
+        if not regioncheck.contains(domain, x, y):
+            continue
+        level = regioncheck.allowed_level(config['regions'], x, y)
+        result.append({'name': 'gauge %d' % gaugeno, 'box': [x, x, y, y],
+                       'resolution': cell_size_m(dx[level-1], dy[level-1],
+                                                 [x, x, y, y],
+                                                 config['Rearth'])})
+    return result
+
+
+def geometry(config, targets, topo):
+    """
+    Precompute what the cost of a ratio sequence depends on: the boxes of
+    the regions clipped to the domain, which contain which, their depths
+    and level 1 cell widths in meters, and for each target the region
+    refining it and the refinement over level 1 it needs.  As inratx and
+    inraty are taken equal, cell widths on level L are those on level 1
+    divided by the product of the ratios.
+    """
+    domain = config['domain']
+    x1, x2, y1, y2 = domain
+    dx1 = (x2 - x1)/float(config['mx'])
+    dy1 = (y2 - y1)/float(config['my'])
+    old_dx, old_dy = regioncheck.level_resolution(config)
+    boxes = [regioncheck.clip(r[4:8], domain) for r in config['regions']]
+    index = [k for k, box in enumerate(boxes) if box is not None]
+    Rearth = config['Rearth']
+    geo = {'dx1': dx1, 'dy1': dy1, 'index': index,
+           'boxes': [boxes[k] for k in index],
+           'area': np.array([(boxes[k][1] - boxes[k][0])*
+                             (boxes[k][3] - boxes[k][2]) for k in index]),
+           'depth': np.array([max_depth(boxes[k], topo) for k in index]),
+           'width': np.array([cell_size_m(dx1, dy1, boxes[k], Rearth)
+                              for k in index]),
+           'domain_depth': max_depth(domain, topo),
+           'domain_width': cell_size_m(dx1, dy1, domain, Rearth)}
+    n = len(index)
+    # inside[i, j] if box i is inside box j (the first of equal boxes wins):
+    inside = np.zeros((n, n), dtype=bool)
+    for i in range(n):
+        for j in range(n):
+            if i != j and regioncheck.box_contains(geo['boxes'][j],
+                                                   geo['boxes'][i]):
+                inside[i, j] = geo['boxes'][i] != geo['boxes'][j] or j < i
+    geo['inside'] = inside
+
+    # refinement over level 1 needed by each target, and by the minlevel
+    # of each region:
+    geo['needs'] = []
+    for target in targets:
+        factor = cell_size_m(dx1, dy1, target['box'], Rearth) \
+                 /target['resolution']
+        if target['name'].startswith('region'):
+            k = int(target['name'].split()[1]) - 1
+        else:
+            # a gauge is refined by the smallest region containing it:
+            covering = [(geo['area'][i], i) for i, k in enumerate(index)
+                        if regioncheck.box_contains(geo['boxes'][i],
+                                                    target['box'])]
+            if not covering:
+                continue
+            k = index[min(covering)[1]]
+        if k in index:
+            geo['needs'].append((index.index(k), factor))
+    geo['minlevel_factor'] = []
+    for k in index:
+        old = min(int(config['regions'][k][0]), config['mxnest'])
+        geo['minlevel_factor'].append(dx1/old_dx[old-1])
+    return geo
+
+
+def ratio_sequences(geo, ratios=range(2, 11), maxlevels=6):
+    """
+    Generator of the lists of ratios, each in ratios, with at most
+    maxlevels levels, that stop at the first level fine enough for every
+    target.
+    """
+    needed = max([factor for i, factor in geo['needs']] + [1.])
+
+    def extend(sequence, product):
+        if product >= needed*(1. - 1e-9):
+            yield list(sequence)
+            return
+        if len(sequence) + 1 >= maxlevels:
+            return
+        for r in ratios:
+            sequence.append(r)
+            for s in extend(sequence, product*r):
+                yield s
+            sequence.pop()
+
+    for s in extend([], 1.):
+        yield s
+
+
+def plan_levels(geo, inrat):
+    """
+    Return arrays (minlevel, maxlevel) of the regions in geo['index'],
+    with maxlevel the coarsest level reaching the resolution of their
+    targets with the ratios inrat, and minlevel the coarsest level at
+    least as fine as the old minlevel, or None if a target is not reached.
+    Regions with no target keep maxlevel 1.
+    """
+    product = np.cumprod([1] + list(inrat))
+    maxlevel = np.ones(len(geo['index']), dtype=int)
+    for i, factor in geo['needs']:
+        level = np.searchsorted(product, factor*(1. - 1e-9)) + 1
+        if level > len(product):
+            return None
+        maxlevel[i] = max(maxlevel[i], level)
+    minlevel = np.searchsorted(product, np.array(geo['minlevel_factor'])
+                               *(1. - 1e-9)) + 1
+    return np.minimum(minlevel, maxlevel), maxlevel
+
+
+def estimate(config, geo, inrat, maxlevel, meqn=3, maux=3, nghost=2,
+             patch_size=30):
+    """
+    Return (cell-updates, words of memory, cells per level, dt per level)
+    for the ratios inrat and the maxlevel of each region.
+    """
+    product = np.cumprod([1] + list(inrat))
+    mxnest = len(product)
+    cells = np.zeros(mxnest)
+    dt = np.zeros(mxnest)
+    cells[0] = config['mx']*config['my']
+    dt[0] = config['cfl']*geo['domain_width'] \
+            / np.sqrt(grav*max(geo['domain_depth'], 1.))
+    cell_area = geo['dx1']*geo['dy1']/product**2
+    for level in range(2, mxnest+1):
+        allowed = maxlevel >= level
+        if not allowed.any():
+            dt[level-1] = dt[level-2]
+            continue
+        # regions inside another region allowing this level count once:
+        counted = allowed & ~(geo['inside'] & allowed[np.newaxis, :]).any(axis=1)
+        cells[level-1] = np.sum(geo['area'][counted])/cell_area[level-1]
+        depth = max(geo['depth'][allowed].max(), 1.)
+        width = geo['width'][allowed].min()/product[level-1]
+        dt[level-1] = min(config['cfl']*width/np.sqrt(grav*depth), dt[level-2])
+    updates = np.sum(cells*config['tfinal']/dt)
+    ghost = ((patch_size + 2.*nghost)/patch_size)**2
+    words = np.sum(cells)*ghost*(2*meqn + maux)
+    return updates, words, cells, dt
+
+
+def plan(config, targets=None, maxwords=None, ratios=range(2, 11),
+         maxlevels=6, **kwargs):
+    """
+    Return a list of the feasible plans, dictionaries with keys inratx,
+    inraty, mxnest, regions, updates, words, cells and dt, cheapest first.
+    """
+    import topocache
+    if targets is None:
+        targets = current_targets(config)
+    topo = []
+    for topofile in config['topofiles']:
+        fname = regioncheck.input_fname(topofile[-1])
+        if fname is not None:
+            topo.append(topocache.read_topo(fname, int(topofile[0])))
+        else:
+            print "*** Warning: topo file %s not found" % topofile[-1]
+    geo = geometry(config, targets, topo)
+
+    plans = []
+    for inrat in ratio_sequences(geo, ratios, maxlevels):
+        levels = plan_levels(geo, inrat)
+        if levels is None:
+            continue
+        minlevel, maxlevel = levels
+        updates, words, cells, dt = estimate(config, geo, inrat, maxlevel,
+                                             **kwargs)
+        if maxwords is not None and words > maxwords:
+            continue
+        plans.append({'inratx': inrat, 'inraty': list(inrat),
+                      'mxnest': len(inrat) + 1, 'levels': levels,
+                      'updates': updates, 'words': words, 'cells': cells,
+                      'dt': dt})
+    plans.sort(key=lambda p: p['updates'])
+    for p in plans:
+        p['regions'] = plan_regions(config, geo, *p.pop('levels'))
+    return plans
+
+
+def plan_regions(config, geo, minlevel, maxlevel):
+    """
+    The regions of config with the levels of a plan, leaving out those
+    outside the domain.
+    """
+    regions = []
+    for i, k in enumerate(geo['index']):
+        region = list(config['regions'][k])
+        region[0], region[1] = int(minlevel[i]), int(maxlevel[i])
+        regions.append(region)
+    return regions
+
+
+def apply_plan(rundata, best):
+    """
+    Set the ratios, mxnest and regions of the plan best in rundata.
+    """
+    clawdata = rundata.clawdata
+    sign = -1 if clawdata.mxnest < 0 else 1
+    clawdata.mxnest = sign*best['mxnest']
+    clawdata.inratx = list(best['inratx'])
+    clawdata.inraty = list(best['inraty'])
+    clawdata.inratt = [1]*len(best['inratx'])
+    rundata.geodata.regions = [list(r) for r in best['regions']]
+    return rundata
+
+
+def print_plans(plans, current=None, nbest=10, f=sys.stdout):
+    if current is not None:
+        f.write('current %-20s updates %11.4e  words %11.4e\n'
+                % (current['inratx'], current['updates'], current['words']))
+    for p in plans[:nbest]:
+        f.write('        %-20s updates %11.4e  words %11.4e\n'
+                % (p['inratx'], p['updates'], p['words']))
+    if plans:
+        best = plans[0]
+        f.write('\nCheapest plan, cells and dt per level:\n')
+        for level in range(best['mxnest']):
+            f.write('  level %d: %12.4g cells  dt = %10.4g s\n'
+                    % (level+1, best['cells'][level], best['dt'][level]))
+        f.write('\n    clawdata.mxnest = -%d\n' % best['mxnest'])
+        f.write('    clawdata.inratx = %s\n' % best['inratx'])
+        f.write('    clawdata.inraty = %s\n' % best['inraty'])
+        for region in best['regions']:
+            f.write('    geodata.regions.append(%s)\n'
+                    % regioncheck.format_region(region))
+    else:
+        f.write('*** No feasible plan\n')
+
+
+if __name__ == '__main__':
+    datadir = None
+    resolution = None
+    if len(sys.argv) > 1 and sys.argv[1] != 'setrun':
+        datadir = sys.argv[1]
+    if len(sys.argv) > 2:
+        resolution = float(sys.argv[2])
+    config = regioncheck.load_config(datadir)
+    targets = current_targets(config, resolution)
+    plans = plan(config, targets)
+    current = None
+    for p in plans:
+        if p['inratx'] == config['inratx'][:config['mxnest']-1]:
+            current = p
+    print_plans(plans, current)
+    if len(sys.argv) > 3 and sys.argv[3] == 'write' and plans:
+        import setrun, datawrite
+        datawrite.write_changed(apply_plan(setrun.setrun(), plans[0]))
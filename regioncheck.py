@@ -0,0 +1,475 @@
+"""
+Static checks of the refinement regions against the gauges and fixed grids.
+
+Loads the regions, gauges, fixed grids, topo files and AMR parameters from
+setrun.py (or from the *.data files in a directory) and reports
+  - regions that do not intersect the domain or extend beyond it,
+  - regions made redundant by a larger region allowing at least the same
+    levels over at least the same times,
+  - overlapping regions whose minlevel is above the other's maxlevel,
+  - regions containing no gauge or fixed grid,
+  - gauges and fixed grids outside the topo files or not covered at their
+    required level,
+and estimates the number of cells on each level each region implies, from
+mx, my and inratx, inraty.  It then proposes a smaller set of boxes that
+still covers every gauge and fixed grid at its required level, by merging
+padded boxes around them while the merged box is not much larger than its
+parts, keeping the existing regions that already do the job.  By default
+the required level is the finest level the current
+regions allow at the gauge or fixed grid.
+
+To use:
+    $ python regioncheck.py              # uses setrun.py
+    $ python regioncheck.py _output      # uses the data files in _output
+    $ python regioncheck.py _output 4    # and require level 4 at gauges
+
+"""
+
+import os, sys
+import numpy as np
+
+
+def load_config(datadir=None):
+    """
+    Return a dictionary with the regions, gauges, fixedgrids, topofiles,
+    dtopofiles, domain [x1,x2,y1,y2], mx, my, inratx, inraty, mxnest, tfinal,
+    cfl (cfl_desired) and Rearth of the run,
+    from setrun.py if datadir is None and otherwise from the data files
+    in datadir.
+    """
+    config = {'datadir': datadir}
+    if datadir is None:
+        import setrun
+        rundata = setrun.setrun()
+        clawdata = rundata.clawdata
+        geodata = rundata.geodata
+        config['regions'] = [list(map(float, r)) for r in geodata.regions]
+        config['gauges'] = [list(map(float, g)) for g in geodata.gauges]
+        config['fixedgrids'] = [list(map(float, f)) for f in geodata.fixedgrids]
+        config['topofiles'] = [list(t) for t in geodata.topofiles]
+        config['dtopofiles'] = [list(t) for t in geodata.dtopofiles]
+        config['domain'] = [clawdata.xlower, clawdata.xupper,
+                            clawdata.ylower, clawdata.yupper]
+        config['mx'], config['my'] = clawdata.mx, clawdata.my
+        config['inratx'] = list(clawdata.inratx)
+        config['inraty'] = list(clawdata.inraty)
+        config['mxnest'] = abs(clawdata.mxnest)
+        config['tfinal'] = clawdata.tfinal
+        config['cfl'] = clawdata.cfl_desired
+        config['Rearth'] = geodata.Rearth
+    else:
+        import amrprofile, gaugestore, fgcube
+        amr = amrprofile.read_datafile(os.path.join(datadir, 'amr2ez.data'))
+        config['regions'] = amrprofile.read_setregions(datadir)
+        gauges = gaugestore.read_setgauges(datadir)
+        config['gauges'] = [[g] + gauges[g] for g in sorted(gauges.keys())]
+        config['fixedgrids'] = fgcube.read_setfixedgrids(datadir)
+        config['topofiles'] = read_settopo(datadir)
+        config['dtopofiles'] = read_setdtopo(datadir)
+        config['domain'] = [float(amr[name][0]) for name in
+                            ['xlower', 'xupper', 'ylower', 'yupper']]
+        config['mx'], config['my'] = int(amr['mx'][0]), int(amr['my'][0])
+        config['inratx'] = [int(r) for r in amr['inratx']]
+        config['inraty'] = [int(r) for r in amr['inraty']]
+        config['mxnest'] = abs(int(amr['mxnest'][0]))
+        config['tfinal'] = float(amr['tfinal'][0])
+        config['cfl'] = float(amr['cfl_desired'][0])
+        geo = amrprofile.read_datafile(os.path.join(datadir, 'setgeo.data'))
+        config['Rearth'] = float(geo['Rearth'][0])
+    return config
+
+
+def read_settopo(datadir='.'):
+    """
+    Return the topo files of settopo.data as [topotype, minlevel, maxlevel,
+    t1, t2, fname].
+    """
+    lines = [line.strip() for line in open(os.path.join(datadir, 'settopo.data'))
+             if line.strip() and not line.startswith('#')]
+    ntopofiles = int(lines[0].split()[0])
+    topofiles = []
+    for k in range(ntopofiles):
+        fname = lines[1+2*k].strip("'\"")
+        values = lines[2+2*k].split()
+        topofiles.append([int(values[0]), int(values[1]), int(values[2]),
+                          float(values[3]), float(values[4]), fname])
+    return topofiles
+
+
+def read_setdtopo(datadir='.'):
+    """
+    Return the dtopo files of setdtopo.data as [dtopotype, minlevel,
+    maxlevel, fname].
+    """
+    lines = [line.strip() for line in open(os.path.join(datadir, 'setdtopo.data'))
+             if line.strip() and not line.startswith('#')]
+    ndtopofiles = int(lines[0].split()[0])
+    dtopofiles = []
+    for k in range(ndtopofiles):
+        fname = lines[1+2*k].strip("'\"")
+        values = lines[2+2*k].split()
+        dtopofiles.append([int(values[0]), int(values[1]), int(values[2]),
+                           fname])
+    return dtopofiles
+
+
+def input_fname(fname, datadir=None):
+    """
+    Path of an input file named in rundata or in the data files, which
+    may have been written on another machine with an absolute path, or
+    None if it is not found.  Relative names are also looked for in
+    datadir, e.g. a scenario directory of scenarios.py.
+    """
+    candidates = [fname, os.path.basename(fname)]
+    if datadir is not None:
+        candidates += [os.path.join(datadir, fname),
+                       os.path.join(datadir, os.path.basename(fname))]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def level_resolution(config):
+    """
+    Return arrays dx, dy of the cell size on each level 1..mxnest.
+    """
+    x1, x2, y1, y2 = config['domain']
+    mxnest = config['mxnest']
+    rx = np.cumprod([1] + list(config['inratx'])[:mxnest-1])
+    ry = np.cumprod([1] + list(config['inraty'])[:mxnest-1])
+    return (x2 - x1)/float(config['mx'])/rx, (y2 - y1)/float(config['my'])/ry
+
+
+def clip(box, domain):
+    """
+    Intersection of box [x1,x2,y1,y2] with domain, or None if empty.
+    """
+    x1, x2 = max(box[0], domain[0]), min(box[1], domain[1])
+    y1, y2 = max(box[2], domain[2]), min(box[3], domain[3])
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return [x1, x2, y1, y2]
+
+
+def contains(box, x, y):
+    return box[0] <= x <= box[1] and box[2] <= y <= box[3]
+
+
+def box_contains(outer, inner):
+    return outer[0] <= inner[0] and inner[1] <= outer[1] and \
+           outer[2] <= inner[2] and inner[3] <= outer[3]
+
+
+def region_cells(region, config):
+    """
+    Number of cells on each level 1..mxnest of the part of region inside
+    the domain, were it all refined to that level.
+    """
+    dx, dy = level_resolution(config)
+    box = clip(region[4:8], config['domain'])
+    if box is None:
+        return np.zeros(len(dx))
+    return (box[1] - box[0])*(box[3] - box[2])/(dx*dy)
+
+
+def allowed_level(regions, x, y, t=None):
+    """
+    Finest level allowed at (x,y) by the regions (at time t if given),
+    or 1 if no region covers it.
+    """
+    level = 1
+    for region in regions:
+        minlevel, maxlevel, t1, t2 = region[:4]
+        if t is not None and not (t1 <= t <= t2):
+            continue
+        if contains(region[4:8], x, y):
+            level = max(level, int(maxlevel))
+    return level
+
+
+def topo_extents(config):
+    """
+    Extents [x1,x2,y1,y2] of the topo files that can be found.
+    """
+    import topocache
+    extents = []
+    for topofile in config['topofiles']:
+        fname = input_fname(topofile[-1])
+        if fname is None:
+            continue
+        topotype = int(topofile[0])
+        if topotype == 1:
+            X, Y, Z = topocache.topofile2griddata(fname, topotype)
+            extents.append([X.min(), X.max(), Y.min(), Y.max()])
+        else:
+            h = topocache.topoheaderread(fname)
+            extents.append([h['xll'], h['xll'] + (h['ncols']-1)*h['cellsize'],
+                            h['yll'], h['yll'] + (h['nrows']-1)*h['cellsize']])
+    return extents
+
+
+def targets(config, gauge_level=None, fixedgrid_level=None):
+    """
+    List of the boxes that must be refined, as dictionaries with keys
+    name, box, level, t1, t2.  The required level is gauge_level or
+    fixedgrid_level, or if None the finest level allowed there now.
+    """
+    result = []
+    for gaugeno, x, y, t1, t2 in config['gauges']:
+        level = gauge_level or allowed_level(config['regions'], x, y)
+        result.append({'name': 'gauge %d' % gaugeno, 'box': [x, x, y, y],
+                       'level': level, 't1': t1, 't2': t2})
+    for k, fg in enumerate(config['fixedgrids']):
+        box = fg[3:7]
+        xc, yc = 0.5*(box[0] + box[1]), 0.5*(box[2] + box[3])
+        level = fixedgrid_level or allowed_level(config['regions'], xc, yc)
+        result.append({'name': 'fixed grid %d' % (k+1), 'box': list(box),
+                       'level': level, 't1': fg[0], 't2': fg[1]})
+    return result
+
+
+def check(config, gauge_level=None, fixedgrid_level=None):
+    """
+    Return a list of (kind, message) for the problems found.  If
+    gauge_level or fixedgrid_level is given, gauges and fixed grids in no
+    region allowing that level are reported.
+    """
+    problems = []
+    regions = config['regions']
+    domain = config['domain']
+    mxnest = config['mxnest']
+    for k, region in enumerate(regions):
+        name = 'region %d %s' % (k+1, region)
+        box = region[4:8]
+        clipped = clip(box, domain)
+        if clipped is None:
+            problems.append(('redundant', '%s does not intersect the domain %s'
+                             % (name, domain)))
+            continue
+        if clipped != list(box):
+            problems.append(('extent', '%s extends beyond the domain %s'
+                             % (name, domain)))
+        if region[1] > mxnest:
+            problems.append(('level', '%s allows level %d > mxnest = %d'
+                             % (name, region[1], mxnest)))
+        for j, other in enumerate(regions):
+            if j == k:
+                continue
+            other_box = clip(other[4:8], domain)
+            if other_box is None:
+                continue
+            if box_contains(other_box, clipped) and \
+                    other[0] >= region[0] and other[1] >= region[1] and \
+                    other[2] <= region[2] and other[3] >= region[3] and \
+                    (other_box != clipped or j < k):
+                problems.append(('redundant', '%s is covered by region %d %s'
+                                 % (name, j+1, other)))
+                break
+        if region[0] > region[1]:
+            problems.append(('conflict', '%s has minlevel > maxlevel' % name))
+        # nested regions are the usual way to refine locally, but where
+        # regions only partly overlap the edge of the refined area depends
+        # on the order in which they were written:
+        for j, other in enumerate(regions[k+1:]):
+            j += k+1
+            overlap = clip(clipped, other[4:8])
+            if overlap is None or list(region[:2]) == list(other[:2]) or \
+                    region[3] < other[2] or other[3] < region[2]:
+                continue
+            if not (box_contains(box, other[4:8]) or
+                    box_contains(other[4:8], box)):
+                problems.append(('conflict', '%s and region %d %s partly '
+                                 'overlap with different levels'
+                                 % (name, j+1, other)))
+        inside = [g for g in config['gauges'] if contains(box, g[1], g[2])]
+        inside += [f for f in config['fixedgrids']
+                   if box_contains(box, f[3:7])]
+        if region[1] > 1 and len(inside) == 0:
+            problems.append(('unused', '%s contains no gauge or fixed grid'
+                             % name))
+
+    extents = topo_extents(config)
+    for gaugeno, x, y, t1, t2 in config['gauges']:
+        if not contains(domain, x, y):
+            problems.append(('gauge', 'gauge %d at (%s, %s) is outside the '
+                             'domain' % (gaugeno, x, y)))
+        elif extents and not [e for e in extents if contains(e, x, y)]:
+            problems.append(('gauge', 'gauge %d at (%s, %s) is outside all '
+                             'topo files' % (gaugeno, x, y)))
+        if gauge_level and allowed_level(regions, x, y) < gauge_level:
+            problems.append(('gauge', 'gauge %d at (%s, %s) is in no region '
+                             'allowing level %d' % (gaugeno, x, y, gauge_level)))
+    level = fixedgrid_level or mxnest
+    for k, fg in enumerate(config['fixedgrids']):
+        box = fg[3:7]
+        covering = [r for r in regions if box_contains(r[4:8], box)
+                    and r[1] >= level]
+        if not covering:
+            problems.append(('fixedgrid', 'fixed grid %d %s is not inside a '
+                             'region allowing level %d' % (k+1, box, level)))
+    return problems
+
+
+def suggest(config, npad=2, slack=0.5, gauge_level=None,
+            fixedgrid_level=None, coarse_level=None):
+    """
+    Propose regions [minlevel,maxlevel,t1,t2,x1,x2,y1,y2] covering every
+    target of targets() at its required level.  Regions allowing at most
+    coarse_level (by default the largest maxlevel below mxnest of the
+    regions intersecting the domain) are kept, clipped to the domain.
+    Finer regions are kept only if they contain a target needing their
+    maxlevel.  The other targets needing a level finer than coarse_level
+    are padded by npad cells of the next coarser level, and boxes needing
+    the same level are merged while the merged box has area at most
+    (1+slack) times the sum of the areas of its parts.
+    Returns the regions and the new boxes as dictionaries with keys box,
+    level, t1, t2 and names of the targets they cover.
+    """
+    domain = config['domain']
+    dx, dy = level_resolution(config)
+    regions = [r for r in config['regions'] if clip(r[4:8], domain) is not None]
+    if coarse_level is None:
+        coarse_level = 1
+        for region in regions:
+            if region[1] < config['mxnest']:
+                coarse_level = max(coarse_level, int(region[1]))
+    kept = [r for r in regions if r[1] <= coarse_level]
+
+    boxes = []
+    for target in targets(config, gauge_level, fixedgrid_level):
+        if target['level'] <= coarse_level:
+            continue
+        covering = [r for r in regions if r[1] >= target['level']
+                    and box_contains(r[4:8], target['box'])
+                    and r[2] <= target['t1'] and r[3] >= target['t2']]
+        if covering:
+            # keep the smallest existing region that does the job:
+            area = lambda r: (r[5] - r[4])*(r[7] - r[6])
+            region = sorted(covering, key=area)[0]
+            if region not in kept:
+                kept.append(region)
+            continue
+        x1, x2, y1, y2 = target['box']
+        px = npad*dx[target['level']-2]
+        py = npad*dy[target['level']-2]
+        boxes.append({'box': [x1-px, x2+px, y1-py, y2+py],
+                      'level': target['level'], 't1': target['t1'],
+                      't2': target['t2'], 'names': [target['name']]})
+    # a kept region may cover targets of a new box too:
+    boxes = [b for b in boxes if not [r for r in kept if r[1] >= b['level']
+                                      and box_contains(r[4:8], b['box'])]]
+
+    area = lambda b: (b[1] - b[0])*(b[3] - b[2])
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i+1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a['level'] != b['level']:
+                    continue
+                union = [min(a['box'][0], b['box'][0]),
+                         max(a['box'][1], b['box'][1]),
+                         min(a['box'][2], b['box'][2]),
+                         max(a['box'][3], b['box'][3])]
+                if area(union) <= (1. + slack)*(area(a['box']) + area(b['box'])):
+                    boxes[i] = {'box': union, 'level': a['level'],
+                                't1': min(a['t1'], b['t1']),
+                                't2': max(a['t2'], b['t2']),
+                                'names': a['names'] + b['names']}
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    suggested = [list(r[:4]) + clip(r[4:8], domain)
+                 for r in config['regions'] if r in kept]
+    for b in boxes:
+        suggested.append([1, b['level'], b['t1'], b['t2']]
+                         + clip(b['box'], domain))
+    return suggested, boxes
+
+
+def cell_table(regions, config):
+    """
+    Total cells on each level implied by the regions, counting each region
+    on the levels 2..maxlevel it allows, except on levels allowed by a
+    region containing it.
+    """
+    domain = config['domain']
+    levels = np.arange(1, config['mxnest']+1)
+    total = np.zeros(config['mxnest'])
+    for k, region in enumerate(regions):
+        box = clip(region[4:8], domain)
+        if box is None:
+            continue
+        allowed = (levels > 1) & (levels <= region[1])
+        for j, other in enumerate(regions):
+            other_box = clip(other[4:8], domain)
+            if j != k and other_box is not None and \
+                    box_contains(other_box, box) and (other_box != box or j < k):
+                allowed &= levels > other[1]
+        total[allowed] += region_cells(region, config)[allowed]
+    return total
+
+
+def format_region(region):
+    return '[%d, %d, %g, %g, %.6g, %.6g, %.6g, %.6g]' % tuple(region)
+
+
+def report(config, f=sys.stdout, **kwargs):
+    """
+    Write the problems, cell estimates and suggested regions to f.
+    The keyword arguments are passed to suggest().
+    """
+    f.write('Problems found:\n')
+    problems = check(config, kwargs.get('gauge_level'),
+                     kwargs.get('fixedgrid_level'))
+    for kind, message in problems:
+        f.write('  [%s] %s\n' % (kind, message))
+    if not problems:
+        f.write('  none\n')
+
+    f.write('\nCells per level if each region were fully refined:\n')
+    for k, region in enumerate(config['regions']):
+        cells = region_cells(region, config)
+        f.write('  region %d %s:\n    ' % (k+1, format_region(region)))
+        f.write('  '.join(['L%d %.3g' % (level+1, cells[level])
+                           for level in range(int(region[0])-1,
+                                              min(int(region[1]),
+                                                  config['mxnest']))]))
+        f.write('\n')
+
+    f.write('\nFinest level allowed at the gauges:\n')
+    for level in range(1, config['mxnest']+1):
+        gaugenos = [int(g[0]) for g in config['gauges']
+                    if allowed_level(config['regions'], g[1], g[2]) == level]
+        if gaugenos:
+            f.write('  level %d: %s\n' % (level, ' '.join(map(str, gaugenos))))
+
+    suggested, boxes = suggest(config, **kwargs)
+    f.write('\nSuggested regions:\n')
+    for b in boxes:
+        f.write('  # level %d for %s\n' % (b['level'], ', '.join(b['names'])))
+    for region in suggested:
+        f.write('    geodata.regions.append(%s)\n' % format_region(region))
+
+    old = cell_table(config['regions'], config)
+    new = cell_table(suggested, config)
+    f.write('\nCells per level allowed, current vs suggested:\n')
+    for level in range(1, config['mxnest']):
+        f.write('  level %d: %12.4g  %12.4g\n' % (level+1, old[level], new[level]))
+
+
+if __name__ == '__main__':
+    datadir = None
+    gauge_level = None
+    if len(sys.argv) > 1:
+        datadir = sys.argv[1]
+        if datadir == 'setrun':
+            datadir = None
+    if len(sys.argv) > 2:
+        gauge_level = int(sys.argv[2])
+    report(load_config(datadir), gauge_level=gauge_level)
@@ -0,0 +1,154 @@
+"""
+Resample an AMR frame onto a regular lat-long raster.
+
+resample() returns the solution at the cell centers of a raster over
+bbox = [x1, x2, y1, y2] with spacing dx, dy, taking each pixel from the
+finest grid covering it, and a map of the AMR level used for each pixel
+(0 where no grid covers it).  Row j of the raster is at
+y1 + (j + 0.5)*dy, so rows go from south to north as in the fixed grid
+arrays of fgcube.py.
+
+The raster is filled in square tiles of tile pixels: for each tile the
+grids intersecting it are found from the frame index (frameindex.py),
+and each grid fills the pixels it covers by index arithmetic from its
+xlow, ylow, dx, dy, coarser levels first.  Patch data read for one tile
+is kept in an LRU cache of bounded size for the next tiles, so memory
+stays bounded by the cache and the output, which can be a memory-mapped
+.npy file for rasters too large to hold in memory.
+
+To use interactively:
+    >>> import frameindex, resample
+    >>> frame = frameindex.IndexedFrame(1, '_output')
+    >>> x, y, q, level = resample.resample(frame, [110,112,-10,-8], 0.01)
+    >>> eta = q[:, :, 3]
+
+To write the surface eta of frame 1 at 1 arcminute to eta.npy:
+    $ python resample.py _output 1 106 130 -15 0 0.016667 eta.npy
+
+"""
+
+import os, sys
+import numpy as np
+
+import frameindex
+
+
+def raster_coords(bbox, dx, dy=None):
+    """
+    Cell centers x, y of the raster over bbox with spacing dx, dy.  The
+    number of cells is rounded, so the raster may end a fraction of a
+    cell inside or outside bbox.
+    """
+    if dy is None:
+        dy = dx
+    x1, x2, y1, y2 = bbox
+    nx = max(int(round((x2 - x1)/dx)), 1)
+    ny = max(int(round((y2 - y1)/dy)), 1)
+    return x1 + (np.arange(nx) + 0.5)*dx, y1 + (np.arange(ny) + 0.5)*dy
+
+
+def resample(frame, bbox, dx, dy=None, levels=None, fields=None,
+             dtype=np.float64, tile=1024, out=None, level_out=None,
+             patch_cache=None):
+    """
+    Resample frame (an IndexedFrame) onto the raster over bbox with
+    spacing dx, dy, using the grids on levels (all if None) and the
+    components fields of q (all if None).
+    Returns x, y, values with shape (ny, nx, len(fields)), nan where no
+    grid covers a pixel, and the level map with shape (ny, nx).
+    The results are written into out and level_out if given, e.g. arrays
+    from np.lib.format.open_memmap.  patch_cache is a
+    plotcache.PlotVarCache holding the patches read, 256 MB by default.
+    """
+    import plotcache
+    if dy is None:
+        dy = dx
+    x, y = raster_coords(bbox, dx, dy)
+    if fields is None:
+        fields = range(frame.meqn)
+    fields = list(fields)
+    if out is None:
+        out = np.empty((len(y), len(x), len(fields)), dtype=dtype)
+    if level_out is None:
+        level_out = np.empty((len(y), len(x)), dtype=np.int8)
+    if patch_cache is None:
+        patch_cache = plotcache.PlotVarCache()
+
+    rows = frame.select(levels)
+    rows = np.sort(rows, order=['level', 'gridno'])
+    f = open(frame.fname, 'rb')
+    try:
+        for j1 in range(0, len(y), tile):
+            for i1 in range(0, len(x), tile):
+                xt, yt = x[i1:i1+tile], y[j1:j1+tile]
+                values = np.nan*np.ones((len(yt), len(xt), len(fields)))
+                level = np.zeros((len(yt), len(xt)), dtype=np.int8)
+                tile_bbox = [xt[0] - 0.5*dx, xt[-1] + 0.5*dx,
+                             yt[0] - 0.5*dy, yt[-1] + 0.5*dy]
+                for row in rows[frameindex.select(rows, bbox=tile_bbox)]:
+                    _fill(frame, row, xt, yt, fields, values, level,
+                          patch_cache, f)
+                out[j1:j1+tile, i1:i1+tile] = values
+                level_out[j1:j1+tile, i1:i1+tile] = level
+    finally:
+        f.close()
+    return x, y, out, level_out
+
+
+def _fill(frame, row, x, y, fields, values, level, patch_cache, f):
+    # Fill the pixels at centers x, y covered by the grid of index row.
+    i = np.floor((x - row['xlow'])/row['dx']).astype(int)
+    j = np.floor((y - row['ylow'])/row['dy']).astype(int)
+    okx = np.where((i >= 0) & (i < row['mx']))[0]
+    oky = np.where((j >= 0) & (j < row['my']))[0]
+    if len(okx) == 0 or len(oky) == 0:
+        return
+    key = (frame.fname, int(row['gridno']), tuple(fields))
+    q = patch_cache.get(key)
+    if q is None:
+        q = frame.read_q(row, f)[:, :, fields]
+        patch_cache.put(key, q)
+    # the covered pixels are contiguous, so slices suffice:
+    sy = slice(oky[0], oky[-1] + 1)
+    sx = slice(okx[0], okx[-1] + 1)
+    values[sy, sx] = q[i[sx][np.newaxis, :], j[sy][:, np.newaxis]]
+    level[sy, sx] = row['level']
+
+
+def resample_to_file(frameno, outdir, bbox, dx, fname, fields=None,
+                     dtype=np.float32, tile=1024):
+    """
+    Resample frame frameno of outdir and save the values to fname (.npy)
+    and the level map to fname with .level.npy, without holding the
+    raster in memory.  Returns x, y.
+    """
+    frame = frameindex.IndexedFrame(frameno, outdir)
+    if fields is None:
+        fields = range(frame.meqn)
+    x, y = raster_coords(bbox, dx)
+    out = np.lib.format.open_memmap(fname, mode='w+', dtype=dtype,
+                                    shape=(len(y), len(x), len(fields)))
+    level_fname = os.path.splitext(fname)[0] + '.level.npy'
+    level_out = np.lib.format.open_memmap(level_fname, mode='w+',
+                                          dtype=np.int8,
+                                          shape=(len(y), len(x)))
+    resample(frame, bbox, dx, fields=fields, tile=tile, out=out,
+             level_out=level_out)
+    out.flush()
+    level_out.flush()
+    del out, level_out
+    return x, y
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 9:
+        print "Usage: python resample.py outdir frameno x1 x2 y1 y2 dx fname.npy"
+        sys.exit(1)
+    outdir = sys.argv[1]
+    frameno = int(sys.argv[2])
+    bbox = [float(v) for v in sys.argv[3:7]]
+    dx = float(sys.argv[7])
+    fname = sys.argv[8]
+    # the surface eta is the last component of q:
+    x, y = resample_to_file(frameno, outdir, bbox, dx, fname, fields=[-1])
+    print "Wrote %s x %s raster to %s" % (len(y), len(x), fname)
@@ -0,0 +1,373 @@
+"""
+Pack a complete output directory into one compressed archive file, and
+read frames, gauges and fixed grids back from it without unpacking.
+
+The archive is a zip file (zip64, so it can exceed 4 GB) whose members
+are compressed separately, so any part can be read on its own:
+    meta.json                   frame numbers, times and meqn, gauge
+                                numbers, fixed grid extents and columns
+    frameNNNN/index             one row per grid as in frameindex.py,
+                                with the chunk and position of its data
+    frameNNNN/chunkKKKK         q of consecutive grids of one level,
+                                at most chunk_size values per chunk
+    gauges/gaugeNNNN            columns of a gauge as in gaugestore.py
+    fgNN/frameNNNN              one frame of a fixed grid as in fgcube.py
+    files/<name>                every other file of outdir (fort.amr,
+                                fort.tck*, the .data files, ...)
+Each array member is a .npy header followed by the bytes of the array
+regrouped so byte k of every value comes together, which compresses
+floating point data much better, then deflated with zlib.  The patch
+data can be stored as float32 to halve it again.
+
+Reading grids on given levels in a bbox only decompresses the chunks
+holding them.  The frames and fixed grid frames are parsed and compressed
+on a pool of processes and written to the archive as they come back.
+
+To use:
+    $ python runarchive.py _output                 # writes _output.zip
+    $ python runarchive.py _output run1.zip float32 8
+and interactively:
+    >>> import runarchive
+    >>> archive = runarchive.RunArchive('_output.zip')
+    >>> frame = archive.frame(1)
+    >>> grids = frame.getgrids(levels=[5], bbox=[110,111,-10,-6])
+    >>> g = archive.gauge(5)
+    >>> fgframe = archive.fg_frame(1, 3)
+
+"""
+
+import os, sys, glob, json, zlib, time, zipfile
+from cStringIO import StringIO
+import numpy as np
+
+import frameindex
+
+archive_index_dtype = np.dtype([('gridno', 'i4'), ('level', 'i4'),
+                                ('mx', 'i4'), ('my', 'i4'),
+                                ('xlow', 'f8'), ('ylow', 'f8'),
+                                ('dx', 'f8'), ('dy', 'f8'),
+                                ('chunk', 'i4'), ('start', 'i8')])
+
+
+def pack(a, compresslevel=6):
+    """
+    Compressed bytes of array a, see unpack.
+    """
+    a = np.ascontiguousarray(a)
+    f = StringIO()
+    np.lib.format.write_array_header_1_0(
+        f, np.lib.format.header_data_from_array_1_0(a))
+    # byte k of all values together:
+    shuffled = a.view(np.uint8).reshape((-1, a.dtype.itemsize)).T
+    f.write(np.ascontiguousarray(shuffled).tostring())
+    return zlib.compress(f.getvalue(), compresslevel)
+
+
+def unpack(data):
+    """
+    Array from the bytes made by pack.
+    """
+    f = StringIO(zlib.decompress(data))
+    np.lib.format.read_magic(f)
+    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    n = int(np.prod(shape))
+    shuffled = np.fromstring(f.read(), dtype=np.uint8)
+    values = shuffled.reshape((dtype.itemsize, n)).T.copy().view(dtype)
+    return values.reshape(shape)
+
+
+def frame_member(frameno, name):
+    return 'frame%s/%s' % (str(frameno).zfill(4), name)
+
+
+def chunk_name(k):
+    return 'chunk%s' % str(k).zfill(4)
+
+
+def _pack_frame(args):
+    # Parse frame frameno of outdir and return its members as a list of
+    # (name, bytes), the patches grouped by level into chunks.
+    outdir, frameno, dtype, chunk_size, compresslevel = args
+    frame = frameindex.IndexedFrame(frameno, outdir)
+    rows = np.sort(frame.index, order=['level', 'gridno'])
+    index = np.zeros(len(rows), dtype=archive_index_dtype)
+    for name in ['gridno', 'level', 'mx', 'my', 'xlow', 'ylow', 'dx', 'dy']:
+        index[name] = rows[name]
+    members = []
+    chunk, nvalues, k = [], 0, 0
+    f = open(frame.fname, 'rb')
+    try:
+        for n, row in enumerate(rows):
+            size = int(row['mx'])*int(row['my'])*frame.meqn
+            if chunk and (nvalues + size > chunk_size or
+                          row['level'] != rows[n-1]['level']):
+                members.append((frame_member(frameno, chunk_name(k)),
+                                pack(np.concatenate(chunk), compresslevel)))
+                chunk, nvalues, k = [], 0, k + 1
+            q = frame.read_q(row, f)
+            chunk.append(q.astype(dtype).ravel())
+            index[n]['chunk'] = k
+            index[n]['start'] = nvalues
+            nvalues += size
+    finally:
+        f.close()
+    if chunk:
+        members.append((frame_member(frameno, chunk_name(k)),
+                        pack(np.concatenate(chunk), compresslevel)))
+    members.append((frame_member(frameno, 'index'),
+                    pack(index, compresslevel)))
+    return members
+
+
+def _pack_fg(args):
+    # Parse one fixed grid frame and return its member as (name, bytes).
+    import fgcube
+    outdir, fgno, frameno, dtype, compresslevel = args
+    fname = fgcube.fg_fname(fgno, frameno, outdir)
+    t, mx, my, xlow, ylow, xhi, yhi, ncols = fgcube.read_fg_header(fname)
+    data = fgcube.read_fg_data(fname, mx, my, ncols).astype(dtype)
+    name = 'fg%s/frame%s' % (str(fgno).zfill(2), str(frameno).zfill(4))
+    return [(name, pack(data, compresslevel))]
+
+
+def _write(zf, name, data):
+    # The members are compressed already, so they are stored as they are.
+    zf.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data)
+
+
+def other_files(outdir):
+    """
+    Files of outdir that are not frames, fixed grids or gauges, nor
+    derived from them (indices, cubes, stores).
+    """
+    fnames = []
+    for fname in sorted(glob.glob(os.path.join(outdir, '*'))):
+        base = os.path.basename(fname)
+        if not os.path.isfile(fname) or \
+                os.path.splitext(base)[1] in ('.npy', '.npz') or \
+                base == 'fort.gauge' or \
+                base[:6] in ('fort.q', 'fort.t') and base[6:].isdigit() or \
+                base.startswith('fort.fg'):
+            continue
+        fnames.append(fname)
+    return fnames
+
+
+def convert(outdir='_output', fname=None, dtype='float64', nprocs=None,
+            chunk_size=2**20, compresslevel=6):
+    """
+    Pack outdir into the archive fname (outdir + '.zip' by default), with
+    the patch and fixed grid data stored as dtype.  The frames are packed
+    on a pool of nprocs processes (one per cpu if None, serially if 1).
+    Returns fname.
+    """
+    import fgcube, gaugestore
+    if fname is None:
+        fname = os.path.normpath(outdir) + '.zip'
+    framenos = frameindex.framenos(outdir)
+    meta = {'outdir': os.path.normpath(outdir), 'dtype': str(np.dtype(dtype)),
+            'framenos': framenos, 'times': [], 'meqn': [],
+            'gaugenos': [], 'fixedgrids': {}, 'files': []}
+    for frameno in framenos:
+        tdata = frameindex.read_tfile(frameno, outdir)
+        meta['times'].append(tdata['time'])
+        meta['meqn'].append(tdata['meqn'])
+
+    work = [(_pack_frame, (outdir, frameno, dtype, chunk_size, compresslevel))
+            for frameno in framenos]
+    fgnos = sorted(set([int(os.path.basename(f)[7:9]) for f in
+                        glob.glob(os.path.join(outdir, 'fort.fg[0-9][0-9]_*'))]))
+    for fgno in fgnos:
+        fg_framenos = fgcube.fg_framenos(fgno, outdir)
+        headers = [fgcube.read_fg_header(fgcube.fg_fname(fgno, frameno, outdir))
+                   for frameno in fg_framenos]
+        t, mx, my, xlow, ylow, xhi, yhi, ncols = headers[0]
+        try:
+            fixedgrid = fgcube.read_setfixedgrids(outdir)[fgno-1]
+            columns = fgcube.fg_columns(fixedgrid[9], fixedgrid[10])
+        except (IOError, IndexError):
+            columns = []
+        if len(columns) != ncols:
+            columns = ['col%s' % k for k in range(ncols)]
+        meta['fixedgrids'][str(fgno)] = {
+            'framenos': fg_framenos, 'times': [h[0] for h in headers],
+            'extent': [xlow, xhi, ylow, yhi], 'columns': columns}
+        work += [(_pack_fg, (outdir, fgno, frameno, dtype, compresslevel))
+                 for frameno in fg_framenos]
+
+    zf = zipfile.ZipFile(fname, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    try:
+        if nprocs == 1:
+            for work_item in work:
+                for name, data in _run(work_item):
+                    _write(zf, name, data)
+        else:
+            from multiprocessing import Pool
+            pool = Pool(nprocs)
+            try:
+                # members are written in order as the frames are done:
+                for members in pool.imap(_run, work):
+                    for name, data in members:
+                        _write(zf, name, data)
+            finally:
+                pool.close()
+                pool.join()
+
+        store = gaugestore.GaugeStore(outdir)
+        for gaugeno in store.gaugenos:
+            _write(zf, 'gauges/gauge%s' % str(gaugeno).zfill(4),
+                   pack(store.gauge(gaugeno).data, compresslevel))
+        meta['gaugenos'] = store.gaugenos
+        for other in other_files(outdir):
+            base = os.path.basename(other)
+            _write(zf, 'files/' + base,
+                   zlib.compress(open(other, 'rb').read(), compresslevel))
+            meta['files'].append(base)
+        _write(zf, 'meta.json', json.dumps(meta, indent=1))
+    finally:
+        zf.close()
+    return fname
+
+
+def _run(work_item):
+    # Pool worker calling one of the packing functions.
+    func, args = work_item
+    return func(args)
+
+
+class ArchivedFrame(object):
+    """
+    One frame of a RunArchive, with the index, select, read_q, getgrids
+    and itergrids of frameindex.IndexedFrame.  Chunks are decompressed
+    when one of their grids is read and the last one is kept.
+    """
+
+    def __init__(self, archive, frameno):
+        self.archive = archive
+        self.frameno = frameno
+        k = archive.framenos.index(frameno)
+        self.t = archive.times[k]
+        self.meqn = archive.meqn[k]
+        self.index = unpack(archive.read(frame_member(frameno, 'index')))
+        self._chunk = (None, None)
+
+    def levels(self):
+        return sorted(set(self.index['level']))
+
+    def select(self, levels=None, bbox=None):
+        return self.index[frameindex.select(self.index, levels, bbox)]
+
+    def read_q(self, row, f=None):
+        """
+        Return q of the grid of index row with shape (mx, my, meqn).
+        """
+        k = int(row['chunk'])
+        if self._chunk[0] != k:
+            data = self.archive.read(frame_member(self.frameno, chunk_name(k)))
+            self._chunk = (k, unpack(data))
+        mx, my = int(row['mx']), int(row['my'])
+        start = int(row['start'])
+        q = self._chunk[1][start:start + mx*my*self.meqn]
+        return q.reshape((mx, my, self.meqn))
+
+    def getgrids(self, levels=None, bbox=None):
+        return [frameindex.Patch(row, self.read_q(row))
+                for row in self.select(levels, bbox)]
+
+    def itergrids(self, levels=None, bbox=None):
+        for row in self.select(levels, bbox):
+            yield frameindex.Patch(row, self.read_q(row))
+
+
+class RunArchive(object):
+    """
+    Read access to an archive made by convert.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.zf = zipfile.ZipFile(fname, 'r', allowZip64=True)
+        meta = json.loads(self.zf.read('meta.json'))
+        self.meta = meta
+        self.framenos = meta['framenos']
+        self.times = meta['times']
+        self.meqn = meta['meqn']
+        self.gaugenos = meta['gaugenos']
+        self.fgnos = sorted([int(fgno) for fgno in meta['fixedgrids']])
+        self.files = meta['files']
+
+    def read(self, name):
+        return self.zf.read(name)
+
+    def close(self):
+        self.zf.close()
+
+    def frame(self, frameno):
+        """
+        Return an ArchivedFrame for frame frameno.
+        """
+        if frameno not in self.framenos:
+            raise KeyError("Frame %s not in %s" % (frameno, self.fname))
+        return ArchivedFrame(self, frameno)
+
+    def gauge(self, gaugeno):
+        """
+        Return the gaugestore.GaugeColumns of gaugeno.
+        """
+        import gaugestore
+        if gaugeno not in self.gaugenos:
+            raise KeyError("Gauge %s not in %s" % (gaugeno, self.fname))
+        data = unpack(self.read('gauges/gauge%s' % str(gaugeno).zfill(4)))
+        return gaugestore.GaugeColumns(gaugeno, data)
+
+    def fg_frame(self, fgno, frameno):
+        """
+        Return an fgcube.FGFrame for frame frameno of fixed grid fgno.
+        """
+        import fgcube
+        fg = self.meta['fixedgrids'][str(fgno)]
+        k = fg['framenos'].index(frameno)
+        data = unpack(self.read('fg%s/frame%s' % (str(fgno).zfill(2),
+                                                   str(frameno).zfill(4))))
+        my, mx, ncols = data.shape
+        fgframe = fgcube.FGFrame()
+        fgframe.frameno = frameno
+        fgframe.t = fg['times'][k]
+        fgframe.mx, fgframe.my = mx, my
+        fgframe.xlow, fgframe.xhi, fgframe.ylow, fgframe.yhi = fg['extent']
+        fgframe.X, fgframe.Y = np.meshgrid(np.linspace(fgframe.xlow,
+                                                       fgframe.xhi, mx),
+                                           np.linspace(fgframe.ylow,
+                                                       fgframe.yhi, my))
+        for m, name in enumerate(fg['columns']):
+            setattr(fgframe, name, data[:, :, m])
+        return fgframe
+
+    def file(self, name):
+        """
+        Contents of the file name of the output directory, e.g. 'fort.amr'.
+        """
+        return zlib.decompress(self.read('files/' + name))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Usage: python runarchive.py outdir [fname.zip] [dtype] [nprocs]"
+        sys.exit(1)
+    outdir = sys.argv[1]
+    fname = None
+    dtype = 'float64'
+    nprocs = None
+    if len(sys.argv) > 2:
+        fname = sys.argv[2]
+    if len(sys.argv) > 3:
+        dtype = sys.argv[3]
+    if len(sys.argv) > 4:
+        nprocs = int(sys.argv[4])
+    t0 = time.time()
+    fname = convert(outdir, fname, dtype, nprocs)
+    nbytes = sum([os.path.getsize(f) for f in glob.glob(os.path.join(outdir, '*'))
+                  if os.path.isfile(f) and
+                  os.path.splitext(f)[1] not in ('.npy', '.npz')])
+    print "Wrote %s in %.1f seconds, %.1f MB from %.1f MB" \
+          % (fname, time.time() - t0, os.path.getsize(fname)/1.e6, nbytes/1.e6)
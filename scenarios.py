@@ -0,0 +1,196 @@
+"""
+Generate and run many scenarios from one setrun.py.
+
+A scenario table (csv, or yaml if PyYAML is installed) has one row per
+scenario, with a column name and one column per parameter to override in
+the rundata made by setrun(), e.g.
+
+    name,geodata.dtopofiles,geodata.coeffmanning
+    base,"[[3,1,1,'java2.tt3']]",0.025
+    smooth,"[[3,1,1,'java2.tt3']]",0.015
+
+Values are read as python literals, so lists such as geodata.regions or
+geodata.gauges can be replaced as a whole.  An optional column weight is
+not a parameter but the weight of the scenario in ensemble.py.  For each
+scenario a directory rundir/name is made with its *.data files, and the
+topo, dtopo and qinit files it uses are symlinked into it rather than
+copied.  The runs can then be launched with xgeoclaw on a bounded number
+of worker processes, and the exit status and run time of each are
+collected in rundir/summary.csv.
+
+To use:
+    $ python scenarios.py scenarios.csv              # only write the data
+    $ python scenarios.py scenarios.csv run 4        # and run 4 at a time
+
+"""
+
+import os, sys, csv, ast, time, subprocess
+
+
+def read_table(fname):
+    """
+    Return the list of scenarios in fname as dictionaries mapping
+    'name' and the parameter names to their values.
+    """
+    if os.path.splitext(fname)[1] in ['.yaml', '.yml']:
+        import yaml
+        scenarios = yaml.safe_load(open(fname))
+    else:
+        scenarios = []
+        for row in csv.DictReader(open(fname)):
+            scenario = {}
+            for key, value in row.items():
+                key = key.strip()
+                value = value.strip()
+                if key == 'name' or value == '':
+                    scenario[key] = value
+                    continue
+                try:
+                    scenario[key] = ast.literal_eval(value)
+                except (ValueError, SyntaxError):
+                    scenario[key] = value
+            scenarios.append(scenario)
+    for k, scenario in enumerate(scenarios):
+        if not scenario.get('name'):
+            scenario['name'] = 'scenario%s' % str(k).zfill(4)
+    return scenarios
+
+
+def apply_overrides(rundata, scenario):
+    """
+    Set each parameter of scenario, e.g. geodata.coeffmanning, in rundata.
+    """
+    for key, value in scenario.items():
+        if key in ('name', 'weight') or value == '':
+            continue
+        if '.' not in key:
+            raise ValueError("Parameter %s should be of the form "
+                             "clawdata.name or geodata.name" % key)
+        attr, name = key.split('.', 1)
+        target = getattr(rundata, attr)
+        if not hasattr(target, name):
+            raise AttributeError("rundata.%s has no parameter %s"
+                                 % (attr, name))
+        setattr(target, name, value)
+    return rundata
+
+
+def input_files(rundata):
+    """
+    Files read by xgeoclaw that are named in rundata.geodata.
+    """
+    geodata = rundata.geodata
+    fnames = [topofile[-1] for topofile in geodata.topofiles]
+    fnames += [dtopofile[-1] for dtopofile in geodata.dtopofiles]
+    fnames += [qinitfile[-1]
+               for qinitfile in getattr(geodata, 'qinitfiles', [])]
+    return fnames
+
+
+def link_inputs(rundata, rundir, basedir='.'):
+    """
+    Symlink the input files of rundata from basedir into rundir.
+    """
+    for fname in input_files(rundata):
+        if os.path.isabs(fname):
+            continue
+        source = os.path.abspath(os.path.join(basedir, fname))
+        target = os.path.join(rundir, fname)
+        if not os.path.exists(source):
+            print "*** Warning: input file %s not found" % source
+        if os.path.lexists(target):
+            os.remove(target)
+        os.symlink(source, target)
+
+
+def write_data(rundata, rundir):
+    """
+    Write the *.data files of rundata into rundir, leaving files whose
+    contents did not change untouched.
+    """
+    import datawrite
+    return datawrite.write_changed(rundata, rundir, verbose=False)
+
+
+def make_rundirs(table_fname, setrun_file='setrun.py', rundir='_scenarios'):
+    """
+    Make a directory in rundir for each scenario of the table, holding its
+    *.data files and links to the shared input files.
+    Returns the list of scenario directories.
+    """
+    import imp
+    setrun_module = imp.load_source('setrun_scenarios',
+                                    os.path.abspath(setrun_file))
+    basedir = os.path.dirname(os.path.abspath(setrun_file))
+    scenarios = read_table(table_fname)
+    rundirs = []
+    for scenario in scenarios:
+        scenario_dir = os.path.join(rundir, scenario['name'])
+        if not os.path.isdir(scenario_dir):
+            os.makedirs(scenario_dir)
+        rundata = apply_overrides(setrun_module.setrun(), scenario)
+        write_data(rundata, scenario_dir)
+        link_inputs(rundata, scenario_dir, basedir)
+        rundirs.append(scenario_dir)
+        print "Created %s" % scenario_dir
+    return rundirs
+
+
+def run_xgeoclaw(rundir, executable='xgeoclaw'):
+    """
+    Run executable in rundir, with output to rundir/xgeoclaw.log.
+    Returns (rundir, exit status, seconds).
+    """
+    executable = os.path.abspath(executable)
+    log = open(os.path.join(rundir, 'xgeoclaw.log'), 'w')
+    t0 = time.time()
+    try:
+        status = subprocess.call([executable], cwd=rundir, stdout=log,
+                                 stderr=subprocess.STDOUT)
+    except OSError, e:
+        log.write("*** Could not run %s: %s\n" % (executable, e))
+        status = -1
+    log.close()
+    return rundir, status, time.time() - t0
+
+
+def run_all(rundirs, nprocs=None, executable='xgeoclaw', summary=None):
+    """
+    Run xgeoclaw in each of rundirs with at most nprocs running at once
+    (one per cpu if None).  The results are written to the csv file
+    summary if given, and returned as a list of (rundir, status, seconds).
+    """
+    from multiprocessing.pool import ThreadPool
+    from multiprocessing import cpu_count
+    if nprocs is None:
+        nprocs = cpu_count()
+    # each thread only waits for its xgeoclaw process:
+    pool = ThreadPool(nprocs)
+    try:
+        results = pool.map(lambda rundir: run_xgeoclaw(rundir, executable),
+                           rundirs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    if summary is not None:
+        writer = csv.writer(open(summary, 'w'))
+        writer.writerow(['rundir', 'status', 'seconds'])
+        for rundir, status, seconds in results:
+            writer.writerow([rundir, status, '%.1f' % seconds])
+    for rundir, status, seconds in results:
+        if status != 0:
+            print "*** %s failed with status %s" % (rundir, status)
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Usage: python scenarios.py table.csv [run [nprocs]]"
+        sys.exit(1)
+    rundir = '_scenarios'
+    rundirs = make_rundirs(sys.argv[1], rundir=rundir)
+    if len(sys.argv) > 2 and sys.argv[2] == 'run':
+        nprocs = None
+        if len(sys.argv) > 3:
+            nprocs = int(sys.argv[3])
+        run_all(rundirs, nprocs, summary=os.path.join(rundir, 'summary.csv'))
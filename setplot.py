@@ -21,6 +21,16 @@ except:
     print "Did not find setplotfg.py"
     setplotfg = None
 
+try:
+    import gaugestore
+except:
+    gaugestore = None
+
+try:
+    import gaugecompare
+except:
+    gaugecompare = None
+
 
 
 #--------------------------
@@ -36,6 +46,13 @@ def setplot(plotdata):
 
 
     from pyclaw.plotters import colormaps, geoplot
+    import plotcache
+
+    # Each of these is computed once per frame and grid and shared by all
+    # figures below, see plotcache.py:
+    surface_or_depth = plotcache.cached(geoplot.surface_or_depth)
+    land = plotcache.cached(geoplot.land)
+    topo = plotcache.cached(geoplot.topo)
 
     plotdata.clearfigures()  # clear any old figures,axes,items data
 
@@ -63,7 +80,7 @@ def setplot(plotdata):
 
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.surface_or_depth
+    plotitem.plot_var = surface_or_depth
     my_cmap = colormaps.make_colormap({-1.0: [0.0,0.0,1.0], \
                                       -0.1: [0.5,0.5,1.0], \
                                        0.0: [1.0,1.0,1.0], \
@@ -78,7 +95,7 @@ def setplot(plotdata):
 
     # Land
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.land
+    plotitem.plot_var = land
     plotitem.imshow_cmap = geoplot.land_colors
     plotitem.imshow_cmin = 0.0
     plotitem.imshow_cmax = 100.0
@@ -112,7 +129,7 @@ def setplot(plotdata):
 
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.surface_or_depth
+    plotitem.plot_var = surface_or_depth
     my_cmap = colormaps.make_colormap({-1.0: [0.0,0.0,1.0], \
                                       -0.1: [0.5,0.5,1.0], \
                                        0.0: [1.0,1.0,1.0], \
@@ -127,7 +144,7 @@ def setplot(plotdata):
 
     # Land
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.land
+    plotitem.plot_var = land
     plotitem.imshow_cmap = geoplot.land_colors
     plotitem.imshow_cmin = 0.0
     plotitem.imshow_cmax = 100.0
@@ -150,7 +167,7 @@ def setplot(plotdata):
 
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.surface_or_depth
+    plotitem.plot_var = surface_or_depth
     my_cmap = colormaps.make_colormap({-1.0: [0.0,0.0,1.0], \
                                       -0.1: [0.5,0.5,1.0], \
                                        0.0: [1.0,1.0,1.0], \
@@ -165,7 +182,7 @@ def setplot(plotdata):
 
     # Land
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.land
+    plotitem.plot_var = land
     plotitem.imshow_cmap = geoplot.land_colors
     plotitem.imshow_cmin = 0.0
     plotitem.imshow_cmax = 100.0
@@ -178,7 +195,7 @@ def setplot(plotdata):
  
    # Add contour lines of bathymetry:
     plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.plot_var = geoplot.topo
+    plotitem.plot_var = topo
     from numpy import arange, linspace
     plotitem.contour_levels = arange(-10., 0., 1.)
     plotitem.amr_contour_colors = ['k']  # color on each level
@@ -191,7 +208,7 @@ def setplot(plotdata):
  
     # Add contour lines of topography:
     plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.plot_var = geoplot.topo
+    plotitem.plot_var = topo
     from numpy import arange, linspace
     plotitem.contour_levels = arange(0., 11., 1.)
     plotitem.amr_contour_colors = ['g']  # color on each level
@@ -214,7 +231,7 @@ def setplot(plotdata):
 
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.surface_or_depth
+    plotitem.plot_var = surface_or_depth
     my_cmap = colormaps.make_colormap({-1.0: [0.0,0.0,1.0], \
                                       -0.1: [0.5,0.5,1.0], \
                                        0.0: [1.0,1.0,1.0], \
@@ -229,7 +246,7 @@ def setplot(plotdata):
 
     # Land
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.land
+    plotitem.plot_var = land
     plotitem.imshow_cmap = geoplot.land_colors
     plotitem.imshow_cmin = 0.0
     plotitem.imshow_cmax = 100.0
@@ -242,7 +259,7 @@ def setplot(plotdata):
  
    # Add contour lines of bathymetry:
     plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.plot_var = geoplot.topo
+    plotitem.plot_var = topo
     from numpy import arange, linspace
     plotitem.contour_levels = arange(-10., 0., 1.)
     plotitem.amr_contour_colors = ['k']  # color on each level
@@ -254,7 +271,7 @@ def setplot(plotdata):
 
     # Add contour lines of topography:
     plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.plot_var = geoplot.topo
+    plotitem.plot_var = topo
     from numpy import arange, linspace
     plotitem.contour_levels = arange(0., 11., 1.)
     plotitem.amr_contour_colors = ['g']  # color on each level
@@ -277,7 +294,7 @@ def setplot(plotdata):
 
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.surface_or_depth
+    plotitem.plot_var = surface_or_depth
     my_cmap = colormaps.make_colormap({-1.0: [0.0,0.0,1.0], \
                                       -0.1: [0.5,0.5,1.0], \
                                        0.0: [1.0,1.0,1.0], \
@@ -292,7 +309,7 @@ def setplot(plotdata):
 
     # Land
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.land
+    plotitem.plot_var = land
     plotitem.imshow_cmap = geoplot.land_colors
     plotitem.imshow_cmin = 0.0
     plotitem.imshow_cmax = 100.0
@@ -305,7 +322,7 @@ def setplot(plotdata):
  
    # Add contour lines of bathymetry:
     plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.plot_var = geoplot.topo
+    plotitem.plot_var = topo
     from numpy import arange, linspace
     plotitem.contour_levels = arange(-10., 0., 1.)
     plotitem.amr_contour_colors = ['k']  # color on each level
@@ -317,7 +334,7 @@ def setplot(plotdata):
 
     # Add contour lines of topography:
     plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.plot_var = geoplot.topo
+    plotitem.plot_var = topo
     from numpy import arange, linspace
     plotitem.contour_levels = arange(0., 11., 1.)
     plotitem.amr_contour_colors = ['g']  # color on each level
@@ -340,7 +357,7 @@ def setplot(plotdata):
     plotaxes.scaled = True
 
     plotitem = plotaxes.new_plotitem(plot_type='2d_pcolor')
-    plotitem.plot_var = geoplot.topo
+    plotitem.plot_var = topo
     plotitem.pcolor_cmap = geoplot.bathy1_colormap
     plotitem.pcolor_cmap = colormaps.make_colormap({-1:[0.3,0.2,0.1],
                                            -0.01:[0.95,0.9,0.7],
@@ -366,6 +383,21 @@ def setplot(plotdata):
     plotfigure = plotdata.new_plotfigure(name='gauge plot', figno=300, \
                     type='each_gauge')
 
+    # Read fort.gauge once for all gauges, see gaugestore.py:
+    if gaugestore is not None:
+        try:
+            gaugestore.fill_plotdata(plotdata)
+        except:
+            print "*** Could not use gaugestore, gauges read from fort.gauge"
+
+    # Tide gauge records obs/TGnnnn.txt for gauge nnnn, see gaugecompare.py:
+    observations = None
+    if gaugecompare is not None:
+        try:
+            observations = gaugecompare.ObservationStore('obs')
+        except:
+            print "*** Could not read observations in obs"
+
     # Set up for axes in this figure:
     plotaxes = plotfigure.new_plotaxes()
     plotaxes.xlimits = 'auto'
@@ -395,14 +427,11 @@ def setplot(plotdata):
         t = current_data.t
         gaugeno = current_data.gaugeno
     
-        if gaugeno == 32412:
-            plot(TG32412[:,0], TG32412[:,1], 'r')
+        if observations is not None and gaugeno in observations.gaugenos:
+            obs = observations.gauge(gaugeno)
+            plot(obs.t, obs.eta, 'r')
             legend(['GeoClaw','Obs'],'lower right')
             axis((0,t.max(),-0.3,0.3))
-        if gaugeno == 51406:
-            plot(TG51406[:,0], TG51406[:,1], 'r')
-            legend(['GeoClaw','Obs'],'lower left')
-            axis((0,t.max(),-0.3,0.3))
 
         #legend(('surface','topography'),loc='lower left')
         plot(t, 0*t, 'k')
@@ -451,7 +480,7 @@ def setplot(plotdata):
 
     # Land
     plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.plot_var = geoplot.land
+    plotitem.plot_var = land
     plotitem.contour_nlevels = 40
     plotitem.contour_min = 0.0
     plotitem.contour_max = 100.0
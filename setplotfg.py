@@ -9,6 +9,10 @@ To use interactively:
     >>> fgdata.plotfg(frameno)   # to plot one frame"
     >>> fgdata.fg2html('all')    # to make html files of all plots"
 
+To check that the frames plotted are read from the cube of fgcube.py and
+agree with the fort.fgNN_NNNN files:
+    $ python setplotfg.py 1 _output
+
 """
 
 def setplotfg(fgno=1, outdir='_output'):
@@ -28,6 +32,20 @@ def setplotfg(fgno=1, outdir='_output'):
     # Fixed grid to display:
     fgdata.fgno = fgno
 
+    # Read frames from the memory-mapped cube made by fgcube.py rather than
+    # parsing each fort.fg file as text, by replacing get_frame, which
+    # plotfg, fgloop and fg2html call for each frame:
+    try:
+        import fgcube
+        fgdata.cube = fgcube.FGCube(fgno, outdir)
+    except (IOError, ValueError), e:
+        print "*** Could not use fgcube (%s), fixed grid frames read as text" \
+              % e
+    else:
+        def get_frame(frameno):
+            return fgdata.cube.get_frame(frameno, fgdata.drytol)
+        fgdata.get_frame = get_frame
+
     if fgno>0:
 
         # Could set things differently for each fgno if desired...
@@ -72,3 +90,30 @@ def setplotfg(fgno=1, outdir='_output'):
         fgdata.exposed_tol = 1.e-2
 
     return fgdata
+
+
+if __name__ == '__main__':
+    import sys
+    import numpy as np
+    import fgcube
+    fgno = 1
+    outdir = '_output'
+    if len(sys.argv) > 1:
+        fgno = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        outdir = sys.argv[2]
+    fgdata = setplotfg(fgno, outdir)
+    if not hasattr(fgdata, 'cube'):
+        print "*** Frames of fixed grid %s are not read from the cube" % fgno
+        sys.exit(1)
+    for frameno in fgcube.fg_framenos(fgno, outdir):
+        grid, solution = fgdata.get_frame(frameno)
+        fname = fgcube.fg_fname(fgno, frameno, outdir)
+        t, mx, my, xlow, ylow, xhi, yhi, ncols = fgcube.read_fg_header(fname)
+        data = fgcube.read_fg_data(fname, mx, my, ncols)
+        if not (np.allclose(solution.t, t) and np.allclose(
+                solution.fg, np.rollaxis(data, 2), equal_nan=True)):
+            print "*** Frame %s of the cube differs from %s" % (frameno, fname)
+            sys.exit(1)
+    print "Frames of fixed grid %s read from %s" % (fgno,
+                                                    fgcube.cube_fname(fgno, outdir))
@@ -384,5 +384,7 @@ if __name__ == '__main__':
     else:
 	rundata = setrun()
 
-    rundata.write()
+    # Only rewrite the data files whose contents changed:
+    import datawrite
+    datawrite.write_changed(rundata)
 
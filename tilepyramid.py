@@ -0,0 +1,354 @@
+"""
+Map tile pyramid of the AMR frames, browsed with a static viewer page.
+
+Instead of one figure per window (Java, Java2, ... in setplot.py), each
+frame is rasterized once into 256x256 pixel PNG tiles
+    tiledir/frameNNNN/z/x/y.png
+in a lat-long pyramid over the computational domain: the single tile of
+zoom 0 covers a square of side the larger of the domain's width and
+height from its north-west corner, and each zoom level halves the tile
+size.  Tile x counts from the west and y from the north.
+
+The tiles of zoom z are drawn from the grids on the levels up to the
+coarsest AMR level whose cells are no larger than the pixels of that zoom,
+with the finest grid covering a pixel winning, and only tiles intersecting
+those grids are made (see resample.py).  Water is colored by
+surface_or_depth and land by land as in setplot.py.  The tiles are
+rendered by a pool of processes, and tiledir/viewer.html shows them with
+a frame slider, dragging and mouse wheel zoom.
+
+To use:
+    $ python tilepyramid.py _output _tiles 4
+and open _tiles/viewer.html in a browser.
+
+"""
+
+import os, sys, json, zlib, struct
+import numpy as np
+
+import frameindex, resample
+
+tile_size = 256
+drytol = 1.e-3
+
+# colormaps of setplot.py, {value: rgb} mapped linearly from cmin to cmax:
+water_colors = {-1.0: [0.0, 0.0, 1.0], -0.1: [0.5, 0.5, 1.0],
+                0.0: [1.0, 1.0, 1.0], 0.1: [1.0, 0.5, 0.5],
+                1.0: [1.0, 0.0, 0.0]}
+water_limits = (-1.0, 1.0)
+land_colors = {0.0: [0.5, 0.7, 0.0], 1.0: [0.2, 0.5, 0.2]}
+land_limits = (0.0, 100.0)
+
+
+def apply_colormap(values, colors, limits):
+    """
+    RGB array (uint8) for values, nan where not defined.
+    """
+    keys = sorted(colors.keys())
+    cmin, cmax = limits
+    s = np.clip((values - cmin)/float(cmax - cmin), 0., 1.)
+    # colormap keys run from -1 to 1 for water and 0 to 1 for land:
+    s = keys[0] + s*(keys[-1] - keys[0])
+    rgb = np.zeros(values.shape + (3,), dtype=np.uint8)
+    for c in range(3):
+        rgb[..., c] = np.round(255*np.interp(s, keys, [colors[k][c]
+                                                       for k in keys]))
+    return rgb
+
+
+def write_png(fname, rgba):
+    """
+    Write the (height, width, 4) uint8 array rgba as a PNG file.
+    """
+    height, width = rgba.shape[:2]
+    raw = b''.join([b'\x00' + rgba[j].tostring() for j in range(height)])
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data \
+               + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    f = open(fname, 'wb')
+    f.write(b'\x89PNG\r\n\x1a\n')
+    f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6,
+                                       0, 0, 0)))
+    f.write(chunk(b'IDAT', zlib.compress(raw, 6)))
+    f.write(chunk(b'IEND', b''))
+    f.close()
+
+
+class Pyramid(object):
+    """
+    Geometry of the tiles over domain [x1, x2, y1, y2].
+    """
+
+    def __init__(self, domain):
+        self.xlower, self.xupper, self.ylower, self.yupper = domain
+        self.size = max(self.xupper - self.xlower, self.yupper - self.ylower)
+
+    def tile_width(self, z):
+        return self.size/2.**z
+
+    def bbox(self, z, x, y):
+        w = self.tile_width(z)
+        x1 = self.xlower + x*w
+        y2 = self.yupper - y*w
+        return [x1, x1 + w, y2 - w, y2]
+
+    def maxzoom(self, dx):
+        """
+        Smallest zoom whose pixels are no larger than dx.
+        """
+        return max(0, int(np.ceil(np.log2(self.size/(tile_size*dx)) - 1e-9)))
+
+    def level(self, z, level_dx):
+        """
+        Coarsest level (from 1) of cell size level_dx no larger than the
+        pixels of zoom z, or the finest level.
+        """
+        pixel = self.tile_width(z)/tile_size
+        for level, dx in enumerate(level_dx):
+            if dx <= pixel*(1. + 1e-9):
+                return level + 1
+        return len(level_dx)
+
+    def tiles(self, z, index):
+        """
+        Set of (x, y) of the tiles of zoom z intersecting the grids of
+        index rows.
+        """
+        w = self.tile_width(z)
+        n = 2**z
+        xhi = index['xlow'] + index['mx']*index['dx']
+        yhi = index['ylow'] + index['my']*index['dy']
+        ix1 = np.floor((index['xlow'] - self.xlower)/w).astype(int)
+        ix2 = np.ceil((xhi - self.xlower)/w).astype(int) - 1
+        iy1 = np.floor((self.yupper - yhi)/w).astype(int)
+        iy2 = np.ceil((self.yupper - index['ylow'])/w).astype(int) - 1
+        tiles = set()
+        for a, b, c, d in zip(ix1, ix2, iy1, iy2):
+            for x in range(max(a, 0), min(b, n-1) + 1):
+                for y in range(max(c, 0), min(d, n-1) + 1):
+                    tiles.add((x, y))
+        return tiles
+
+
+def tile_rgba(q):
+    """
+    RGBA image of surface_or_depth over land, transparent where q is nan.
+    """
+    h = q[..., 0]
+    eta = q[..., -1]
+    topo = eta - h
+    covered = ~np.isnan(h)
+    wet = covered & (np.where(covered, h, 0.) > drytol)
+    dry = covered & ~wet
+    # surface_or_depth: surface offshore, water depth onshore
+    water = np.where(topo[wet] < 0., eta[wet], h[wet])
+    rgba = np.zeros(h.shape + (4,), dtype=np.uint8)
+    rgba[wet, :3] = apply_colormap(water, water_colors, water_limits)
+    rgba[dry, :3] = apply_colormap(topo[dry], land_colors, land_limits)
+    rgba[covered, 3] = 255
+    return rgba
+
+
+_frames = {}
+_patch_cache = None
+
+
+def _render_tile(args):
+    # Render one tile (outdir, tiledir, frameno, z, x, y, level, domain)
+    # in a worker, keeping the frames and recently read patches of the process.
+    global _patch_cache
+    import plotcache
+    outdir, tiledir, frameno, z, x, y, level, domain = args
+    if _patch_cache is None:
+        _patch_cache = plotcache.PlotVarCache()
+    if frameno not in _frames:
+        _frames[frameno] = frameindex.IndexedFrame(frameno, outdir)
+    frame = _frames[frameno]
+    bbox = Pyramid(domain).bbox(z, x, y)
+    rows = frame.select(range(1, level+1), bbox)
+    if len(rows) == 0:
+        return None
+    q = resample.resample(frame, bbox, (bbox[1] - bbox[0])/tile_size,
+                          (bbox[3] - bbox[2])/tile_size,
+                          levels=range(1, level+1),
+                          patch_cache=_patch_cache)[2]
+    # images go from north to south:
+    q = q[::-1]
+    dirname = os.path.join(tiledir, 'frame%s' % str(frameno).zfill(4),
+                           str(z), str(x))
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            pass   # made by another process meanwhile
+    fname = os.path.join(dirname, '%s.png' % y)
+    write_png(fname, tile_rgba(q))
+    return fname
+
+
+def tile_items(outdir, domain, framenos=None, maxzoom=None):
+    """
+    Work items for _render_tile for all frames and zooms, and the dict
+    written to index.json.
+    """
+    pyramid = Pyramid(domain)
+    if framenos is None:
+        framenos = frameindex.framenos(outdir)
+    items = []
+    info = {'domain': list(domain), 'size': pyramid.size,
+            'tile_size': tile_size, 'frames': []}
+    for frameno in framenos:
+        frame = frameindex.IndexedFrame(frameno, outdir)
+        index = frame.index
+        levels = frame.levels()
+        level_dx = [index['dx'][index['level'] == level].min()
+                    for level in levels]
+        zmax = pyramid.maxzoom(min(level_dx))
+        if maxzoom is not None:
+            zmax = min(zmax, maxzoom)
+        for z in range(zmax + 1):
+            level = levels[pyramid.level(z, level_dx) - 1]
+            rows = index[index['level'] <= level]
+            for x, y in sorted(pyramid.tiles(z, rows)):
+                items.append((outdir, None, frameno, z, x, y, level,
+                              list(domain)))
+        info['frames'].append({'frameno': frameno, 't': frame.t,
+                               'maxzoom': zmax})
+    return items, info
+
+
+def make_tiles(outdir='_output', tiledir='_tiles', nprocs=None, domain=None,
+               framenos=None, maxzoom=None):
+    """
+    Render the tile pyramid of the frames of outdir into tiledir with
+    nprocs processes, and write index.json and viewer.html there.
+    The domain defaults to that of amr2ez.data.
+    Returns the number of tiles written.
+    """
+    from multiprocessing import Pool, cpu_count
+    if domain is None:
+        import amrprofile
+        amr = amrprofile.read_datafile(os.path.join(outdir, 'amr2ez.data'))
+        domain = [float(amr[name][0]) for name in
+                  ['xlower', 'xupper', 'ylower', 'yupper']]
+    if not os.path.isdir(tiledir):
+        os.makedirs(tiledir)
+    items, info = tile_items(outdir, domain, framenos, maxzoom)
+    items = [item[:1] + (tiledir,) + item[2:] for item in items]
+    if nprocs is None:
+        nprocs = cpu_count()
+    pool = Pool(nprocs)
+    try:
+        # tiles of one frame and zoom are neighbours, so a chunk mostly
+        # reads the same grids:
+        fnames = pool.map(_render_tile, items,
+                          chunksize=max(1, len(items)//(4*nprocs)))
+    finally:
+        pool.close()
+        pool.join()
+    json.dump(info, open(os.path.join(tiledir, 'index.json'), 'w'), indent=1)
+    write_viewer(info, os.path.join(tiledir, 'viewer.html'))
+    return len([f for f in fnames if f is not None])
+
+
+viewer_html = """<html>
+<head>
+<title>Tiles</title>
+<style>
+body { margin: 0; font-family: sans-serif; }
+#map { position: absolute; top: 40px; bottom: 0; left: 0; right: 0;
+       overflow: hidden; background: #888; cursor: move; }
+#map img { position: absolute; width: 256px; height: 256px; }
+#bar { height: 40px; padding: 8px; box-sizing: border-box; }
+</style>
+</head>
+<body>
+<div id="bar">
+Frame <input id="frame" type="range" min="0" value="0">
+<span id="label"></span>
+</div>
+<div id="map"></div>
+<script>
+var info = INFO;
+var map = document.getElementById('map');
+var slider = document.getElementById('frame');
+var label = document.getElementById('label');
+var z = 0, cx = 0.5, cy = 0.5;   // center in units of the zoom 0 tile
+slider.max = info.frames.length - 1;
+
+function pad(n) { return ('000' + n).slice(-4); }
+
+function draw() {
+    var frame = info.frames[slider.value];
+    var zoom = Math.min(z, frame.maxzoom);
+    var scale = 256*Math.pow(2, z);              // pixels per zoom 0 tile
+    var tile = 256*Math.pow(2, z - zoom);        // pixels per tile shown
+    var w = map.clientWidth, h = map.clientHeight;
+    var x0 = w/2 - cx*scale, y0 = h/2 - cy*scale;
+    var n = Math.pow(2, zoom);
+    map.innerHTML = '';
+    for (var x = Math.max(0, Math.floor(-x0/tile));
+         x < Math.min(n, Math.ceil((w - x0)/tile)); x++) {
+        for (var y = Math.max(0, Math.floor(-y0/tile));
+             y < Math.min(n, Math.ceil((h - y0)/tile)); y++) {
+            var img = document.createElement('img');
+            img.src = 'frame' + pad(frame.frameno) + '/' + zoom + '/' + x
+                      + '/' + y + '.png';
+            img.style.left = (x0 + x*tile) + 'px';
+            img.style.top = (y0 + y*tile) + 'px';
+            img.style.width = img.style.height = tile + 'px';
+            img.onerror = function() { this.style.display = 'none'; };
+            map.appendChild(img);
+        }
+    }
+    var lon = info.domain[0] + cx*info.size;
+    var lat = info.domain[3] - cy*info.size;
+    label.innerHTML = 'frame ' + frame.frameno + ', t = ' + frame.t
+                      + ' s, zoom ' + z + ', center ' + lon.toFixed(3)
+                      + ', ' + lat.toFixed(3);
+}
+
+var drag = null;
+map.onmousedown = function(e) { drag = [e.clientX, e.clientY]; return false; };
+document.onmouseup = function() { drag = null; };
+document.onmousemove = function(e) {
+    if (!drag) return;
+    var scale = 256*Math.pow(2, z);
+    cx -= (e.clientX - drag[0])/scale;
+    cy -= (e.clientY - drag[1])/scale;
+    drag = [e.clientX, e.clientY];
+    draw();
+};
+map.onwheel = function(e) {
+    z = Math.max(0, Math.min(z + (e.deltaY < 0 ? 1 : -1), 20));
+    draw();
+    return false;
+};
+slider.oninput = draw;
+window.onresize = draw;
+draw();
+</script>
+</body>
+</html>
+"""
+
+
+def write_viewer(info, fname):
+    open(fname, 'w').write(viewer_html.replace('INFO', json.dumps(info)))
+
+
+if __name__ == '__main__':
+    outdir = '_output'
+    tiledir = '_tiles'
+    nprocs = None
+    if len(sys.argv) > 1:
+        outdir = sys.argv[1]
+    if len(sys.argv) > 2:
+        tiledir = sys.argv[2]
+    if len(sys.argv) > 3:
+        nprocs = int(sys.argv[3])
+    ntiles = make_tiles(outdir, tiledir, nprocs)
+    print "Wrote %s tiles, open %s" % (ntiles,
+                                       os.path.join(tiledir, 'viewer.html'))
@@ -0,0 +1,218 @@
+"""
+Binary cache for ASCII topography files such as java.asc.
+
+The first read of a topo file parses the text and writes the elevations
+to a sidecar fname.cache.npy, with the header, the size, mtime and
+SHA-1 hash of the text file in fname.cache.npz.  Later reads check the
+size and mtime (and, if only the mtime changed, the hash) and then
+memory-map the .npy file instead of parsing the text again.
+
+The functions topoheaderread and topofile2griddata have the same
+arguments and results as those in pyclaw.geotools.topotools, for
+topotype 1, 2 or 3 files:
+    >>> import topocache
+    >>> X, Y, Z = topocache.topofile2griddata('java.asc', topotype=3)
+
+To make topotools itself use the cache:
+    >>> topocache.install()
+
+To build the caches for all topofiles of setrun.py:
+    $ python topocache.py
+
+"""
+
+import os
+import hashlib
+import numpy as np
+
+_header_keys = ['ncols', 'nrows', 'xll', 'yll', 'cellsize', 'nodata_value']
+
+
+def file_hash(fname, blocksize=2**20):
+    """
+    SHA-1 hash of the contents of fname.
+    """
+    sha = hashlib.sha1()
+    f = open(fname, 'rb')
+    while True:
+        block = f.read(blocksize)
+        if not block:
+            break
+        sha.update(block)
+    f.close()
+    return sha.hexdigest()
+
+
+def cache_fnames(fname, cachedir=None):
+    """
+    Names of the data and header files of the cache of fname.
+    """
+    if cachedir is not None:
+        fname = os.path.join(cachedir, os.path.basename(fname))
+    return fname + '.cache.npy', fname + '.cache.npz'
+
+
+def topoheaderread(inputfile):
+    """
+    Read the 6 line header of a topotype 2 or 3 file and return a
+    dictionary with keys ncols, nrows, xll, yll, cellsize, nodata_value.
+    Each line is either value first, as in java.asc, or keyword first, as
+    in ESRI files (ncols 961).
+    """
+    f = open(inputfile)
+    values = []
+    for i in range(6):
+        tokens = f.readline().split()
+        try:
+            float(tokens[0].replace('D', 'E'))
+            values.append(tokens[0])
+        except ValueError:
+            values.append(tokens[1])
+    f.close()
+    topoheader = {}
+    for key, value in zip(_header_keys, values):
+        value = value.replace('D', 'E')
+        if key in ['ncols', 'nrows']:
+            topoheader[key] = int(float(value))
+        else:
+            topoheader[key] = float(value)
+    return topoheader
+
+
+def parse_topofile(inputfile, topotype=2):
+    """
+    Parse a topo file and return (topoheader, Z), where Z has shape
+    (nrows, ncols) with the first row the northern edge, as in the file.
+    """
+    if topotype == 1:
+        xyz = np.loadtxt(inputfile)
+        x = np.unique(xyz[:, 0])
+        y = np.unique(xyz[:, 1])
+        ncols, nrows = len(x), len(y)
+        if ncols*nrows != xyz.shape[0]:
+            raise IOError("%s is not a complete topotype 1 grid" % inputfile)
+        topoheader = {'ncols': ncols, 'nrows': nrows,
+                      'xll': x[0], 'yll': y[0],
+                      'cellsize': (x[-1] - x[0])/max(ncols-1, 1),
+                      'nodata_value': -9999.}
+        # place each value by its coordinates, north to south:
+        i = np.searchsorted(x, xyz[:, 0])
+        j = nrows - 1 - np.searchsorted(y, xyz[:, 1])
+        Z = np.empty((nrows, ncols))
+        Z[j, i] = xyz[:, 2]
+    elif topotype in [2, 3]:
+        topoheader = topoheaderread(inputfile)
+        f = open(inputfile, 'rb')
+        for i in range(6):
+            f.readline()
+        text = f.read()
+        f.close()
+        Z = np.fromstring(text.replace(b'D', b'E'), sep=' ')
+        nrows, ncols = topoheader['nrows'], topoheader['ncols']
+        if Z.size != nrows*ncols:
+            raise IOError("%s has %s values, expected %s" \
+                          % (inputfile, Z.size, nrows*ncols))
+        Z = Z.reshape((nrows, ncols))
+    else:
+        raise ValueError("Unrecognized topotype %s" % topotype)
+    return topoheader, Z
+
+
+def write_cache(inputfile, topotype, topoheader, Z, cachedir=None):
+    dataname, metaname = cache_fnames(inputfile, cachedir)
+    np.save(dataname, Z)
+    np.savez(metaname, topotype=topotype,
+             header=np.array([topoheader[key] for key in _header_keys]),
+             size=os.path.getsize(inputfile),
+             mtime=os.path.getmtime(inputfile),
+             sha1=file_hash(inputfile))
+
+
+def read_cache(inputfile, topotype, cachedir=None, mmap_mode='r'):
+    """
+    Return (topoheader, Z) from the cache of inputfile, with Z memory-mapped
+    with mmap_mode, or None if there is no valid cache.
+    """
+    dataname, metaname = cache_fnames(inputfile, cachedir)
+    if not (os.path.exists(dataname) and os.path.exists(metaname)):
+        return None
+    meta = np.load(metaname)
+    if int(meta['topotype']) != topotype or \
+            int(meta['size']) != os.path.getsize(inputfile):
+        return None
+    mtime = os.path.getmtime(inputfile)
+    if float(meta['mtime']) != mtime:
+        # file touched or copied, compare contents:
+        if str(meta['sha1']) != file_hash(inputfile):
+            return None
+        arrays = dict([(key, meta[key]) for key in meta.files])
+        arrays['mtime'] = mtime
+        np.savez(metaname, **arrays)
+    topoheader = {}
+    for key, value in zip(_header_keys, meta['header']):
+        topoheader[key] = value
+    topoheader['ncols'] = int(topoheader['ncols'])
+    topoheader['nrows'] = int(topoheader['nrows'])
+    Z = np.load(dataname, mmap_mode=mmap_mode)
+    return topoheader, Z
+
+
+def read_topo(inputfile, topotype=2, cachedir=None, mmap_mode='r'):
+    """
+    Return (topoheader, Z) for inputfile, from the cache if it is valid and
+    otherwise by parsing the file and creating the cache.
+    """
+    cached = read_cache(inputfile, topotype, cachedir, mmap_mode)
+    if cached is not None:
+        return cached
+    topoheader, Z = parse_topofile(inputfile, topotype)
+    try:
+        write_cache(inputfile, topotype, topoheader, Z, cachedir)
+    except IOError:
+        print "*** Could not write topo cache for %s" % inputfile
+    return topoheader, Z
+
+
+def topofile2griddata(inputfile, topotype=2, cachedir=None):
+    """
+    Return X, Y, Z arrays of shape (nrows, ncols) for the topo file,
+    with the first row at the northern edge.  Z may be changed in place,
+    as Z of topotools can: a cached Z is mapped copy-on-write.
+    """
+    topoheader, Z = read_topo(inputfile, topotype, cachedir, mmap_mode='c')
+    ncols, nrows = topoheader['ncols'], topoheader['nrows']
+    xll, yll = topoheader['xll'], topoheader['yll']
+    cellsize = topoheader['cellsize']
+    x = np.linspace(xll, xll + (ncols-1)*cellsize, ncols)
+    y = np.linspace(yll + (nrows-1)*cellsize, yll, nrows)
+    X, Y = np.meshgrid(x, y)
+    return X, Y, Z
+
+
+def read_topofiles(topofiles, cachedir=None):
+    """
+    Read every file in a geodata.topofiles list, whose entries are
+    [topotype, minlevel, maxlevel, t1, t2, fname].
+    Returns a list of (topoheader, Z).
+    """
+    return [read_topo(topofile[5], int(topofile[0]), cachedir)
+            for topofile in topofiles]
+
+
+def install():
+    """
+    Replace topofile2griddata in pyclaw.geotools.topotools by the cached
+    version, so existing scripts use the cache without changes.
+    """
+    from pyclaw.geotools import topotools
+    topotools.topofile2griddata = topofile2griddata
+
+
+if __name__ == '__main__':
+    import setrun
+    rundata = setrun.setrun()
+    for topofile in rundata.geodata.topofiles:
+        topoheader, Z = read_topo(topofile[5], int(topofile[0]))
+        print "%s: %s x %s, cached in %s" \
+              % (topofile[5], topoheader['ncols'], topoheader['nrows'],
+                 cache_fnames(topofile[5])[0])
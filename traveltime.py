@@ -0,0 +1,257 @@
+"""
+Tsunami travel times from the bathymetry, to set the time windows of the
+gauges and regions.
+
+The arrival time T solves the eikonal equation |grad T| = 1/c with the
+shallow water speed c = sqrt(g*h) over the depths h of a topo file, and
+is computed with the first order fast marching method on its lat-long
+grid (optionally subsampled by stride).  T = 0 on the source, the cells
+where the dtopo deformation exceeds a fraction of its maximum, and cells
+shallower than hmin are not crossed.
+
+For each gauge the arrival time is the earliest over the wet cells within
+search cells of it, and for each region the earliest over its wet cells.
+The gauge windows become
+    t1 = max(0, (1 - margin_fraction)*arrival - margin)
+    t2 = t1 + duration       (if duration is given, t2 is kept otherwise)
+and the regions allowing levels above coarse_level get the same t1, so
+they are not refined before the wave can get there.  Gauges and regions
+outside the topo file are left as they are.
+
+To use:
+    $ python traveltime.py                 # from setrun.py
+    $ python traveltime.py _output         # from the data files in _output
+    $ python traveltime.py setrun write    # set the windows in the data files
+
+"""
+
+import sys, heapq
+import numpy as np
+
+import regioncheck
+
+grav = 9.81
+
+
+def read_dtopo(fname):
+    """
+    Read a dtopotype 3 file and return x, y and the deformation dz at the
+    last time, with dz[j,i] at (x[i], y[j]) and y increasing.
+    """
+    f = open(fname)
+    header = [f.readline().split()[0] for i in range(9)]
+    mx, my, mt = [int(v) for v in header[:3]]
+    xlower, ylower, t0, dx, dy, dt = [float(v.replace('D', 'E'))
+                                      for v in header[3:]]
+    dz = np.fromstring(f.read().replace('D', 'E'), sep=' ')
+    f.close()
+    if dz.size != mx*my*mt:
+        raise IOError("%s has %s values, expected %s" % (fname, dz.size,
+                                                         mx*my*mt))
+    # rows of each time are written from north to south:
+    dz = dz.reshape((mt, my, mx))[-1, ::-1, :]
+    return xlower + dx*np.arange(mx), ylower + dy*np.arange(my), dz
+
+
+def topo_grid(fname, topotype=3, stride=1):
+    """
+    Return x, y and the depths h (positive below sea level) of a topo file,
+    with h[j,i] at (x[i], y[j]) and y increasing, taking every stride'th
+    point.
+    """
+    import topocache
+    header, Z = topocache.read_topo(fname, topotype)
+    nrows, ncols = Z.shape
+    x = header['xll'] + header['cellsize']*np.arange(ncols)
+    y = header['yll'] + header['cellsize']*np.arange(nrows)
+    h = -np.asarray(Z[::-1, :])
+    return x[::stride], y[::stride], h[::stride, ::stride]
+
+
+def source_mask(x, y, dtopofiles, fraction=0.05, datadir=None):
+    """
+    Boolean array on the grid x, y true where the deformation of one of
+    the dtopofiles is more than fraction times its largest magnitude.
+    """
+    mask = np.zeros((len(y), len(x)), dtype=bool)
+    for dtopofile in dtopofiles:
+        fname = regioncheck.input_fname(dtopofile[-1], datadir)
+        if fname is None:
+            raise IOError("dtopo file %s not found" % dtopofile[-1])
+        xd, yd, dz = read_dtopo(fname)
+        big = np.abs(dz) > fraction*np.abs(dz).max()
+        # nearest point of the dtopo grid to each grid point inside it:
+        ix = np.round((x - xd[0])/(xd[1] - xd[0])).astype(int)
+        iy = np.round((y - yd[0])/(yd[1] - yd[0])).astype(int)
+        okx = (ix >= 0) & (ix < len(xd))
+        oky = (iy >= 0) & (iy < len(yd))
+        sub = big[np.ix_(iy[oky], ix[okx])]
+        mask[np.ix_(np.where(oky)[0], np.where(okx)[0])] |= sub
+    return mask
+
+
+def fast_march(x, y, h, source, hmin=1., Rearth=6367.5e3):
+    """
+    Arrival times (s) on the grid x, y of depths h from T = 0 on source,
+    inf where not reached, on a sphere of radius Rearth.
+    """
+    deg2m = Rearth*np.pi/180.
+    my, mx = h.shape
+    speed = np.sqrt(grav*np.maximum(h, 0.))
+    wet = h > hmin
+    dy = (y[1] - y[0])*deg2m
+    dxs = (x[1] - x[0])*deg2m*np.cos(np.radians(y))
+    T = np.inf*np.ones((my, mx))
+    done = np.zeros((my, mx), dtype=bool)
+    heap = []
+    for j, i in zip(*np.where(source & wet)):
+        T[j, i] = 0.
+        heap.append((0., j, i))
+    heapq.heapify(heap)
+
+    while heap:
+        t, j, i = heapq.heappop(heap)
+        if done[j, i]:
+            continue
+        done[j, i] = True
+        for jn, inn in ((j-1, i), (j+1, i), (j, i-1), (j, i+1)):
+            if jn < 0 or jn >= my or inn < 0 or inn >= mx or \
+                    done[jn, inn] or not wet[jn, inn]:
+                continue
+            # smallest known neighbour time in each direction:
+            a = min(T[jn, inn-1] if inn > 0 else np.inf,
+                    T[jn, inn+1] if inn < mx-1 else np.inf)
+            b = min(T[jn-1, inn] if jn > 0 else np.inf,
+                    T[jn+1, inn] if jn < my-1 else np.inf)
+            dx = dxs[jn]
+            s = 1./speed[jn, inn]
+            tn = min(a + s*dx, b + s*dy)
+            if a < np.inf and b < np.inf:
+                # both directions upwind if the quadratic allows it:
+                wx, wy = 1./dx**2, 1./dy**2
+                p = wx + wy
+                q = a*wx + b*wy
+                disc = q*q - p*(a*a*wx + b*b*wy - s*s)
+                if disc >= 0.:
+                    t2 = (q + np.sqrt(disc))/p
+                    if t2 >= max(a, b):
+                        tn = min(tn, t2)
+            if tn < T[jn, inn]:
+                T[jn, inn] = tn
+                heapq.heappush(heap, (tn, jn, inn))
+    return T
+
+
+def arrival_at(x, y, T, xp, yp, search=3):
+    """
+    Earliest arrival within search cells of the point (xp, yp), or None if
+    it is outside the grid or no wet cell near it is reached.
+    """
+    if not (x[0] <= xp <= x[-1] and y[0] <= yp <= y[-1]):
+        return None
+    i = int(round((xp - x[0])/(x[1] - x[0])))
+    j = int(round((yp - y[0])/(y[1] - y[0])))
+    t = T[max(j-search, 0):j+search+1, max(i-search, 0):i+search+1].min()
+    if np.isinf(t):
+        return None
+    return t
+
+
+def arrival_in(x, y, T, box):
+    """
+    Earliest arrival in box [x1,x2,y1,y2], or None.
+    """
+    ix = np.where((x >= box[0]) & (x <= box[1]))[0]
+    iy = np.where((y >= box[2]) & (y <= box[3]))[0]
+    if len(ix) == 0 or len(iy) == 0:
+        return None
+    t = T[iy[0]:iy[-1]+1, ix[0]:ix[-1]+1].min()
+    if np.isinf(t):
+        return None
+    return t
+
+
+def travel_times(config, stride=1, fraction=0.05, hmin=1.):
+    """
+    Return x, y and the arrival times T on the grid of the first topo file
+    of config that is found.
+    """
+    for topofile in config['topofiles']:
+        fname = regioncheck.input_fname(topofile[-1], config.get('datadir'))
+        if fname is not None:
+            break
+    else:
+        raise IOError("None of the topo files was found")
+    x, y, h = topo_grid(fname, int(topofile[0]), stride)
+    source = source_mask(x, y, config['dtopofiles'], fraction,
+                         config.get('datadir'))
+    if not source.any():
+        print "*** Warning: the dtopo deformation is outside %s" % fname
+    return x, y, fast_march(x, y, h, source, hmin,
+                            config.get('Rearth', 6367.5e3))
+
+
+def windows(config, x, y, T, margin=600., margin_fraction=0.1,
+            duration=None, coarse_level=3, search=3):
+    """
+    Return the gauges and regions of config with their time windows set
+    from the arrival times, and a list of (name, arrival) for the report.
+    """
+    def start(arrival):
+        return max(0., (1. - margin_fraction)*arrival - margin)
+
+    arrivals = []
+    gauges = []
+    for gauge in config['gauges']:
+        gauge = list(gauge)
+        arrival = arrival_at(x, y, T, gauge[1], gauge[2], search)
+        arrivals.append(('gauge %d' % gauge[0], arrival))
+        if arrival is not None:
+            gauge[3] = start(arrival)
+            if duration is not None:
+                gauge[4] = gauge[3] + duration
+        gauges.append(gauge)
+    regions = []
+    for k, region in enumerate(config['regions']):
+        region = list(region)
+        if region[1] > coarse_level:
+            arrival = arrival_in(x, y, T, region[4:8])
+            arrivals.append(('region %d' % (k+1), arrival))
+            if arrival is not None:
+                region[2] = max(region[2], start(arrival))
+        regions.append(region)
+    return gauges, regions, arrivals
+
+
+def apply_windows(rundata, gauges, regions):
+    """
+    Set the gauges and regions in rundata.geodata.
+    """
+    rundata.geodata.gauges = [list(g) for g in gauges]
+    rundata.geodata.regions = [list(r) for r in regions]
+    return rundata
+
+
+if __name__ == '__main__':
+    datadir = None
+    if len(sys.argv) > 1 and sys.argv[1] != 'setrun':
+        datadir = sys.argv[1]
+    config = regioncheck.load_config(datadir)
+    x, y, T = travel_times(config)
+    gauges, regions, arrivals = windows(config, x, y, T)
+    for name, arrival in arrivals:
+        if arrival is None:
+            print "%-10s  not reached or outside the topo" % name
+        else:
+            print "%-10s  arrival %8.0f s = %5.2f h" % (name, arrival,
+                                                         arrival/3600.)
+    for gauge in gauges:
+        print "    geodata.gauges.append([%d, %.3f, %.3f, %g, %g])" \
+              % tuple(gauge)
+    for region in regions:
+        print "    geodata.regions.append(%s)" \
+              % regioncheck.format_region(region)
+    if len(sys.argv) > 2 and sys.argv[2] == 'write':
+        import setrun, datawrite
+        datawrite.write_changed(apply_windows(setrun.setrun(), gauges,
+                                              regions))